@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+# Level of the subject and category dimensions holding the totals over all subjects or categories
+ALL = "All"
+# Category of scripts that have no result under a condition, e.g. scripts RaaS never ran
+NO_CATEGORY = "no result"
+DIMENSIONS = ["condition", "year", "subject", "category", "timed_out"]
+
+# Count the scripts of one condition (e.g. without or with RaaS) and their datasets by year, subject,
+# error category and whether the dataset timed out. scripts_df needs doi_id and category_col,
+# datasets_by_id_df is indexed by doi_id and has the year and the subjects mask of subject_table, and
+# timed_out is a boolean series indexed by doi_id. The scripts are grouped once by dataset and
+# category; everything after that works on datasets.
+def build_condition_cube(condition, scripts_df, category_col, datasets_by_id_df, timed_out, subject_table):
+    categories = scripts_df[category_col].astype(object)
+    scripts = pd.DataFrame({"doi_id": scripts_df["doi_id"].to_numpy(),
+                            "category": categories.where(categories.notna(), NO_CATEGORY).to_numpy()})
+    per_dataset_df = scripts.groupby(["doi_id", "category"]).size().rename("scripts").reset_index()
+    dataset_totals_df = per_dataset_df.groupby("doi_id")["scripts"].sum().reset_index()
+    dataset_totals_df["category"] = ALL
+    per_dataset_df = pd.concat([per_dataset_df, dataset_totals_df], ignore_index=True)
+
+    per_dataset_df["year"] = per_dataset_df["doi_id"].map(datasets_by_id_df["year"])
+    per_dataset_df["timed_out"] = per_dataset_df["doi_id"].map(timed_out).fillna(False).astype(bool)
+
+    # A dataset is counted under each of its subjects and once under ALL
+    positions, subjects = subject_table.memberships(datasets_by_id_df["subjects"])
+    subjects_df = pd.DataFrame({"doi_id": datasets_by_id_df.index[positions], "subject": subjects})
+    subjects_df = pd.concat([subjects_df, pd.DataFrame({"doi_id": per_dataset_df["doi_id"].unique(), "subject": ALL})], ignore_index=True)
+    per_dataset_df = per_dataset_df.merge(subjects_df, on="doi_id")
+
+    cube_df = per_dataset_df.groupby(DIMENSIONS[1:], dropna=False).agg(scripts=("scripts", "sum"), datasets=("doi_id", "size"))
+    cube_df = cube_df.astype(np.int32)
+    cube_df = pd.concat({condition: cube_df}, names=["condition"])
+    return(AggregationCube(cube_df))
+
+class AggregationCube:
+    '''
+    Script and dataset counts by condition, year, subject, error category and whether the dataset
+    timed out. Tables and figures take slices of it with aggregate instead of filtering the script
+    dataframes once per year or subject. A dataset can have several subjects and scripts in several
+    categories, so those two dimensions have an ALL level with the true totals, and dataset counts
+    only add up over years and timed_out, not over subjects or categories.
+    '''
+    def __init__(self, cube_df):
+        self.cube_df = cube_df
+
+    # A cube holding the conditions of both cubes
+    def combine(self, other):
+        return(AggregationCube(pd.concat([self.cube_df, other.cube_df]).sort_index()))
+
+    # Sum the counts by the dimensions in `by`, keeping only the cells matching `where` (a value or
+    # a list of values per dimension). Subject and category are taken at their ALL level unless
+    # they are grouped by or selected. Cells with an unknown year are dropped when grouping by year.
+    def aggregate(self, by, **where):
+        by = list(by)
+        for dimension in where:
+            if dimension not in DIMENSIONS:
+                raise KeyError("unknown dimension " + dimension)
+        for dimension in ["subject", "category"]:
+            if dimension not in by and dimension not in where:
+                where[dimension] = ALL
+        mask = np.ones(len(self.cube_df.index), dtype=bool)
+        for dimension, value in where.items():
+            values = value if isinstance(value, list) else [value]
+            mask &= self.cube_df.index.get_level_values(dimension).isin(values)
+        for dimension in ["subject", "category"]:
+            if dimension in by:
+                mask &= self.cube_df.index.get_level_values(dimension) != ALL
+        return(self.cube_df[mask].groupby(level=by).sum())
+
+    # Scripts per value of `by` split into successes and the rest, as n_success and n_error
+    def success_counts(self, by, **where):
+        totals = self.aggregate([by], **where)["scripts"]
+        successes = self.aggregate([by], category="success", **where)["scripts"].reindex(totals.index, fill_value=0)
+        return(pd.DataFrame({"n_success": successes, "n_error": totals - successes}))
@@ -0,0 +1,68 @@
+import argparse
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from compact_schema import SubjectTable, compact_subjects, categorize_columns, memory_report
+from error_classifier import classify_errors
+from helper_functions import get_doi_from_results_filename_v
+from metadata_store import open_metadata_store
+
+# Report the memory used by the script, dataset and joined dataframes with plain strings and a
+# boolean column per subject, and with the compact schema (categorical error messages and
+# categories, one subject mask per dataset). Runs on the data in results.db and doi_metadata, and
+# on a synthetic corpus made of copies of it where every copy gets its own DOIs.
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--copies', type=int, default=100, help="size of the synthetic corpus in copies of the bundled data")
+args = parser.parse_args()
+
+con = sqlite3.connect("../data/results.db")
+results_df = pd.read_sql_query("SELECT filename, error FROM results", con)
+con.close()
+results_df["doi"] = get_doi_from_results_filename_v(results_df["filename"])
+
+metadata_store = open_metadata_store("../data/doi_metadata.db", seed_json="../data/doi_metadata.json")
+subject_table = SubjectTable(metadata_store.subjects())
+metadata_df = metadata_store.datasets_df()
+metadata_store.close()
+
+# Copy the scripts and datasets, appending the copy number to every DOI
+def replicate(df, copies):
+    if copies == 1:
+        return(df.copy())
+    df = pd.concat([df] * copies, ignore_index=True)
+    copy = np.repeat(np.arange(copies), len(df.index) // copies).astype(str)
+    df["doi"] = df["doi"].to_numpy().astype(object) + "." + copy
+    return(df)
+
+def plain_frames(results_df, metadata_df):
+    scripts_df = pd.DataFrame({"doi": results_df["doi"].to_numpy(),
+                               "nr_error": results_df["error"].to_numpy(),
+                               "nr_error_category": np.asarray(classify_errors(results_df["error"]), dtype=object)})
+    dataset_df = metadata_df.copy()
+    overall_df = scripts_df.merge(dataset_df, on="doi", how="left")
+    return({"scripts_df": scripts_df, "dataset_df": dataset_df, "overall_df": overall_df})
+
+def compact_frames(results_df, metadata_df):
+    scripts_df = pd.DataFrame({"doi": results_df["doi"].to_numpy(),
+                               "nr_error": results_df["error"].to_numpy(),
+                               "nr_error_category": classify_errors(results_df["error"])})
+    scripts_df = categorize_columns(scripts_df, ["nr_error"])
+    dataset_df = compact_subjects(metadata_df.copy(), subject_table)
+    overall_df = scripts_df.merge(dataset_df, on="doi", how="left")
+    return({"scripts_df": scripts_df, "dataset_df": dataset_df, "overall_df": overall_df})
+
+for copies in [1, args.copies]:
+    corpus_results_df = replicate(results_df, copies)
+    corpus_metadata_df = replicate(metadata_df, copies)
+    before = memory_report(plain_frames(corpus_results_df, corpus_metadata_df))
+    after = memory_report(compact_frames(corpus_results_df, corpus_metadata_df))
+    report_df = pd.DataFrame({"rows": before["rows"],
+                              "before MiB": before["bytes"] / 2 ** 20,
+                              "after MiB": after["bytes"] / 2 ** 20,
+                              "saved": 1 - after["bytes"] / before["bytes"]})
+    print("bundled data" if copies == 1 else "synthetic corpus ({0}x)".format(copies))
+    print(report_df.to_string(float_format=lambda value: "{0:.2f}".format(value)))
+    print("")
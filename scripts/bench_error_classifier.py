@@ -0,0 +1,52 @@
+import argparse
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from error_classifier import classify_errors
+from helper_functions import determine_error_cause_v
+
+# Benchmark the compiled error classifier against determine_error_cause_v on a synthetic
+# corpus built by resampling the error messages collected in results.db and timed_results.db,
+# once as resampled and once with every message made distinct
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--messages', type=int, default=1000000)
+parser.add_argument('--baseline-messages', type=int, default=100000)
+parser.add_argument('--seed', type=int, default=0)
+args = parser.parse_args()
+
+error_msgs = []
+for db_file in ["../data/results.db", "../data/timed_results.db"]:
+    con = sqlite3.connect(db_file)
+    error_msgs = error_msgs + [row[0] for row in con.execute("SELECT error FROM results")]
+    con.close()
+error_msgs = np.array(error_msgs, dtype=object)
+
+rng = np.random.default_rng(args.seed)
+resampled = error_msgs[rng.integers(0, len(error_msgs), args.messages)]
+# The resampled corpus repeats the same few thousand messages, so the classifier mostly looks up
+# messages it has seen. Numbering every message makes each one distinct and measures the scan itself.
+distinct = np.array([msg + "\n(message " + str(idx) + ")" for idx, msg in enumerate(resampled)], dtype=object)
+
+for name, corpus in [("resampled", resampled), ("distinct", distinct)]:
+    baseline_corpus = corpus[:args.baseline_messages]
+
+    start = time.perf_counter()
+    baseline_labels = determine_error_cause_v(baseline_corpus)
+    baseline_secs = time.perf_counter() - start
+
+    start = time.perf_counter()
+    labels = classify_errors(corpus)
+    compiled_secs = time.perf_counter() - start
+
+    if not (np.asarray(labels[:args.baseline_messages], dtype=object) == baseline_labels).all():
+        raise SystemExit("Compiled classifier disagrees with determine_error_cause on the " + name + " corpus")
+
+    print("{0} corpus, {1:,} distinct messages".format(name, len(pd.unique(corpus))))
+    print("  determine_error_cause_v: {0:,} messages in {1:.2f}s ({2:,.0f} msgs/s)".format(len(baseline_corpus), baseline_secs, len(baseline_corpus) / baseline_secs))
+    print("  classify_errors:         {0:,} messages in {1:.2f}s ({2:,.0f} msgs/s)".format(len(corpus), compiled_secs, len(corpus) / compiled_secs))
+    print("  speedup: {0:.1f}x".format((len(corpus) / compiled_secs) / (len(baseline_corpus) / baseline_secs)))
+print(labels.value_counts().to_string())
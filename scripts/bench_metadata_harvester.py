@@ -0,0 +1,134 @@
+import os
+import json
+import argparse
+import tempfile
+import threading
+
+from collections import Counter
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+from metadata_harvester import MetadataHarvester
+from metadata_store import MetadataStore
+
+# Run MetadataHarvester against a local stub of the Dataverse API and check how every kind of
+# response is handled: retries on 503, permanent errors, bodies that are not JSON, a redirect loop,
+# duplicate DOIs in the input, and a second run resuming from the progress file or the store.
+
+# How the stub answers each DOI. "flaky" fails with 503 FLAKY_FAILURES times and then succeeds.
+FLAKY_FAILURES = 2
+EXPECTED = {
+    "doi:10.0000/ok": None,
+    "doi:10.0000/no-version": None,
+    "doi:10.0000/flaky": None,
+    "doi:10.0000/down": "HTTP 503",
+    "doi:10.0000/missing": "Possible incorrect permissions: Dataset not found",
+    "doi:10.0000/html": "Unexpected response",
+    "doi:10.0000/loop": "TooManyRedirects",
+}
+
+def dataset_json(subjects):
+    dataset = {"publicationDate": "2021-05-04"}
+    if subjects is not None:
+        dataset["latestVersion"] = {"metadataBlocks": {"citation": {"fields": [{"typeName": "subject", "value": subjects}]}}}
+    return({"status": "OK", "data": dataset})
+
+class StubDataverse(BaseHTTPRequestHandler):
+    requests_seen = Counter()
+    lock = threading.Lock()
+
+    def send(self, status, body, content_type="application/json", headers={}):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        doi = parse_qs(urlparse(self.path).query)["persistentId"][0]
+        with self.lock:
+            self.requests_seen[doi] += 1
+            seen = self.requests_seen[doi]
+        name = doi.split("/")[-1]
+        if name == "ok":
+            self.send(200, json.dumps(dataset_json(["Social Sciences"])))
+        elif name == "no-version":
+            self.send(200, json.dumps(dataset_json(None)))
+        elif name == "flaky":
+            if seen <= FLAKY_FAILURES:
+                self.send(503, "Service Unavailable", "text/plain")
+            else:
+                self.send(200, json.dumps(dataset_json(["Physics"])))
+        elif name == "down":
+            self.send(503, "Service Unavailable", "text/plain")
+        elif name == "missing":
+            self.send(404, json.dumps({"status": "ERROR", "message": "Dataset not found"}))
+        elif name == "html":
+            self.send(200, "<html><body>Maintenance</body></html>", "text/html")
+        elif name == "loop":
+            self.send(302, "", "text/plain", {"Location": self.path})
+
+    def log_message(self, format, *args):
+        pass
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+    print("ok   " + message)
+
+def check_records(records, label):
+    for doi, error in EXPECTED.items():
+        record = records[doi]
+        if error is None:
+            check(record["error"] is None, label + ": " + doi + " harvested")
+        else:
+            check(record["error"] is not None and error in record["error"],
+                  label + ": " + doi + " failed with " + repr(record["error"]))
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--max-attempts', type=int, default=4)
+args = parser.parse_args()
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), StubDataverse)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+api_url = "http://127.0.0.1:" + str(server.server_address[1]) + "/api/"
+
+# Every DOI once, the good one three times over, and the list's trailing newlines kept
+doi_lines = [doi + "\n" for doi in EXPECTED] + ["doi:10.0000/ok\n", " doi:10.0000/ok\n"]
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+    progress_path = os.path.join(tmp_dir, "progress.jsonl")
+    store = MetadataStore(os.path.join(tmp_dir, "doi_metadata.db"))
+    for label, options in [("progress file", {"progress_path": progress_path}), ("store", {"store": store})]:
+        StubDataverse.requests_seen.clear()
+        harvester = MetadataHarvester(api_url=api_url, concurrency=4, rate=None, timeout=5,
+                                      max_attempts=args.max_attempts, backoff_base=0.01, backoff_max=0.05, **options)
+        records = harvester.harvest(doi_lines, verbose=False)
+        check_records(records, label)
+        check(records["doi:10.0000/ok"]["subjects"] == ["Social Sciences"], label + ": subjects parsed")
+        check(records["doi:10.0000/no-version"]["subjects"] is None, label + ": no latestVersion gives no subjects")
+        seen = StubDataverse.requests_seen
+        check(seen["doi:10.0000/ok"] == 1, label + ": duplicate DOIs requested once")
+        check(seen["doi:10.0000/flaky"] == FLAKY_FAILURES + 1, label + ": 503 retried until it succeeded")
+        check(seen["doi:10.0000/down"] == args.max_attempts, label + ": 503 retried max_attempts times")
+        check(seen["doi:10.0000/missing"] == 1, label + ": permanent error not retried")
+        check(seen["doi:10.0000/html"] == 1, label + ": non-JSON body not retried")
+        # Every redirect followed is a request of its own; a retry would follow them all again
+        check(seen["doi:10.0000/loop"] == requests.Session().max_redirects + 1, label + ": redirect loop not retried")
+
+        # A second run only asks again for the DOIs that failed
+        StubDataverse.requests_seen.clear()
+        records = harvester.harvest(doi_lines, verbose=False)
+        failed = set(doi for doi, error in EXPECTED.items() if error is not None)
+        check(set(StubDataverse.requests_seen) == failed, label + ": second run requests only the failed DOIs")
+        if "progress_path" in options:
+            check_records(records, label + " resumed")
+    store.close()
+
+server.shutdown()
+print("All checks passed")
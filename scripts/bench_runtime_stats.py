@@ -0,0 +1,73 @@
+import json
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from compact_schema import SubjectTable, compact_subjects
+from metadata_store import open_metadata_store
+from runtime_stats import RuntimeSummary, TIMEOUT_SECONDS
+
+# Benchmark the runtime sketches against exact quantiles computed with pandas on a synthetic
+# campaign: the years and subjects of the datasets in doi_metadata resampled, with log-normal
+# runtimes capped at the timeout. The datasets are split between VMs that each summarize their
+# own, and the partial summaries are merged after a round trip through JSON.
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--datasets', type=int, default=1000000)
+parser.add_argument('--vms', type=int, default=8)
+parser.add_argument('--accuracy', type=float, default=0.01)
+parser.add_argument('--seed', type=int, default=0)
+args = parser.parse_args()
+
+metadata_store = open_metadata_store("../data/doi_metadata.db", seed_json="../data/doi_metadata.json")
+subject_table = SubjectTable(metadata_store.subjects())
+metadata_df = compact_subjects(metadata_store.datasets_df(), subject_table)
+metadata_store.close()
+
+rng = np.random.default_rng(args.seed)
+sample = rng.integers(0, len(metadata_df.index), args.datasets)
+nr_time = rng.lognormal(4, 1.5, args.datasets)
+raas_time = nr_time * rng.lognormal(1.5, 1, args.datasets) + rng.lognormal(6, 1, args.datasets)
+datasets_df = pd.DataFrame({"year": metadata_df["year"].to_numpy()[sample],
+                            "subjects": metadata_df["subjects"].to_numpy()[sample],
+                            "nr_time": nr_time, "nr_timed_out": nr_time > TIMEOUT_SECONDS,
+                            "raas_time": raas_time, "raas_timed_out": raas_time > TIMEOUT_SECONDS})
+
+start = time.perf_counter()
+partials = [json.dumps(RuntimeSummary(args.accuracy).add(datasets_df.iloc[vm_rows[0]:vm_rows[-1] + 1], subject_table).to_dict())
+            for vm_rows in np.array_split(np.arange(len(datasets_df.index)), args.vms) if len(vm_rows) > 0]
+summarize_secs = time.perf_counter() - start
+start = time.perf_counter()
+summary = RuntimeSummary(args.accuracy)
+for partial in partials:
+    summary.merge(RuntimeSummary.from_dict(json.loads(partial)))
+merge_secs = time.perf_counter() - start
+
+# The same statistics computed exactly from the raw runtimes, taking the value at the rank a sketch
+# reads instead of interpolating between two values
+start = time.perf_counter()
+quantiles = [0.5, 0.9, 0.99]
+capped_df = datasets_df.assign(nr_time=datasets_df["nr_time"].clip(upper=TIMEOUT_SECONDS), raas_time=datasets_df["raas_time"].clip(upper=TIMEOUT_SECONDS))
+exact = {condition: capped_df[prefix + "_time"].quantile(quantiles, interpolation="lower").to_numpy() for condition, prefix in [("control", "nr"), ("treatment", "raas")]}
+completed_df = capped_df[(capped_df["nr_time"] < TIMEOUT_SECONDS) & (capped_df["raas_time"] < TIMEOUT_SECONDS)]
+ratios = completed_df["raas_time"] / completed_df["nr_time"]
+exact["ratio"] = ratios.quantile(quantiles, interpolation="lower").to_numpy()
+exact_by_year = ratios.groupby(completed_df["year"]).quantile(0.9, interpolation="lower")
+positions, subjects = subject_table.memberships(completed_df["subjects"].to_numpy())
+exact_by_subject = pd.Series(ratios.to_numpy()[positions]).groupby(subjects).quantile(0.9, interpolation="lower")
+exact_secs = time.perf_counter() - start
+
+sketched = {"control": summary.runtimes["control"].quantile(quantiles), "treatment": summary.runtimes["treatment"].quantile(quantiles),
+            "ratio": summary.ratios.quantile(quantiles)}
+errors = {name: np.abs(sketched[name] / exact[name] - 1).max() for name in exact}
+errors["ratio p90 by year"] = np.abs(summary.ratio_table("year")["p90"].reindex(exact_by_year.index.astype(int)).to_numpy() / exact_by_year.to_numpy() - 1).max()
+errors["ratio p90 by subject"] = np.abs(summary.ratio_table("subject")["p90"].reindex(exact_by_subject.index).to_numpy() / exact_by_subject.to_numpy() - 1).max()
+
+print("{0:,} datasets on {1} VMs".format(args.datasets, args.vms))
+print("summarize on the VMs: {0:.2f}s, merge {1:.3f}s, {2:,} bytes of JSON shipped".format(summarize_secs, merge_secs, sum(len(partial) for partial in partials)))
+print("exact with pandas:    {0:.2f}s, {1:,} bytes of runtimes".format(exact_secs, int(datasets_df[["nr_time", "raas_time"]].memory_usage(index=False).sum())))
+print("timeout cap: control {0:.2%}, treatment {1:.2%}".format(summary.cap_share("control"), summary.cap_share("treatment")))
+for name, error in errors.items():
+    print("largest relative error, {0}: {1:.4f} (bound {2})".format(name, error, args.accuracy))
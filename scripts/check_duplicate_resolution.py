@@ -0,0 +1,124 @@
+import os
+import json
+import glob
+import shutil
+import sqlite3
+import argparse
+import tempfile
+
+import pandas as pd
+
+from helper_functions import read_doi_lists
+from raas_reports import ingest_raas_dbs
+from results_warehouse import raas_sources, keep_one_report, build_warehouse, campaign_reports, campaign_timeouts, RESOLUTIONS
+
+# Check that generate_figures_plots.py reads the same RaaS results with and without --warehouse for
+# every --duplicates resolution. The RaaS databases and timeout lists of --data are copied to a
+# temporary directory and given duplicates: some reports copied onto the next VM, and a rerun of the
+# first VM (N-app-redo.db and N-timeout-dois-redo.txt) with some of its reports changed. The VMs
+# finish in the reverse order of their numbers, so the latest report is not the first one read.
+# Then the dataframes the plain ingest_raas stage returns are compared with the warehouse's.
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--data', default="../data")
+parser.add_argument('--every', type=int, default=7, help="copy every this many reports onto the next VM and into the rerun")
+args = parser.parse_args()
+
+def read_reports(db_file):
+    con = sqlite3.connect(db_file)
+    reports = [row[0] for row in con.execute("SELECT report FROM dataset ORDER BY id")]
+    con.close()
+    return(reports)
+
+def append_reports(db_file, reports):
+    con = sqlite3.connect(db_file)
+    with con:
+        con.execute("CREATE TABLE IF NOT EXISTS dataset (id INTEGER PRIMARY KEY, report TEXT)")
+        con.executemany("INSERT INTO dataset (report) VALUES (?)", [(report,) for report in reports])
+    con.close()
+
+# A rerun of a report: half of the reruns fixed every script and half broke every script, so the
+# best report is sometimes the rerun and sometimes the original
+def rerun_report(report, position):
+    report = json.loads(report)
+    report["Additional Information"]["Build Time"] = report["Additional Information"]["Build Time"] + 1
+    for script in report["Individual Scripts"].values():
+        script["Errors"] = [] if position % 2 == 0 else ["Error in library(foo) : there is no package called 'foo'"]
+    return(json.dumps(report))
+
+def plain_results(data_dir, resolution):
+    sources = raas_sources(data_dir)
+    db_sources = [source for source in sources if source.kind == "reports"]
+    reports_df, scripts_df = ingest_raas_dbs([source.path for source in db_sources])
+    reports_df, scripts_df = keep_one_report(reports_df, scripts_df, db_sources, resolution)
+    timeout_dois = read_doi_lists([source.path for source in sources if source.kind == "timeouts"])
+    return(reports_df, scripts_df, timeout_dois)
+
+def warehouse_results(data_dir, resolution):
+    warehouse_path = os.path.join(data_dir, "warehouse.db")
+    build_warehouse(warehouse_path, raas_sources(data_dir))
+    con = sqlite3.connect(warehouse_path)
+    reports_df, scripts_df = campaign_reports(con, ["raas"], resolution)
+    timeout_dois = campaign_timeouts(con, ["raas"])
+    con.close()
+    return(reports_df, scripts_df, timeout_dois)
+
+# The reports are numbered in the order they were read, so the plain reports, which keep their
+# numbers from before the duplicates were dropped, are numbered again to compare them
+def renumbered(reports_df, scripts_df):
+    numbers = pd.Series(range(len(reports_df.index)), index=reports_df["report_idx"].to_numpy())
+    reports_df = reports_df.assign(report_idx=numbers.to_numpy()).reset_index(drop=True)
+    scripts_df = scripts_df.assign(report_idx=numbers[scripts_df["report_idx"]].to_numpy()).reset_index(drop=True)
+    scripts_df["raas_error"] = scripts_df["raas_error"].astype(str)
+    return(reports_df, scripts_df)
+
+db_files = sorted(glob.glob(os.path.join(args.data, "raas_dbs", "*app.db")))
+if len(db_files) == 0:
+    raise SystemExit("no RaaS databases in " + os.path.join(args.data, "raas_dbs"))
+
+with tempfile.TemporaryDirectory() as data_dir:
+    shutil.copytree(os.path.join(args.data, "raas_dbs"), os.path.join(data_dir, "raas_dbs"))
+    if os.path.exists(os.path.join(args.data, "raas_timeouts")):
+        shutil.copytree(os.path.join(args.data, "raas_timeouts"), os.path.join(data_dir, "raas_timeouts"))
+    os.makedirs(os.path.join(data_dir, "raas_timeouts"), exist_ok=True)
+    copies = [os.path.join(data_dir, "raas_dbs", os.path.basename(db_file)) for db_file in db_files]
+
+    reports = [read_reports(copy) for copy in copies]
+    for vm, vm_reports in enumerate(reports):
+        append_reports(copies[(vm + 1) % len(copies)], vm_reports[::args.every])
+    rerun = [rerun_report(report, position) for position, report in enumerate(reports[0][::args.every])]
+    redo_path = copies[0].replace("app.db", "app-redo.db")
+    append_reports(redo_path, rerun)
+    with open(os.path.join(data_dir, "raas_timeouts", os.path.basename(redo_path).replace("app-redo.db", "timeout-dois-redo.txt")), "w") as timeout_file:
+        timeout_file.write("doi:10.7910/DVN/REDO01\n")
+
+    # When each file was written on its VM, as get_data_from_vms.py records it
+    manifest = {os.path.abspath(copy): {"mtime": 1000000.0 - 1000 * vm} for vm, copy in enumerate(copies)}
+    manifest[os.path.abspath(redo_path)] = {"mtime": 2000000.0}
+    with open(os.path.join(data_dir, "vm_manifest.json"), "w") as manifest_file:
+        manifest_file.write(json.dumps(manifest))
+
+    kept_dois = {}
+    for resolution in RESOLUTIONS:
+        plain_reports_df, plain_scripts_df, plain_timeouts = plain_results(data_dir, resolution)
+        warehouse_reports_df, warehouse_scripts_df, warehouse_timeouts = warehouse_results(data_dir, resolution)
+        plain_reports_df, plain_scripts_df = renumbered(plain_reports_df, plain_scripts_df)
+        warehouse_reports_df, warehouse_scripts_df = renumbered(warehouse_reports_df, warehouse_scripts_df)
+        pd.testing.assert_frame_equal(plain_reports_df, warehouse_reports_df)
+        pd.testing.assert_frame_equal(plain_scripts_df, warehouse_scripts_df)
+        pd.testing.assert_index_equal(plain_timeouts, warehouse_timeouts)
+        if plain_reports_df["doi"].duplicated().any():
+            raise AssertionError(resolution + ": more than one report of a DOI kept")
+        kept_dois[resolution] = plain_reports_df.set_index("doi")["raas_time"]
+        print("ok   " + resolution + ": " + str(len(plain_reports_df.index)) + " reports, " + str(len(plain_scripts_df.index)) +
+              " scripts and " + str(len(plain_timeouts)) + " timed out DOIs read the same with and without the warehouse")
+
+    # The duplicates have to make the resolutions disagree, or the check above proves little
+    for resolution in RESOLUTIONS:
+        if resolution != "first":
+            changed = (kept_dois[resolution] != kept_dois["first"].reindex(kept_dois[resolution].index)).sum()
+            print(resolution + " keeps a different report than first for " + str(changed) + " DOIs")
+            if changed == 0:
+                raise AssertionError("the duplicates do not tell " + resolution + " from first")
+
+print("All checks passed")
@@ -0,0 +1,34 @@
+import pandas as pd
+
+from pandas.api.types import union_categoricals
+
+MIB = 2 ** 20
+
+# Decoded rows take several times the size of their raw text while a chunk is processed: Python
+# string objects, parsed JSON and the intermediate columns built from them
+WORKING_SET_FACTOR = 8
+
+# The smallest chunk read, however small the memory budget
+MIN_CHUNK_ROWS = 100
+
+# Average number of bytes of text in the given columns of a table, measured inside SQLite so no
+# row has to be read into Python
+def average_row_bytes(con, table, columns):
+    lengths = " + ".join("COALESCE(LENGTH(" + column + "), 0)" for column in columns)
+    average = con.execute("SELECT AVG(" + lengths + ") FROM " + table).fetchone()[0]
+    return(average or 0)
+
+# How many rows of a table to read at a time so that one chunk stays within memory_budget bytes
+def chunk_rows(con, table, columns, memory_budget):
+    row_bytes = max(1, average_row_bytes(con, table, columns) * WORKING_SET_FACTOR)
+    return(max(MIN_CHUNK_ROWS, int(memory_budget // row_bytes)))
+
+# Concatenate the dataframes built from each chunk. Categorical columns are merged into one
+# Categorical with sorted categories, the same as if the whole table had been categorized at once.
+def concat_chunks(chunks, ignore_index=True):
+    chunks = list(chunks)
+    combined = pd.concat(chunks, ignore_index=ignore_index)
+    for column in combined.columns:
+        if all(isinstance(chunk[column].dtype, pd.CategoricalDtype) for chunk in chunks):
+            combined[column] = pd.Categorical(union_categoricals([chunk[column] for chunk in chunks], sort_categories=True))
+    return(combined)
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+
+# Every subject of a dataset is one bit of this integer
+SUBJECT_MASK_DTYPE = np.uint16
+
+class SubjectTable:
+    '''
+    Lookup table giving every Dataverse subject one bit of a uint16 mask, so the subjects of a
+    dataset are a single small integer instead of a boolean column per subject. Filtering on
+    subjects is a bitwise and with the mask of the subjects asked for. Masks that went missing in
+    a join (NaN) are treated as datasets without subjects.
+    '''
+    def __init__(self, subjects):
+        subjects = list(subjects)
+        if len(subjects) > np.iinfo(SUBJECT_MASK_DTYPE).bits:
+            raise ValueError("{0} subjects do not fit in a {1} mask".format(len(subjects), np.dtype(SUBJECT_MASK_DTYPE).name))
+        self.subjects = subjects
+        self.bits = {subject: SUBJECT_MASK_DTYPE(1 << idx) for idx, subject in enumerate(subjects)}
+
+    def lookup_df(self):
+        return(pd.DataFrame({"subject": self.subjects, "bit": list(self.bits.values())}))
+
+    # The mask of one subject or of a list of subjects
+    def mask(self, subjects):
+        if isinstance(subjects, str):
+            subjects = [subjects]
+        mask = SUBJECT_MASK_DTYPE(0)
+        for subject in subjects:
+            mask |= self.bits[subject]
+        return(mask)
+
+    # Masks from one boolean column per subject, like the dataframe of MetadataStore.datasets_df
+    def encode(self, in_subject_df):
+        masks = np.zeros(len(in_subject_df.index), dtype=SUBJECT_MASK_DTYPE)
+        for subject, bit in self.bits.items():
+            if subject in in_subject_df:
+                masks[in_subject_df[subject].to_numpy() == True] |= bit
+        return(masks)
+
+    def as_masks(self, masks):
+        return(pd.Series(np.asarray(masks)).fillna(0).to_numpy().astype(SUBJECT_MASK_DTYPE))
+
+    # Whether each mask has at least one of the subjects
+    def has_any(self, masks, subjects):
+        return((self.as_masks(masks) & self.mask(subjects)) != 0)
+
+    # The (position, subject) pairs of every subject set in masks, ordered by position and then
+    # by subject like a stacked frame of boolean subject columns
+    def memberships(self, masks):
+        bits = np.array(list(self.bits.values()), dtype=SUBJECT_MASK_DTYPE)
+        positions, subject_idxs = np.nonzero((self.as_masks(masks)[:, None] & bits[None, :]) != 0)
+        return(positions, np.array(self.subjects, dtype=object)[subject_idxs])
+
+    # One boolean column per subject, the inverse of encode
+    def decode(self, masks, index=None):
+        masks = self.as_masks(masks)
+        return(pd.DataFrame({subject: (masks & bit) != 0 for subject, bit in self.bits.items()}, index=index))
+
+# Replace the boolean subject columns of a dataset dataframe by a "subjects" mask column
+def compact_subjects(dataset_df, subject_table):
+    masks = subject_table.encode(dataset_df)
+    dataset_df = dataset_df.drop(columns=[subject for subject in subject_table.subjects if subject in dataset_df])
+    dataset_df["subjects"] = masks
+    return(dataset_df)
+
+# Dictionary encode string columns as Categoricals: every distinct string (an error message or
+# category) is stored once and each row holds an integer code into it. The categories are sorted,
+# so value_counts and crosstabs come out in the same order as with plain strings.
+def categorize_columns(df, columns):
+    for column in columns:
+        if not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = pd.Categorical(np.asarray(df[column], dtype=object))
+    return(df)
+
+# Rows and deep memory use in bytes of each dataframe in frames ({name: dataframe})
+def memory_report(frames):
+    return(pd.DataFrame({"rows": [len(df.index) for df in frames.values()],
+                         "bytes": [int(df.memory_usage(index=True, deep=True).sum()) for df in frames.values()]},
+                        index=pd.Index(list(frames), name="frame")))
@@ -0,0 +1,128 @@
+import os
+import re
+import heapq
+import argparse
+
+from glob import glob
+
+import numpy as np
+import pandas as pd
+
+from helper_functions import normalize_dois, read_doi_lists
+from compact_schema import SubjectTable, compact_subjects
+from metadata_store import open_metadata_store
+from raas_reports import ingest_raas_dbs
+
+# Longest a dataset is allowed to run before it is stopped, in seconds
+TIMEOUT_SECONDS = 18000
+
+# The shard files in a doi_lists directory, in shard order
+def shard_paths(doi_lists_dir):
+    paths = glob(os.path.join(doi_lists_dir, "*_r_dois.txt"))
+    return(sorted(paths, key=lambda path: int(re.match(r"(\d+)_", os.path.basename(path)).group(1))))
+
+def read_shards(paths):
+    return([list(read_doi_lists([path])) for path in paths])
+
+# Runtime of every DOI seen so far, in seconds. RaaS build times are preferred over runtimes
+# without RaaS, since they are what a VM spends evaluating a dataset, and a DOI in a timeout list
+# costs the full timeout. Every runtime is capped at the timeout.
+def runtime_history(times_csv="../data/dataset_times.csv", raas_dbs_dir="../data/raas_dbs", timeout_lists=()):
+    runtimes = pd.Series(dtype=float)
+    if os.path.exists(times_csv):
+        times_df = pd.read_csv(times_csv)
+        runtimes = pd.Series(times_df["time"].to_numpy(dtype=float), index=normalize_dois(times_df["doi"]))
+    db_files = sorted([y for x in os.walk(raas_dbs_dir) for y in glob(os.path.join(x[0], "*app*.db"))])
+    if db_files:
+        raas_df, _ = ingest_raas_dbs(db_files)
+        raas_times = pd.Series(raas_df["raas_time"].to_numpy(dtype=float), index=normalize_dois(raas_df["doi"]))
+        runtimes = pd.concat([runtimes, raas_times])
+    # The last runtime of a DOI wins, so RaaS times replace the times without RaaS
+    runtimes = runtimes[~runtimes.index.duplicated(keep="last")]
+    timed_out = read_doi_lists(list(timeout_lists))
+    runtimes = pd.concat([runtimes[~runtimes.index.isin(timed_out)], pd.Series(float(TIMEOUT_SECONDS), index=timed_out)])
+    return(runtimes.clip(upper=TIMEOUT_SECONDS))
+
+class CostModel:
+    '''
+    Predicts how long evaluating each DOI will take. DOIs with a recorded runtime cost that
+    runtime. Any other DOI costs the median runtime of the known datasets published in the same
+    year under the same subjects, or, if there are none, the median of the same year, and
+    otherwise the median of every known dataset. metadata_df has one row per DOI with its year
+    and subjects mask (see compact_schema).
+    '''
+    def __init__(self, runtimes, metadata_df):
+        self.runtimes = runtimes
+        self.metadata_df = metadata_df.drop_duplicates("doi").set_index("doi")[["year", "subjects"]]
+        known = self.metadata_df.join(runtimes.rename("runtime"), how="inner")
+        self.by_subjects_year = known.groupby(["subjects", "year"])["runtime"].median()
+        self.by_year = known.groupby("year")["runtime"].median()
+        self.overall = runtimes.median() if len(runtimes.index) > 0 else float(TIMEOUT_SECONDS)
+
+    # Predicted cost of each DOI, and where each prediction came from
+    def predict(self, dois):
+        dois = pd.Index(normalize_dois(dois))
+        metadata_df = self.metadata_df.reindex(dois)
+        by_subjects_year = pd.Series(self.by_subjects_year.reindex(pd.MultiIndex.from_arrays([metadata_df["subjects"], metadata_df["year"]])).to_numpy(), index=dois)
+        by_year = pd.Series(self.by_year.reindex(metadata_df["year"]).to_numpy(), index=dois)
+        recorded = self.runtimes.reindex(dois)
+
+        costs = recorded.fillna(by_subjects_year).fillna(by_year).fillna(self.overall)
+        source = np.select([recorded.notna(), by_subjects_year.notna(), by_year.notna()], ["recorded", "subjects and year", "year"], default="overall")
+        return(pd.DataFrame({"cost": costs.to_numpy(), "source": source}, index=dois))
+
+# Longest processing time first: hand out the DOIs from most to least expensive, each to the shard
+# with the least work so far. Ties go to the lower shard, so the split is deterministic.
+def lpt_partition(costs, shards):
+    order = np.argsort(-costs.to_numpy(), kind="stable")
+    loads = [(0.0, shard) for shard in range(shards)]
+    assignment = np.zeros(len(costs.index), dtype=int)
+    for position in order:
+        load, shard = heapq.heappop(loads)
+        assignment[position] = shard
+        heapq.heappush(loads, (load + costs.iloc[position], shard))
+    return([list(costs.index[assignment == shard]) for shard in range(shards)])
+
+# Predicted work of each shard, the longest of which (the makespan) is how long the campaign takes
+def shard_loads(shards, costs):
+    return(np.array([costs.reindex(pd.Index(normalize_dois(shard))).sum() for shard in shards]))
+
+def write_shards(shards, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    for number, dois in enumerate(shards):
+        with open(os.path.join(output_dir, str(number) + "_r_dois.txt"), "w") as doi_file:
+            doi_file.write("".join(doi + "\n" for doi in dois))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--current', default="../doi_lists", help="directory with the current count-based split")
+    parser.add_argument('--dois', help="file of the DOIs to split, instead of every DOI in the current split")
+    parser.add_argument('--shards', type=int, help="number of VMs, by default as many as in the current split")
+    parser.add_argument('--output', default="../doi_lists/balanced")
+    parser.add_argument('--times', default="../data/dataset_times.csv")
+    parser.add_argument('--raas-dbs', default="../data/raas_dbs")
+    parser.add_argument('--timeouts', nargs='*', default=["../data/no_raas_timeouts.txt"] + sorted(glob("../data/raas_timeouts/*timeout-dois*.txt")))
+    args = parser.parse_args()
+
+    current_shards = read_shards(shard_paths(args.current))
+    dois = list(read_doi_lists([args.dois])) if args.dois else [doi for shard in current_shards for doi in shard]
+    shards = args.shards or len(current_shards)
+
+    metadata_store = open_metadata_store("../data/doi_metadata.db", seed_json="../data/doi_metadata.json")
+    metadata_df = compact_subjects(metadata_store.datasets_df(), SubjectTable(metadata_store.subjects()))
+    metadata_store.close()
+    metadata_df["doi"] = normalize_dois(metadata_df["doi"])
+
+    model = CostModel(runtime_history(args.times, args.raas_dbs, args.timeouts), metadata_df)
+    predictions = model.predict(dois)
+    costs = predictions["cost"]
+    balanced_shards = lpt_partition(costs, shards)
+    write_shards(balanced_shards, args.output)
+
+    print("{0:,} DOIs: {1}".format(len(dois), ", ".join("{0} {1}".format(count, source) for source, count in predictions["source"].value_counts().items())))
+    print("Lower bound on the makespan: {0:,.0f}s".format(max(costs.sum() / shards, costs.max())))
+    if current_shards and not args.dois and len(current_shards) == shards:
+        current_loads = shard_loads(current_shards, costs)
+        print("Current split:  makespan {0:,.0f}s, shards from {1:,.0f}s to {2:,.0f}s".format(current_loads.max(), current_loads.min(), current_loads.max()))
+    balanced_loads = shard_loads(balanced_shards, costs)
+    print("Balanced split: makespan {0:,.0f}s, shards from {1:,.0f}s to {2:,.0f}s, written to {3}".format(balanced_loads.max(), balanced_loads.min(), balanced_loads.max(), args.output))
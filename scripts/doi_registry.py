@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+from helper_functions import normalize_dois
+
+# Interns values into an index so each distinct value gets a stable integer id, in the order values
+# are first seen. Missing values get -1.
+def intern_values(index, values):
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    positions = index.get_indexer(uniques)
+    is_new = positions < 0
+    positions[is_new] = np.arange(len(index), len(index) + is_new.sum())
+    index = index.append(pd.Index(uniques[is_new], dtype=object))
+    ids = np.where(codes >= 0, positions[np.maximum(codes, 0)], -1)
+    return(index, ids)
+
+class DoiRegistry:
+    '''
+    Maps every spelling of a DOI (dataset paths, results.db filenames, container tags, doi list
+    lines) to one int32 id, and every script to an int64 key made of its DOI's id in the high
+    32 bits and the id of its lower cased file name in the low 32 bits. Dataframes are joined on
+    these integers, and the DOI strings are only needed again when writing output.
+    '''
+    def __init__(self):
+        self.dois = pd.Index([], dtype=object)
+        self.script_names = pd.Index([], dtype=object)
+
+    def doi_ids(self, dois):
+        self.dois, ids = intern_values(self.dois, normalize_dois(dois))
+        return(ids.astype(np.int32))
+
+    def doi_strings(self, doi_ids):
+        return(self.dois.take(np.asarray(doi_ids)).to_numpy())
+
+    # script_names are the lower cased base names used in unique_id, see create_script_id
+    def script_keys(self, doi_ids, script_names):
+        self.script_names, name_ids = intern_values(self.script_names, script_names)
+        doi_ids = np.asarray(doi_ids, dtype=np.int64)
+        keys = (doi_ids << 32) | name_ids.astype(np.int64)
+        return(np.where((doi_ids >= 0) & (name_ids >= 0), keys, -1))
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+# The rules used to categorize R error messages, in the same priority order as
+# helper_functions.determine_error_cause. Each rule is (category, phrases that must all
+# appear, phrases that must not appear). The first rule that holds decides the category.
+ERROR_RULES = [
+    ("working directory", ["Error in setwd"], []),
+    ("library", ["Error in library"], []),
+    ("library", ["unable to find required package"], []),
+    ("missing file", ["Error in file"], []),
+    ("missing file", ["such file or directory"], []),
+    ("missing file", ["unable to open"], []),
+    ("missing file", ["cannot open file"], []),
+    ("missing file", ["does not exist in current working directory"], []),
+    ("missing file", ["does not exist"], [".checkpoint", "Unsupported get request"]),
+    ("missing file", ["Error in readChar"], []),
+    ("missing file", ["File to copy does not exist"], []),
+    ("function", ["could not find function"], []),
+    ("library", ["there is no package called"], []),
+    ("missing file", ["cannot open the connection"], []),
+    ("missing object", ["object", "not found"], []),
+]
+
+# Messages that are categorized by an exact match rather than by the phrases they contain
+EXACT_ERRORS = {"success": "success", "timed out": "timed out"}
+
+DEFAULT_CATEGORY = "other"
+
+class ErrorClassifier:
+    '''
+    Categorizes error messages with a rule table. The rules are walked in order for each
+    distinct message and stop at the first one that holds, and a rule stops searching at the
+    first required phrase that is missing, so a message costs about as many substring
+    searches as the chain of checks in determine_error_cause.
+    '''
+    def __init__(self, rules=ERROR_RULES, exact=EXACT_ERRORS, default=DEFAULT_CATEGORY):
+        self.exact = dict(exact)
+        self.default = default
+        self.rules = [(category, tuple(required), tuple(forbidden)) for category, required, forbidden in rules]
+
+    def classify_one(self, error_msg):
+        if error_msg in self.exact:
+            return(self.exact[error_msg])
+        for category, required, forbidden in self.rules:
+            for phrase in required:
+                if phrase not in error_msg:
+                    break
+            else:
+                for phrase in forbidden:
+                    if phrase in error_msg:
+                        break
+                else:
+                    return(category)
+        return(self.default)
+
+    # Categorize a column of error messages. Only the distinct messages are classified, and
+    # the categories are then broadcast back to every row.
+    def classify(self, error_msgs):
+        codes, uniques = pd.factorize(np.asarray(error_msgs, dtype=object))
+        unique_labels = np.array([self.classify_one(msg) for msg in uniques], dtype=object)
+        # Sorted categories keep crosstabs and value_counts in the same order as plain strings
+        categories = sorted(set(unique_labels))
+        label_codes = pd.Categorical(unique_labels, categories=categories).codes
+        row_codes = np.where(codes >= 0, label_codes[codes], -1)
+        return(pd.Categorical.from_codes(row_codes, categories=categories))
+
+default_classifier = ErrorClassifier()
+
+# Drop-in replacement for determine_error_cause_v that returns a pandas Categorical
+def classify_errors(error_msgs):
+    return(default_classifier.classify(error_msgs))
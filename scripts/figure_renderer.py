@@ -0,0 +1,263 @@
+import os
+import json
+import inspect
+import pickle
+import hashlib
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+
+import numpy as np
+import pandas as pd
+
+FIGURES_DIR = "../figures"
+
+# Above this many datasets the runtime comparison is drawn as 2D bins instead of one marker per dataset
+SCATTER_POINT_LIMIT = 20000
+# Bins per axis of the binned runtime comparison, evenly spaced on a log scale
+RUNTIME_BINS = 120
+
+def set_plot_style():
+    import seaborn as sns
+    sns.set(color_codes=True)
+    sns.set_style("whitegrid")
+    sns.set_context("notebook")
+
+# Scripts and scripts with errors per dataset publish year. year_melted_df has the columns Year,
+# Count Type ("with Errors" or "Total") and Count.
+def plot_error_count_by_year(year_melted_df, path):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    set_plot_style()
+    #plt.figure(figsize=(10, 5), dpi=300)
+    figure = plt.figure(dpi=300)
+    ax = sns.barplot(x="Year", y="Count", hue="Count Type", data=year_melted_df, palette=sns.color_palette("Set1", n_colors=2, desat=.7))
+    ax.set_title('Total Script and Error Count by Year')
+    ax.set_xlabel("Dataset Publish Year")
+    ax.set_ylabel("Number of Scripts")
+    year_errors_df = year_melted_df[year_melted_df["Count Type"] == "with Errors"]
+    x_index = 0
+    for index, row in year_errors_df.iterrows():
+        total = year_melted_df[year_melted_df["Count Type"] == "Total"]
+        total = total[total["Year"] == row["Year"]]
+        perc = round(row["Count"] / total["Count"].values[0] * 100, 1)
+        ax.text(x=x_index,y=total["Count"].values[0],s=str(perc) + "%", ha="center")
+        x_index += 1
+    plt.savefig(path, format="png")
+    plt.close(figure)
+
+# Wilson score interval for successes out of totals, computed for all rows at once
+def wilson_interval(successes, totals, z=1.96):
+    successes = np.asarray(successes, dtype=float)
+    totals = np.asarray(totals, dtype=float)
+    proportion = successes / totals
+    denominator = 1 + z ** 2 / totals
+    center = (proportion + z ** 2 / (2 * totals)) / denominator
+    half_width = z * np.sqrt(proportion * (1 - proportion) / totals + z ** 2 / (4 * totals ** 2)) / denominator
+    return(center - half_width, center + half_width)
+
+# Bars of the share of successes in totals for each label in order, with a 95% Wilson interval on
+# each bar drawn the way seaborn draws its error bars. Labels go on the y axis when horizontal is set.
+def rate_barplot(labels, successes, totals, order, horizontal=False, **barplot_kwargs):
+    import seaborn as sns
+    counts_df = pd.DataFrame({"successes": np.asarray(successes), "totals": np.asarray(totals)}, index=labels).reindex(order)
+    rates = (counts_df["successes"] / counts_df["totals"]).dropna()
+    # The intervals are drawn below, so seaborn should not bootstrap its own (ci became errorbar in 0.12)
+    no_errorbar = {"errorbar": None} if "errorbar" in inspect.signature(sns.barplot).parameters else {"ci": None}
+    if horizontal:
+        ax = sns.barplot(y=rates.index, x=rates.to_numpy(), order=order, **no_errorbar, **barplot_kwargs)
+    else:
+        ax = sns.barplot(x=rates.index, y=rates.to_numpy(), order=order, **no_errorbar, **barplot_kwargs)
+
+    # Keep the category axis seaborn set up while adding the interval lines
+    ax.autoscale(False, axis="y" if horizontal else "x")
+    lows, highs = wilson_interval(counts_df["successes"], counts_df["totals"])
+    for position, (low, high) in enumerate(zip(lows, highs)):
+        if not np.isnan(low):
+            line = ([low, high], [position, position]) if horizontal else ([position, position], [low, high])
+            ax.plot(*line, color=".26", linewidth=matplotlib.rcParams["lines.linewidth"] * 1.8)
+    return(ax)
+
+# Fraction of failing scripts per subject. subject_counts_df has one row per subject with its
+# n_success and n_error script counts.
+def plot_error_rate_by_subject(subject_counts_df, path):
+    import matplotlib.pyplot as plt
+    set_plot_style()
+    figure = plt.figure(dpi=300)
+    plt.xticks(rotation=-70, ha = "left")
+    ax = rate_barplot(subject_counts_df["Subject"], subject_counts_df["n_error"], subject_counts_df["n_success"] + subject_counts_df["n_error"],
+                      order=["Mathematical Sciences",
+                             "Medicine, Health and Life Sciences",
+                             "Law",
+                             "Earth and Environmental Sciences",
+                             "Business and Management",
+                             "Agricultural Sciences",
+                             "Social Sciences",
+                             "Computer and Information Science",
+                             "Other",
+                             "Engineering",
+                             "Arts and Humanities",
+                             "Physics"],
+                      horizontal=True)
+    #ax.set_title('Script Failure Proportion by Subject')
+    ax.set_ylabel("Subject")
+    ax.set_xlabel("Fraction of Failing Scripts")
+    plt.tight_layout()
+    plt.savefig(path, format="png")
+    plt.close(figure)
+
+# Count the datasets in log-scaled 2D bins of runtime without RaaS (x) and with RaaS (y). Both axes
+# share the same edges so the y=x line runs through the bin corners. Runtimes of zero have no
+# place on a log scale and are left out.
+def bin_runtimes(datasets_df, bins=RUNTIME_BINS):
+    x = datasets_df["nr_time"].to_numpy(dtype=float)
+    y = datasets_df["raas_time"].to_numpy(dtype=float)
+    positive = (x > 0) & (y > 0)
+    x = x[positive]
+    y = y[positive]
+    low, high = (min(x.min(), y.min()), max(x.max(), y.max())) if len(x) > 0 else (1.0, 10.0)
+    edges = np.geomspace(low, high * (1 + 1e-9), bins + 1)
+    log_edges = np.log10(edges)
+    counts, _, _ = np.histogram2d(np.log10(x), np.log10(y), bins=[log_edges, log_edges])
+    return({"edges": edges, "counts": counts.T.astype(np.int64), "datasets": int(positive.sum())})
+
+# What the runtime comparison is drawn from: every dataset for a scatter plot, or the bin counts of
+# bin_runtimes. mode is "scatter", "binned" or "auto", which bins above SCATTER_POINT_LIMIT datasets.
+def runtime_comparison_frame(all_clean_completed_datasets_df, mode="auto"):
+    if mode == "binned" or (mode == "auto" and len(all_clean_completed_datasets_df.index) > SCATTER_POINT_LIMIT):
+        return(bin_runtimes(all_clean_completed_datasets_df))
+    return(all_clean_completed_datasets_df)
+
+# The datasets in each runtime bin as a heatmap on log axes, with the y=x line
+def plot_runtime_density(runtime_bins, path):
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LogNorm
+    set_plot_style()
+    figure = plt.figure(dpi=300)
+    ax = plt.gca()
+    edges = runtime_bins["edges"]
+    counts = np.ma.masked_equal(runtime_bins["counts"], 0)
+    mesh = ax.pcolormesh(edges, edges, counts, norm=LogNorm(vmin=1, vmax=max(1, counts.max())), cmap="viridis", shading="flat")
+    figure.colorbar(mesh, ax=ax, label="Datasets")
+    ax.set_xscale("log")
+    ax.set_yscale("log")
+    ax.set_title('Comparison of Runtimes')
+    ax.set_xlabel("Runtime Without RaaS in Seconds")
+    ax.set_ylabel("Runtime With RaaS in Seconds")
+    plt.tight_layout()
+    ax.plot([edges[0], edges[-1]], [edges[0], edges[-1]], linewidth=1, alpha = 0.5, color = "0.2")
+    plt.savefig(path, format="png")
+    plt.close(figure)
+
+# Runtime of each dataset without RaaS against its runtime with RaaS, or the binned counts of
+# runtime_comparison_frame
+def plot_runtime_comparison(all_clean_completed_datasets_df, path):
+    if isinstance(all_clean_completed_datasets_df, dict):
+        plot_runtime_density(all_clean_completed_datasets_df, path)
+        return
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    set_plot_style()
+    #plt.figure(figsize=(10, 5), dpi=300)
+    figure = plt.figure(dpi=300)
+    ax = sns.scatterplot(x="nr_time", y="raas_time", data=all_clean_completed_datasets_df, color = ".2", marker ="+")
+    ax.set_title('Comparison of Runtimes')
+    ax.set_xlabel("Runtime Without RaaS in Seconds")
+    ax.set_ylabel("Runtime With RaaS in Seconds")
+    plt.tight_layout()
+    ax.axline([0, 0], [1, 1], linewidth=1, alpha = 0.5, color = "0.2")
+    plt.savefig(path, format="png")
+    plt.close(figure)
+
+# Fraction of scripts that succeeded with RaaS per dataset publish year. success_by_year_df has
+# one row per year with its n_success and n_error script counts.
+def plot_success_rate_by_year(success_by_year_df, path):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    set_plot_style()
+    figure = plt.figure(dpi=300)
+    plt.xticks(rotation=-70, ha = "left")
+    plt.ylim(0,1)
+    ax = rate_barplot(success_by_year_df["Year"], success_by_year_df["n_success"], success_by_year_df["n_success"] + success_by_year_df["n_error"],
+                      order=["2015", "2016", "2017", "2018", "2019", "2020", "2021"],
+                      palette=sns.color_palette("Set1", n_colors=1, desat=.7))
+    #ax.set_title('Script Failure Proportion by Subject')
+    ax.set_xlabel("Year")
+    ax.set_ylabel("Fraction of Successful Scripts")
+    plt.tight_layout()
+    plt.savefig(path, format="png")
+    plt.close(figure)
+
+# Every figure the renderer knows: the function drawing it and the file it is saved to
+FIGURES = {
+    "error_count_by_year": (plot_error_count_by_year, os.path.join(FIGURES_DIR, "error_count_by_year.png")),
+    "error_rate_by_subject": (plot_error_rate_by_subject, os.path.join(FIGURES_DIR, "error_rate_by_subject.png")),
+    "runtime_comparison": (plot_runtime_comparison, os.path.join(FIGURES_DIR, "runtime-comparison.png")),
+    "success_rate_by_year": (plot_success_rate_by_year, os.path.join(FIGURES_DIR, "success_rate_by_year.png")),
+}
+
+def figure_paths(names):
+    return([FIGURES[name][1] for name in names])
+
+# The hash of what a figure is drawn from: its plot-ready frame and the source of this module, which
+# covers the plot function along with every helper and constant it uses
+def figure_hash(name, frame):
+    digest = hashlib.sha256(name.encode())
+    digest.update(pickle.dumps(frame, protocol=pickle.HIGHEST_PROTOCOL))
+    with open(__file__, "rb") as source_file:
+        digest.update(source_file.read())
+    return(digest.hexdigest())
+
+# Workers draw on Agg, starting from a clean pyplot state whatever the parent had open
+def use_headless_backend():
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    plt.close("all")
+
+def render_figure(name, frame):
+    plot, path = FIGURES[name]
+    plot(frame, path)
+    return(name)
+
+class FigureRenderer:
+    '''
+    Renders figures from plot-ready frames in worker processes on the Agg backend, so
+    drawing never happens in the process running the analysis. A figure is only drawn again when
+    its frame or plot code changed since the last render recorded in state_path, or its file is gone.
+    '''
+    def __init__(self, state_path="../data/stages/figures.json", workers=1):
+        self.state_path = state_path
+        self.workers = workers
+        self.state = {}
+        if os.path.exists(state_path):
+            with open(state_path, "r") as state_file:
+                self.state = json.load(state_file)
+
+    def save_state(self):
+        state_dir = os.path.dirname(self.state_path)
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        with open(self.state_path, "w") as state_file:
+            json.dump(self.state, state_file, indent=1, sort_keys=True)
+
+    # frames maps figure names to their plot-ready frames. Returns the names that were rendered.
+    def render(self, frames, verbose=True):
+        hashes = {name: figure_hash(name, frame) for name, frame in frames.items()}
+        todo = [name for name in frames if self.state.get(name) != hashes[name] or not os.path.exists(FIGURES[name][1])]
+        if todo:
+            # Forked like the stages, since a spawned worker would rerun the converted notebook on import
+            context = None
+            if "fork" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("fork")
+            with ProcessPoolExecutor(max_workers=max(1, min(self.workers, len(todo))), mp_context=context,
+                                     initializer=use_headless_backend) as pool:
+                futures = {name: pool.submit(render_figure, name, frames[name]) for name in todo}
+                for name, future in futures.items():
+                    future.result()
+                    self.state[name] = hashes[name]
+                    if verbose:
+                        print("[figures] rendered " + FIGURES[name][1], flush=True)
+            self.save_state()
+        return(todo)
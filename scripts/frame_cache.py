@@ -0,0 +1,72 @@
+import io
+import mmap
+import struct
+import pickle
+
+import numpy as np
+import pandas as pd
+
+# Objects passed between stages, most of them the ingested dataframes, are stored in a columnar
+# layout: pickle protocol 5 with the buffer of every numpy array (a dataframe's column blocks,
+# categorical codes and index) taken out of band and written one after another behind a small
+# header, each aligned to ALIGNMENT bytes. Columns of strings are dictionary encoded into their
+# distinct strings and integer codes, the way parquet stores them. Loading maps the file and
+# rebuilds the arrays as views of the mapping, so numeric columns are neither copied nor parsed,
+# and every distinct string is unpickled once. pyarrow is not part of the analysis image,
+# so feather and parquet are not used; this layout keeps categoricals, object columns and indexes
+# exactly as they were.
+MAGIC = b"FRAMES01"
+ALIGNMENT = 64
+
+def padding(size):
+    return(-size % ALIGNMENT)
+
+# An object array of strings from its distinct strings and codes, with the missing values (code -1)
+# put back as they were
+def decode_strings(uniques, codes, missing, shape):
+    strings = np.empty(len(uniques), dtype=object)
+    strings[:] = uniques
+    values = strings[codes]
+    values[codes == -1] = missing
+    return(values.reshape(shape))
+
+class ColumnPickler(pickle.Pickler):
+    def reducer_override(self, obj):
+        if type(obj) is np.ndarray and obj.dtype == object and obj.size > 0:
+            flat = obj.ravel()
+            if pd.api.types.infer_dtype(flat, skipna=True) == "string":
+                codes, uniques = pd.factorize(flat)
+                return(decode_strings, (list(uniques), codes, list(flat[codes == -1]), obj.shape))
+        return(NotImplemented)
+
+# The bytes of the stored form of value
+def dump_object(value):
+    buffers = []
+    header_file = io.BytesIO()
+    ColumnPickler(header_file, protocol=5, buffer_callback=buffers.append).dump(value)
+    header = header_file.getvalue()
+    raws = [buffer.raw() for buffer in buffers]
+    prefix = MAGIC + struct.pack("<QQ", len(header), len(raws)) + b"".join(struct.pack("<Q", raw.nbytes) for raw in raws)
+    parts = [prefix, header, b"\0" * padding(len(prefix) + len(header))]
+    for raw in raws:
+        parts.append(raw)
+        parts.append(b"\0" * padding(raw.nbytes))
+    return(b"".join(parts))
+
+def load_object(path):
+    # A private mapping: pages are read when a column first touches them, and a stage writing to
+    # a column it loaded changes its own copy of the page, never the stored object
+    with open(path, "rb") as object_file:
+        view = memoryview(mmap.mmap(object_file.fileno(), 0, access=mmap.ACCESS_COPY))
+    if view[:len(MAGIC)] != MAGIC:
+        raise ValueError(path + " is not a stored object")
+    header_size, count = struct.unpack_from("<QQ", view, len(MAGIC))
+    sizes = struct.unpack_from("<" + "Q" * count, view, len(MAGIC) + 16)
+    offset = len(MAGIC) + 16 + 8 * count
+    header = view[offset:offset + header_size]
+    offset += header_size + padding(offset + header_size)
+    buffers = []
+    for size in sizes:
+        buffers.append(view[offset:offset + size])
+        offset += size + padding(size)
+    return(pickle.loads(header, buffers=buffers))
@@ -12,10 +12,12 @@
 
 
 import os
+import argparse
 import sqlite3
 import json
 import requests
 import re
+import warnings
 import matplotlib
 
 import matplotlib.pyplot as plt
@@ -27,12 +29,75 @@ import numpy as np
 from glob import glob
 
 from helper_functions import *
+from error_classifier import classify_errors
+from raas_reports import ingest_raas_dbs
+from doi_registry import DoiRegistry
+from metadata_store import open_metadata_store
+from md_template import render_template
+from aggregation_cube import build_condition_cube
+from compact_schema import SubjectTable, compact_subjects, categorize_columns
+from chunked_ingest import MIB, chunk_rows, concat_chunks
+from sql_pushdown import category_counts
+from results_warehouse import discover_sources, raas_sources, build_warehouse, keep_one_report, campaign_scripts_query, campaign_reports, campaign_timeouts, RESOLUTIONS
+from transitions import TransitionMatrices
+from runtime_stats import summarize_runtimes, TIMEOUT_SECONDS
+from stage_graph import StageGraph, StageError
+from figure_renderer import FigureRenderer, FIGURES, figure_paths, runtime_comparison_frame
 
 font = {'family' : 'normal',
         'weight' : 'normal',
         'size'   : 25}
 matplotlib.rc('font', **font)
 
+# When run as a script, e.g. python generate_figures_plots.py --stages subject_breakdown_table. Unknown arguments
+# are ignored so the notebook kernel's own arguments don't get in the way.
+parser = argparse.ArgumentParser()
+parser.add_argument('--workers', type=int, default=os.cpu_count(), help="processes used to read the RaaS databases")
+parser.add_argument('--refresh-cache', action='store_true', help="rerun every selected stage even if its inputs did not change")
+parser.add_argument('--jobs', type=int, default=os.cpu_count(), help="stages run at the same time")
+parser.add_argument('--stages', nargs='+', help="only run these stages and the stages they depend on")
+parser.add_argument('--list-stages', action='store_true')
+parser.add_argument('--figures', nargs='+', choices=list(FIGURES), help="only render these figures")
+parser.add_argument('--runtime-plot', choices=["auto", "scatter", "binned"], default="auto", help="draw the runtime comparison per dataset, in 2D bins, or in bins only when there are many datasets")
+parser.add_argument('--memory-budget', type=float, help="read results.db and the RaaS databases in chunks that fit in this many MiB")
+parser.add_argument('--pushdown', action='store_true', help="count the scripts of results.db by category inside SQLite for the headline numbers")
+parser.add_argument('--warehouse', nargs='?', const="../data/warehouse.db", help="merge every result file into this SQLite warehouse and read the results from it")
+parser.add_argument('--duplicates', choices=RESOLUTIONS, default="first", help="keep the first result loaded, the latest or the best result of a DOI")
+parser.add_argument('--control', nargs='+', default=["no raas"], help="with --warehouse, the campaigns compared as the results without RaaS")
+parser.add_argument('--treatment', nargs='+', default=["raas"], help="with --warehouse, the campaigns compared as the results with RaaS")
+args, _ = parser.parse_known_args()
+if args.warehouse is None and (args.control != ["no raas"] or args.treatment != ["raas"]):
+    parser.error("--control and --treatment need --warehouse")
+
+# Plain values, so changing the campaigns or how duplicates are resolved reruns the stages reading them
+control_campaigns = args.control
+treatment_campaigns = args.treatment
+duplicate_resolution = args.duplicates
+
+# Every step of the analysis below is declared as a stage of this graph with the objects it uses,
+# the files it reads and the files it writes. The last cell runs the stages whose inputs changed
+# since the previous run; the objects passed between stages are kept in ../data/stages.
+pipeline = StageGraph("../data/stages", files=["helper_functions.py", "md_template.py", "aggregation_cube.py", "transitions.py", "compact_schema.py"])
+
+# Figures are drawn by figure_renderer.py in worker processes from the frames the stages below prepare
+selected_figures = args.figures or list(FIGURES)
+runtime_plot = args.runtime_plot
+
+
+# Results Warehouse
+# -----------------
+# 
+# With `--warehouse`, results.db, timed_results.db, the RaaS database and timeout list of every VM, and the files of every campaign under `../data/campaigns`, are merged into one indexed SQLite file that keeps each result with its campaign, VM and run time. The results below are then read from it instead of from each file: `--control` and `--treatment` pick the campaigns compared, and `--duplicates` how one result is chosen when a DOI has several.
+
+# In[ ]:
+
+
+if args.warehouse is not None:
+    @pipeline.stage(outputs=["warehouse_manifest"], files=["../data/results.db", "../data/timed_results.db", "../data/no_raas_timeouts.txt", "../data/raas_dbs",
+                                                           "../data/raas_timeouts", "../data/campaigns", "../data/vm_manifest.json", "results_warehouse.py", "raas_reports.py"], writes=[args.warehouse])
+    def build_results_warehouse():
+        return(build_warehouse(args.warehouse, discover_sources("../data")))
+
 
 # Analyzing scripts that ran __*without*__ RaaS
 # =======================================
@@ -47,15 +112,42 @@ matplotlib.rc('font', **font)
 # In[2]:
 
 
-con = sqlite3.connect("../data/results.db")
-
-scripts_df = pd.read_sql_query("SELECT * FROM results", con) 
-scripts_df["doi"] = get_doi_from_results_filename_v(scripts_df["filename"])
-scripts_df["error_category"] = determine_error_cause_v(scripts_df["error"])
-
-scripts_df = scripts_df[["filename", "error", "doi", "error_category"]]
-scripts_df["unique_id"] = create_script_id_v(scripts_df["doi"].values, scripts_df["filename"].values)
-scripts_df.columns = ['filename', 'nr_error', 'doi', 'nr_error_category', 'unique_id']
+def prepare_no_raas_scripts(scripts_df):
+    # Scripts read from the warehouse come with their DOI, whatever form their filenames take
+    if "doi" not in scripts_df.columns:
+        scripts_df["doi"] = get_doi_from_results_filename_v(scripts_df["filename"])
+    scripts_df["error_category"] = classify_errors(scripts_df["error"])
+
+    scripts_df = scripts_df[["filename", "error", "doi", "error_category"]]
+    scripts_df["unique_id"] = create_script_id_v(scripts_df["doi"].values, scripts_df["filename"].values)
+    scripts_df.columns = ['filename', 'nr_error', 'doi', 'nr_error_category', 'unique_id']
+    # Error messages repeat across scripts, so each distinct message is stored once
+    scripts_df = categorize_columns(scripts_df, ["nr_error"])
+    return(scripts_df)
+
+# With --memory-budget the results are read in chunks, and only the compact columns of each chunk
+# are kept once it has been categorized
+def read_no_raas_scripts(con, query, table):
+    if args.memory_budget is None:
+        return(prepare_no_raas_scripts(pd.read_sql_query(query, con)))
+    rows_per_chunk = chunk_rows(con, table, ["filename", "error"], args.memory_budget * MIB)
+    chunks = pd.read_sql_query(query, con, chunksize=rows_per_chunk)
+    return(concat_chunks(prepare_no_raas_scripts(chunk) for chunk in chunks))
+
+if args.warehouse is None:
+    @pipeline.stage(outputs=["results_df"], files=["../data/results.db", "error_classifier.py", "chunked_ingest.py"])
+    def ingest_no_raas():
+        con = sqlite3.connect("../data/results.db")
+        scripts_df = read_no_raas_scripts(con, "SELECT filename, error FROM results", "results")
+        con.close()
+        return(scripts_df)
+else:
+    @pipeline.stage(outputs=["results_df"], files=["error_classifier.py", "chunked_ingest.py", "results_warehouse.py"])
+    def ingest_no_raas(warehouse_manifest):
+        con = sqlite3.connect(args.warehouse)
+        scripts_df = read_no_raas_scripts(con, campaign_scripts_query(control_campaigns, duplicate_resolution), "scripts")
+        con.close()
+        return(scripts_df)
 
 
 # __Generate Datasets Dataframe__
@@ -63,78 +155,85 @@ scripts_df.columns = ['filename', 'nr_error', 'doi', 'nr_error_category', 'uniqu
 # In[3]:
 
 
-# Load in metadata about each doi generated from get_doi_metadata.ipynb 
-with open("../data/doi_metadata.json", "r") as doi_file:
-    doi_metadata = json.loads(doi_file.read())
-
-# Identify all subjects that R scripts were uploaded under on Dataverse
-subject_set = set()
-for doi_key in doi_metadata:
-    if doi_metadata[doi_key][0] is not None:
-        for subject in doi_metadata[doi_key][0]:
-            subject_set.add(subject)   
-
-
-# In[4]:
+# Load in metadata about each doi harvested by get_doi_metadata.ipynb. The store is created from
+# doi_metadata.json the first time it is opened, and imports it again whenever it changes.
+# The stage is keyed on the content of the store rather than on doi_metadata.db, which opening
+# the store can rewrite, so the store is opened here once to import the json and take its hash.
+store = open_metadata_store("../data/doi_metadata.db", seed_json="../data/doi_metadata.json")
+metadata_store_hash = store.content_hash()
+store.close()
 
+@pipeline.stage(outputs=["subject_list", "subject_table", "metadata_df"], files=["../data/doi_metadata.json", "metadata_store.py"])
+def ingest_metadata():
+    metadata_store = open_metadata_store("../data/doi_metadata.db", seed_json="../data/doi_metadata.json")
+    # A harvest since the hash was taken would leave these outputs recorded under a stale key
+    if metadata_store.content_hash() != metadata_store_hash:
+        metadata_store.close()
+        raise StageError("../data/doi_metadata.db changed after this cell ran; run it again")
 
-# generate a dataset dataframe. Initialize and populate as a dict that we will later convert to a dataframe
-df_dict = {"doi": [], "year":[]}
-for subject in subject_set:
-    df_dict[subject] = []
+    # Identify all subjects that R scripts were uploaded under on Dataverse
+    subject_list = metadata_store.subjects()
 
-for doi_key in doi_metadata:
-    if doi_metadata[doi_key][0] is not None:
-        df_dict["year"].append(doi_metadata[doi_key][1])
-        df_dict["doi"].append(doi_key.strip("\n"))
-        for subject in subject_set:
-            if subject in doi_metadata[doi_key][0]:
-                df_dict[subject].append(True)
-            else:
-                df_dict[subject].append(False)
-
-dataset_df = pd.DataFrame(df_dict)
+    # generate a dataset dataframe with the doi, the year, and the subjects of each dataset as the
+    # bits of one integer. Filter on subjects with subject_table.has_any.
+    subject_table = SubjectTable(subject_list)
+    dataset_df = compact_subjects(metadata_store.datasets_df(), subject_table)
+    metadata_store.close()
+    return(subject_list, subject_table, dataset_df)
 
 
 # In[5]:
 
 
 # Add the time it took for each dataset to execute to the dataframe
-no_raas_times = pd.read_csv("../data/dataset_times.csv")
-dataset_df["nr_time"] = None
-col_idx = dataset_df.columns.get_loc("nr_time")
-for index, row in no_raas_times.iterrows():
-    doi = get_doi_from_dir_path(row["doi"])
-    row_idx = dataset_df[dataset_df["doi"] == doi].index
-    dataset_df.iloc[row_idx, col_idx] = row["time"]
-    
-dataset_df = dataset_df[~dataset_df.nr_time.isna()]
-
-
-# In[6]:
-
+def add_runtimes(dataset_df):
+    no_raas_times = pd.read_csv("../data/dataset_times.csv")
+    dataset_df = attach_runtimes(dataset_df, no_raas_times, "nr_time")
+    dataset_df = dataset_df[~dataset_df.nr_time.isna()]
+    return(dataset_df)
 
 # Add a boolean column identifying whether or not a dataset was 'clean,' aka no scripts had errors
-clean_col = []
-for doi in dataset_df["doi"].values:
-    clean_col.append(is_clean(doi, scripts_df))
-dataset_df["nr_clean"] = clean_col
-dataset_df["nr_timed_out"] = False
-no_raas_timeouts_dois = []
-with open("../data/no_raas_timeouts.txt", "r") as no_raas_timeouts_file:
-    no_raas_timeouts_dois = strip_newlines_v(no_raas_timeouts_file.readlines())
-
-nr_timeout_idxs = dataset_df[dataset_df["nr_time"] > 18000].index
-dataset_df.loc[nr_timeout_idxs, "nr_timed_out"] = True
-valid_datasets_df = dataset_df[dataset_df["nr_timed_out"] == False]
+def add_cleanliness(dataset_df, scripts_df):
+    nr_summary_df = summarize_datasets(scripts_df, "nr_error")
+    dataset_df["nr_clean"] = dataset_df["doi"].map(nr_summary_df["clean"]).fillna(False).astype(bool)
+    return(dataset_df)
+
+# Join the datasets with the scripts that ran without RaaS
+@pipeline.stage(outputs=["scripts_df", "dataset_df", "valid_datasets_df", "datasets_by_id_df", "overall_df", "doi_registry"],
+                files=["../data/dataset_times.csv", "../data/no_raas_timeouts.txt", "doi_registry.py"])
+def join_metadata(results_df, metadata_df):
+    scripts_df = results_df
+    dataset_df = add_runtimes(metadata_df)
+    dataset_df = add_cleanliness(dataset_df, scripts_df)
+    dataset_df["nr_timed_out"] = False
+    no_raas_timeouts_dois = read_doi_lists(["../data/no_raas_timeouts.txt"])
+
+    nr_timeout_idxs = dataset_df[dataset_df["nr_time"] > 18000].index
+    dataset_df.loc[nr_timeout_idxs, "nr_timed_out"] = True
+    valid_datasets_df = dataset_df[dataset_df["nr_timed_out"] == False]
+
+    # Give every DOI and script an integer id so the joins below compare integers instead of strings.
+    # The DOI strings are only kept for output.
+    doi_registry = DoiRegistry()
+    dataset_df["doi_id"] = doi_registry.doi_ids(dataset_df["doi"])
+    scripts_df["doi_id"] = doi_registry.doi_ids(scripts_df["doi"])
+    scripts_df["script_key"] = doi_registry.script_keys(scripts_df["doi_id"], scripts_df["filename"].str.rsplit("/", n=1).str[-1].str.lower())
+    datasets_by_id_df = dataset_df.drop(columns="doi").set_index("doi_id")
+
+    overall_df = scripts_df.join(datasets_by_id_df, on="doi_id")
+    return(scripts_df, dataset_df, valid_datasets_df, datasets_by_id_df, overall_df, doi_registry)
+
+
+# __Counts by Year, Subject and Error Category__
 
-
-# __Generate Overall Joined Dataframe__
-
-# In[7]:
+# In[ ]:
 
 
-overall_df = scripts_df.join(dataset_df.set_index("doi"), on="doi")
+# Script and dataset counts by year, subject, error category and timeout, counted once. The breakdowns
+# below take slices of it instead of filtering the scripts once per year or subject.
+@pipeline.stage(outputs=["no_raas_cube"])
+def no_raas_counts(scripts_df, datasets_by_id_df, subject_table):
+    return(build_condition_cube("no raas", scripts_df, "nr_error_category", datasets_by_id_df, datasets_by_id_df["nr_timed_out"], subject_table))
 
 
 # Comparison of Chen's 2018 Study to our 2022 Study
@@ -145,15 +244,38 @@ overall_df = scripts_df.join(dataset_df.set_index("doi"), on="doi")
 # In[8]:
 
 
-total_num_scripts = len(scripts_df[scripts_df["nr_error"] != "timed out"].index)
-num_success_scripts = len(scripts_df[scripts_df["nr_error_category"] == "success"].index)
-num_error_scripts = len(scripts_df[~scripts_df.nr_error_category.isin(["success", "timed out"])].index)
+# Scripts by DOI and error category. With --pushdown they are counted inside SQLite (see
+# sql_pushdown.py), so the headline numbers don't need every error message read into pandas.
+if args.pushdown:
+    @pipeline.stage(outputs=["nr_category_counts"], files=["../data/results.db", "error_classifier.py", "sql_pushdown.py"])
+    def no_raas_category_counts():
+        con = sqlite3.connect("../data/results.db")
+        nr_category_counts = category_counts(con)
+        con.close()
+        return(nr_category_counts)
+else:
+    @pipeline.stage(outputs=["nr_category_counts"])
+    def no_raas_category_counts(results_df):
+        nr_category_counts = results_df.groupby(["doi", "nr_error_category"], observed=True).size()
+        nr_category_counts = nr_category_counts.rename("scripts").reset_index().rename(columns={"nr_error_category": "category"})
+        nr_category_counts["category"] = nr_category_counts["category"].astype(str)
+        return(nr_category_counts)
+
+# Only "timed out" messages are in the timed out category, so the scripts that didn't time out are
+# everything else
+@pipeline.stage(outputs=["total_num_scripts", "num_success_scripts", "num_error_scripts"])
+def script_totals(nr_category_counts):
+    scripts_by_category = nr_category_counts.groupby("category")["scripts"].sum()
+    total_num_scripts = int(scripts_by_category.drop("timed out", errors="ignore").sum())
+    num_success_scripts = int(scripts_by_category.get("success", 0))
+    num_error_scripts = total_num_scripts - num_success_scripts
+    return(total_num_scripts, num_success_scripts, num_error_scripts)
 
 
 # In[9]:
 
 
-chen_comparison_markdown = '''
+chen_comparison_template = '''
 ------------------------------------------------
               Chen's              Ours 
   --------- -------- --------- ------- ---------
@@ -167,15 +289,18 @@ chen_comparison_markdown = '''
 ------------------------------------------------
 '''
 
-chen_comparison_markdown = chen_comparison_markdown.replace("OUR_SUCCESS_COUNT", str(num_success_scripts))
-chen_comparison_markdown = chen_comparison_markdown.replace("OUR_SUCCESS_PERCENT", "{0:.1f}".format(num_success_scripts / total_num_scripts * 100))
+chen_comparison_placeholders = ["OUR_SUCCESS_COUNT", "OUR_SUCCESS_PERCENT", "OUR_ERROR_COUNT", "OUR_ERROR_PERCENT", "OUR_TOTAL"]
 
-chen_comparison_markdown = chen_comparison_markdown.replace("OUR_ERROR_COUNT", str(num_error_scripts))
-chen_comparison_markdown = chen_comparison_markdown.replace("OUR_ERROR_PERCENT", "{0:.1f}".format(num_error_scripts / total_num_scripts * 100))
+@pipeline.stage(writes=md_insert_paths("chen_total_comparison.md"))
+def chen_total_table(total_num_scripts, num_success_scripts, num_error_scripts):
+    chen_comparison_markdown = render_template(chen_comparison_template, chen_comparison_placeholders, {
+        "OUR_SUCCESS_COUNT": num_success_scripts,
+        "OUR_SUCCESS_PERCENT": "{0:.1f}".format(num_success_scripts / total_num_scripts * 100),
+        "OUR_ERROR_COUNT": num_error_scripts,
+        "OUR_ERROR_PERCENT": "{0:.1f}".format(num_error_scripts / total_num_scripts * 100),
+        "OUR_TOTAL": total_num_scripts})
 
-chen_comparison_markdown = chen_comparison_markdown.replace("OUR_TOTAL", str(total_num_scripts))
-
-write_file_from_string("chen_total_comparison.md", chen_comparison_markdown)
+    write_md_inserts({"chen_total_comparison.md": chen_comparison_markdown})
 
 
 # __Comparison of Error Categories__
@@ -183,7 +308,7 @@ write_file_from_string("chen_total_comparison.md", chen_comparison_markdown)
 # In[10]:
 
 
-category_comparison_md = '''
+category_comparison_template = '''
 ---------------------------------------------------------------
                         Chen (2018)              2022 
   ------------------- ------------- --------- ------- ---------
@@ -204,21 +329,21 @@ category_comparison_md = '''
 ---------------------------------------------------------------
 '''
 
-def replace_in_table(key, category, markdown, scripts_df, total):
-    error_count = len(scripts_df[scripts_df["nr_error_category"] == category].index)
-    markdown = markdown.replace(key + "_COUNT", str(error_count))
-    markdown = markdown.replace(key + "_PERCENT", "{0:.1f}".format(error_count / total * 100))
-    return(markdown)
+# Placeholder prefix of each error category in the table
+category_comparison_keys = {"LIBRARY": "library", "WD": "working directory", "FILE": "missing file", "FUNC": "function", "OTHER": "other"}
+category_comparison_placeholders = [key + suffix for key in category_comparison_keys for suffix in ["_COUNT", "_PERCENT"]] + ["ERROR_TOTAL"]
 
-category_comparison_md = replace_in_table("LIBRARY", "library", category_comparison_md, scripts_df, num_error_scripts)
-category_comparison_md = replace_in_table("WD", "working directory", category_comparison_md, scripts_df, num_error_scripts)
-category_comparison_md = replace_in_table("FILE", "missing file", category_comparison_md, scripts_df, num_error_scripts)
-category_comparison_md = replace_in_table("FUNC", "function", category_comparison_md, scripts_df, num_error_scripts)
-category_comparison_md = replace_in_table("OTHER", "other", category_comparison_md, scripts_df, num_error_scripts)
+@pipeline.stage(writes=md_insert_paths("chen_category_comparison.md"))
+def chen_category_table(nr_category_counts, num_error_scripts):
+    category_counts = nr_category_counts.groupby("category")["scripts"].sum()
 
-category_comparison_md = category_comparison_md.replace("ERROR_TOTAL", str(num_error_scripts))
+    values = {"ERROR_TOTAL": num_error_scripts}
+    for key, category in category_comparison_keys.items():
+        error_count = int(category_counts.get(category, 0))
+        values[key + "_COUNT"] = error_count
+        values[key + "_PERCENT"] = "{0:.1f}".format(error_count / num_error_scripts * 100)
 
-write_file_from_string("chen_category_comparison.md", category_comparison_md)
+    write_md_inserts({"chen_category_comparison.md": render_template(category_comparison_template, category_comparison_placeholders, values)})
 
 
 # __Breakdown by Subject and Dataset__
@@ -226,7 +351,7 @@ write_file_from_string("chen_category_comparison.md", category_comparison_md)
 # In[11]:
 
 
-subject_breakdown_md = '''
+subject_breakdown_template = '''
 -------------------------------------------------------------------------------------
   Subject                                Total Files   Total Error Files   Error Rate
   ------------------------------------ ------------- ------------------- ------------
@@ -257,77 +382,27 @@ subject_breakdown_md = '''
 -------------------------------------------------------------------------------------
 '''
 
-def replace_in_subject_table(key, markdown, subject_script_df):
-    total = len(subject_script_df.index)
-    error_count = len(subject_script_df[subject_script_df["nr_error_category"] != "success"].index)
-    markdown = markdown.replace(key + "_TOTAL", str(total))
-    markdown = markdown.replace(key + "_ERROR", str(error_count))
-    markdown = markdown.replace(key + "_PERC", "{0:.1f}".format(error_count / total * 100))
-    return(markdown)
-
-def get_subject_scripts(subject, dataset_df, scripts_df):
-    dois_in_subject = dataset_df[dataset_df[subject] == True]["doi"].values
-    scripts_from_doi = scripts_df[scripts_df.doi.isin(dois_in_subject)]
-    return scripts_from_doi
-
-for subject in subject_set:
-    subject_script_df = get_subject_scripts(subject, valid_datasets_df[["doi", subject]], scripts_df)
-    subject_breakdown_md = replace_in_subject_table(subject, subject_breakdown_md, subject_script_df)
-
-write_file_from_string("subject_breakdown.md", subject_breakdown_md)
-
-
-# __Errors by Year Plot__
-
-# In[12]:
-
-
-# Massage the data into the format used for plotting
-years = set(dataset_df["year"].values)
-year_breakdown = {"Year":[], "Total Files": [], "Total Error Files":[], "Error Rate (Rounded)":[]}
-for year in years:
-    scripts_in_year = overall_df[overall_df["year"] == year]
-    total_files = len(scripts_in_year.index)
-    if(total_files == 0):
-        continue
-        
-    year_breakdown["Year"].append(str(year))
-    total_error_files = len(scripts_in_year[scripts_in_year["nr_error_category"] != "success"].index)
-    year_breakdown["Total Files"].append(total_files)
-    year_breakdown["Total Error Files"].append(total_error_files)
-    year_breakdown["Error Rate (Rounded)"].append("{0:.4g}".format(total_error_files / total_files * 100))
-year_breakdown_df = pd.DataFrame(year_breakdown)
-year_breakdown_df.sort_values(["Year"], inplace=True)
-
-year_breakdown_df.columns = ["Year", "Total", "with Errors", "Error Rate"]
-year_melted_df = year_breakdown_df[["Year", "with Errors", "Total"]]    .loc[year_breakdown_df['Year'].isin(["2015","2016", "2017", "2018", "2019", "2020", "2021",])]    .melt(id_vars='Year').rename(columns=str.title)
-year_melted_df.columns = ["Year", "Count Type", "Count"]
-
-
-# In[13]:
-
-
-#plt.figure(figsize=(10, 5), dpi=300)
-plt.figure(dpi=300)
-sns.set(color_codes=True)
-sns.set_style("whitegrid")
-sns.set_context("notebook")
-ax = sns.barplot(x="Year", y="Count", hue="Count Type", data=year_melted_df, palette=sns.color_palette("Set1", n_colors=2, desat=.7))
-ax.set_title('Total Script and Error Count by Year')
-ax.set_xlabel("Dataset Publish Year")
-ax.set_ylabel("Number of Scripts")
-year_errors_df = year_melted_df[year_melted_df["Count Type"] == "with Errors"]
-x_index = 0
-for index, row in year_errors_df.iterrows():
-    x = row["Year"]
-    y = row["Count"]
-    total = year_melted_df[year_melted_df["Count Type"] == "Total"]
-    total = total[total["Year"] == row["Year"]]
-    perc = round(row["Count"] / total["Count"].values[0] * 100, 1)
-    ax.text(x=x_index,y=total["Count"].values[0],s=str(perc) + "%", ha="center")
-    x_index += 1
-#plt.show()
-plt.savefig('../figures/error_count_by_year.png', format="png")
+breakdown_subjects = ["Social Sciences", "Computer and Information Science", "Medicine, Health and Life Sciences", "Physics",
+                      "Engineering", "Other", "Business and Management", "Mathematical Sciences", "Arts and Humanities",
+                      "Agricultural Sciences", "Law", "Earth and Environmental Sciences"]
+subject_breakdown_placeholders = [subject + suffix for subject in breakdown_subjects for suffix in ["_TOTAL", "_ERROR", "_PERC"]]
+
+@pipeline.stage(writes=md_insert_paths("subject_breakdown.md"))
+def subject_breakdown_table(subject_list, no_raas_cube):
+    # Scripts of the datasets that did not time out
+    subject_counts = no_raas_cube.success_counts("subject", condition="no raas", timed_out=False)
+    subject_totals = subject_counts["n_success"] + subject_counts["n_error"]
+    subject_errors = subject_counts["n_error"]
+
+    values = {}
+    for subject in subject_list:
+        total = int(subject_totals.get(subject, 0))
+        error_count = int(subject_errors.get(subject, 0))
+        values[subject + "_TOTAL"] = total
+        values[subject + "_ERROR"] = error_count
+        values[subject + "_PERC"] = "{0:.1f}".format(error_count / total * 100)
+
+    write_md_inserts({"subject_breakdown.md": render_template(subject_breakdown_template, subject_breakdown_placeholders, values)})
 
 
 # __Errors by Subject Plot__
@@ -335,72 +410,43 @@ plt.savefig('../figures/error_count_by_year.png', format="png")
 # In[14]:
 
 
-subjects = dataset_df.loc[:, ~dataset_df.columns.isin(['doi', 'year', 'nr_time', 'nr_clean'])].columns
+@pipeline.stage(outputs=["subject_error_desc", "subject_counts_df"])
+def subject_error_rates(no_raas_cube, subject_list):
+    subject_counts = no_raas_cube.success_counts("subject", condition="no raas")
+    # Scripts of timed-out datasets have always been counted as one more group here, which takes
+    # part in the min and max subject percentages used in the prose
+    subject_counts.loc["nr_timed_out"] = no_raas_cube.success_counts("timed_out", condition="no raas").reindex([True], fill_value=0).iloc[0]
+    subject_counts = subject_counts.reindex(subject_list + ["nr_timed_out"], fill_value=0)
 
-subject_breakdown = {"Subject":[], "Total Files": [], "Total Error Files":[], "Error Rate (Rounded)":[]}
-subject_error_percs = {}
-for subject in subjects:
-    scripts_in_subject = overall_df[overall_df[subject] == True]
-    total_files = len(scripts_in_subject.index)
-    if(total_files == 0):
-        continue
-    
-    # Not directly used in the figure, but for inserting values into the prose later
-    subject_error_percs[subject] = [len(scripts_in_subject[scripts_in_subject.nr_error_category != "success"].index) / len(scripts_in_subject.index) * 100]
-    
-    subject_breakdown["Subject"].append(subject)
-    total_error_files = len(scripts_in_subject[scripts_in_subject["nr_error_category"] != "success"].index)
-    subject_breakdown["Total Files"].append(total_files)
-    subject_breakdown["Total Error Files"].append(total_error_files)
-    subject_breakdown["Error Rate (Rounded)"].append("{0:.4g}".format(total_error_files / total_files * 100))
-
-subject_error_percs.pop("Chemistry")
-subject_error_percs = pd.DataFrame(subject_error_percs)
-subject_error_desc = subject_error_percs.iloc[0].describe()
-
-subject_breakdown_df = pd.DataFrame(subject_breakdown)    
-subject_breakdown_df['Subject'] = pd.Categorical(subject_breakdown_df['Subject'],categories=['Social Sciences',                                                           'Computer and Information Science',                                                           'Medicine, Health and Life Sciences',                                                           'Physics',                                                           'Engineering',                                                           'Other',                                                           'Business and Management',                                                           'Mathematical Sciences',                                                           'Arts and Humanities',                                                           'Agricultural Sciences',                                                           'Law',                                                           'Earth and Environmental Sciences'],ordered=True)
-subject_breakdown_df = subject_breakdown_df.sort_values('Subject',ascending=True)
-subject_breakdown_df = subject_breakdown_df[~subject_breakdown_df["Subject"].isna()]
-
-subject_err_df = pd.DataFrame(columns=["Subject", "is_error"])
-
-for _, row in subject_breakdown_df.iterrows():
-    num_err = int(row["Total Error Files"])
-    num_suc = int(row["Total Files"] - row["Total Error Files"])
-    subject_err_df = subject_err_df.append(([pd.DataFrame({"Subject" : [row["Subject"]], "is_error": [0]})] * num_suc))
-    subject_err_df = subject_err_df.append(([pd.DataFrame({"Subject" : [row["Subject"]], "is_error": [1]})] * num_err))
-
-
-# In[15]:
-
-
-plt.figure(dpi=300)
-plt.xticks(rotation=-70, ha = "left")
-sns.set(color_codes=True)
-sns.set_style("whitegrid")
-sns.set_context("notebook")
-ax = sns.barplot(y=subject_err_df['Subject'], 
-                 x=subject_err_df['is_error'],
-                order=["Mathematical Sciences", 
-                      "Medicine, Health and Life Sciences",
-                      "Law",
-                      "Earth and Environmental Sciences",
-                      "Business and Management",
-                      "Agricultural Sciences",
-                      "Social Sciences",
-                      "Computer and Information Science",
-                      "Other",
-
-                      "Engineering",
-                      "Arts and Humanities",
-                      "Physics"])
-#ax.set_title('Script Failure Proportion by Subject')
-ax.set_ylabel("Subject")
-ax.set_xlabel("Fraction of Failing Scripts")
-plt.tight_layout()
-#plt.show()
-plt.savefig('../figures/error_rate_by_subject.png', format="png")
+    subject_breakdown = {"Subject":[], "Total Files": [], "Total Error Files":[]}
+    subject_error_percs = {}
+    for subject, counts in subject_counts.iterrows():
+        total_files = int(counts["n_success"] + counts["n_error"])
+        if(total_files == 0):
+            continue
+        total_error_files = int(counts["n_error"])
+
+        # Not directly used in the figure, but for inserting values into the prose later
+        subject_error_percs[subject] = [total_error_files / total_files * 100]
+
+        subject_breakdown["Subject"].append(subject)
+        subject_breakdown["Total Files"].append(total_files)
+        subject_breakdown["Total Error Files"].append(total_error_files)
+
+    subject_error_percs.pop("Chemistry")
+    subject_error_percs = pd.DataFrame(subject_error_percs)
+    subject_error_desc = subject_error_percs.iloc[0].describe()
+
+    subject_breakdown_df = pd.DataFrame(subject_breakdown)    
+    subject_breakdown_df['Subject'] = pd.Categorical(subject_breakdown_df['Subject'],categories=['Social Sciences',                                                           'Computer and Information Science',                                                           'Medicine, Health and Life Sciences',                                                           'Physics',                                                           'Engineering',                                                           'Other',                                                           'Business and Management',                                                           'Mathematical Sciences',                                                           'Arts and Humanities',                                                           'Agricultural Sciences',                                                           'Law',                                                           'Earth and Environmental Sciences'],ordered=True)
+    subject_breakdown_df = subject_breakdown_df.sort_values('Subject',ascending=True)
+    subject_breakdown_df = subject_breakdown_df[~subject_breakdown_df["Subject"].isna()]
+
+    # The figure is drawn from the script counts of each subject
+    subject_counts_df = pd.DataFrame({"Subject": subject_breakdown_df["Subject"].astype(str),
+                                      "n_success": subject_breakdown_df["Total Files"] - subject_breakdown_df["Total Error Files"],
+                                      "n_error": subject_breakdown_df["Total Error Files"]})
+    return(subject_error_desc, subject_counts_df)
 
 
 # Analyzing scripts that ran __*with*__ RaaS
@@ -417,115 +463,87 @@ plt.savefig('../figures/error_rate_by_subject.png', format="png")
 # In[16]:
 
 
-# Collect the path to all databases that contain data for datasets evaluated by RaaS
-db_files = [y for x in os.walk("../data/raas_dbs") for y in glob(os.path.join(x[0], '*app.db'))]
-
-# List of dataframes to concat later from each database
-result_dfs = []
-
-# Convert the dataset table written by RaaS to a dataframe for each database we have and then 
-# concat into a single dataframe we will use in the eval
-for db_file in db_files:
-    con = sqlite3.connect(db_file)
-    result_dfs.append(pd.read_sql_query("SELECT report FROM dataset", con))
-        
-# The final dataframe that contains all of the data from all devices that processed datasets with RaaS
-raas_df = pd.concat(result_dfs)
-
-def get_cleanliness_from_report(report):
-    report_dict = json.loads(report)
-    if len(report_dict["Individual Scripts"]) == 0:
-        return None
-    scripts_df = pd.DataFrame(report_dict["Individual Scripts"]).transpose()
-    scripts_df["Errors"] = scripts_df["Errors"].apply(lambda x: x[0] if x else "success")
-    error_set = set(scripts_df["Errors"].values)
-    return(len(error_set) == 1 and "success" in error_set)
-get_cleanliness_from_report_v = np.vectorize(get_cleanliness_from_report)
-
-def get_nums_scripts_from_report(report):
-    report_dict = json.loads(report)
-    return len(report_dict["Individual Scripts"])
-get_nums_scripts_from_report_v = np.vectorize(get_nums_scripts_from_report)
-
-raas_df["doi"] = get_doi_from_report_v(raas_df["report"].values)
-raas_df["raas_time"] = get_time_from_report_v(raas_df["report"].values)
-raas_df["raas_clean"] = get_cleanliness_from_report_v(raas_df["report"].values)
-raas_df["raas_num_scripts"] = get_nums_scripts_from_report_v(raas_df["report"].values)
-raas_df["raas_timed_out"] = False
-accidental_duplicated = list(raas_df.doi.value_counts()[raas_df.doi.value_counts() > 1].index)
-for duplicate in accidental_duplicated:
-    rows = list(raas_df[raas_df.doi == duplicate].index)
-    rows.pop(0)
-    raas_df = raas_df.drop(rows)
+if args.warehouse is None:
+    @pipeline.stage(outputs=["raas_reports_df", "raas_report_scripts_df", "raas_timeout_dois"], files=["../data/raas_dbs", "../data/raas_timeouts", "../data/vm_manifest.json", "raas_reports.py",
+                                                                                                      "chunked_ingest.py", "results_warehouse.py"])
+    def ingest_raas():
+        # Collect all databases that contain data for datasets evaluated by RaaS, and all files that
+        # list the datasets timed out when running with RaaS, the same ones in the same order as the
+        # warehouse loads, so that the combined data is in the same order on every machine
+        sources = raas_sources("../data")
+        db_sources = [source for source in sources if source.kind == "reports"]
+        db_files = [source.path for source in db_sources]
+
+        # Decode the dataset table written by RaaS in each database in parallel, then concat into the
+        # dataframes we will use in the eval. raas_df contains all of the data from all devices that
+        # processed datasets with RaaS, and raas_report_scripts_df the scripts inside each report.
+        memory_budget = None if args.memory_budget is None else args.memory_budget * MIB
+        raas_reports_df, raas_report_scripts_df = ingest_raas_dbs(db_files, args.workers, memory_budget)
+
+        # Some DOIs were accidentally evaluated on more than one VM. Keep one report of each by the
+        # same rules as the warehouse, the first one read unless --duplicates says otherwise.
+        raas_reports_df, raas_report_scripts_df = keep_one_report(raas_reports_df, raas_report_scripts_df, db_sources, duplicate_resolution)
+
+        timeout_doi_file_list = [source.path for source in sources if source.kind == "timeouts"]
+        return(raas_reports_df, raas_report_scripts_df, read_doi_lists(timeout_doi_file_list))
+else:
+    # Only one result per DOI is read from the warehouse
+    @pipeline.stage(outputs=["raas_reports_df", "raas_report_scripts_df", "raas_timeout_dois"], files=["results_warehouse.py"])
+    def ingest_raas(warehouse_manifest):
+        con = sqlite3.connect(args.warehouse)
+        raas_reports_df, raas_report_scripts_df = campaign_reports(con, treatment_campaigns, duplicate_resolution)
+        raas_timeout_dois = campaign_timeouts(con, treatment_campaigns)
+        con.close()
+        return(raas_reports_df, raas_report_scripts_df, raas_timeout_dois)
 
 
 # In[17]:
 
 
-# Collect the path to all files that contain data for datasets timed out when running with RaaS
-timeout_doi_file_list = [y for x in os.walk("../data/raas_timeouts") for y in glob(os.path.join(x[0], '*timeout-dois.txt'))]
-
-timeout_dois = []
-for timeout_file_path in timeout_doi_file_list:
-    with open(timeout_file_path, "r") as timeout_file:
-        timeout_dois = timeout_dois + timeout_file.readlines()
-
-timeout_dois = list(set(timeout_dois))
-both_datasets_complete_df = dataset_df.merge(raas_df.set_index("doi"), on="doi") 
-both_datasets_complete_df = both_datasets_complete_df[~both_datasets_complete_df.nr_clean.isna()]
-both_datasets_all_df = dataset_df.join(raas_df.set_index("doi"), on="doi") 
+# Join the RaaS results with the datasets and scripts that ran without RaaS
+@pipeline.stage(outputs=["raas_scripts_df", "both_datasets_complete_df", "both_datasets_all_df", "both_scripts_complete_df",
+                         "both_scripts_all_df", "scripts_datasets_both_complete", "both_no_timeouts"],
+                files=["error_classifier.py"])
+def join_raas(raas_reports_df, raas_report_scripts_df, raas_timeout_dois, doi_registry, dataset_df, scripts_df):
+    raas_df = raas_reports_df
+    raas_df["doi_id"] = doi_registry.doi_ids(raas_df["doi"])
+    raas_df["raas_timed_out"] = False
 
-timed_out_col_idx = both_datasets_complete_df.columns.get_loc("raas_timed_out")
-timed_out_row_idxs = both_datasets_complete_df[both_datasets_complete_df.doi.isin(strip_newlines_v(timeout_dois))].index
-both_datasets_complete_df.loc[timed_out_row_idxs, "raas_timed_out"] = True
+    raas_by_id_df = raas_df.drop(columns="doi").set_index("doi_id")
+    both_datasets_complete_df = dataset_df.merge(raas_by_id_df, on="doi_id") 
+    both_datasets_complete_df = both_datasets_complete_df[~both_datasets_complete_df.nr_clean.isna()]
+    both_datasets_all_df = dataset_df.join(raas_by_id_df, on="doi_id") 
 
-timed_out_col_idx = both_datasets_all_df.columns.get_loc("raas_timed_out")
-timed_out_row_idxs = both_datasets_all_df[both_datasets_all_df.doi.isin(strip_newlines_v(timeout_dois))].index
-both_datasets_all_df.loc[timed_out_row_idxs, "raas_timed_out"] = True
+    both_datasets_complete_df.loc[flag_dois(both_datasets_complete_df.doi, raas_timeout_dois), "raas_timed_out"] = True
+    both_datasets_all_df.loc[flag_dois(both_datasets_all_df.doi, raas_timeout_dois), "raas_timed_out"] = True
 
-#timed_out_col_idx = both_datasets_df.columns.get_loc("raas_timed_out")
-#timed_out_row_idxs = both_datasets_df[both_datasets_df.doi.isin(strip_newlines_v(timeout_dois))].index
+    raas_scripts_df = raas_report_scripts_df.reset_index(drop=True)
+    raas_scripts_df["script_key"] = doi_registry.script_keys(doi_registry.doi_ids(raas_scripts_df["doi"]), raas_scripts_df["script_name"])
+    raas_scripts_df = raas_scripts_df[["raas_error", "unique_id", "script_key"]]
+    if(raas_df.raas_timed_out_scripts.sum() > 0):
+        print(raas_df[raas_df.raas_timed_out_scripts > 0][["doi", "raas_timed_out_scripts"]])
+    raas_scripts_df = categorize_columns(raas_scripts_df, ["raas_error"])
+    raas_scripts_df["raas_error_category"] = classify_errors(raas_scripts_df["raas_error"])
 
+    raas_scripts_by_key_df = raas_scripts_df.drop(columns="unique_id").set_index("script_key")
+    both_scripts_complete_df = scripts_df.merge(raas_scripts_by_key_df, on="script_key")
+    both_scripts_all_df = scripts_df.join(raas_scripts_by_key_df, on="script_key")
+    scripts_datasets_both_complete = both_scripts_all_df[both_scripts_all_df.doi_id.isin(both_datasets_complete_df.doi_id)] 
 
-# In[18]:
+    both_no_timeouts = both_datasets_all_df[(both_datasets_all_df["raas_timed_out"] == False) & (both_datasets_all_df["nr_timed_out"] == False)]
+    #3033
+    return(raas_scripts_df, both_datasets_complete_df, both_datasets_all_df, both_scripts_complete_df, both_scripts_all_df, scripts_datasets_both_complete, both_no_timeouts)
 
 
-raas_scripts_dict = {"raas_error":[], "unique_id" : []}
-
-def get_scripts_info_from_report(report):
-    report_dict = json.loads(report)
-    if len(report_dict["Individual Scripts"]) < 1:
-        #print(report_dict["Additional Information"]["Container Name"])
-        return ([], [])
-    scripts_temp_df = pd.DataFrame(report_dict["Individual Scripts"]).transpose()
-    timed_out_scripts = scripts_temp_df[scripts_temp_df["Timed Out"] == True]
-    if(len(timed_out_scripts.index) > 0):
-        print(timed_out_scripts)
-    #timed_out_idxs = scripts_temp_df
-    return(scripts_temp_df.index.values, scripts_temp_df.Errors.values)
-
-for _, row in raas_df.iterrows():
-    filenames, errors = get_scripts_info_from_report(row["report"])
-    if len(filenames) == len(errors) and len(filenames) != 0:
-        raas_scripts_dict["raas_error"] = raas_scripts_dict["raas_error"] + [error if error != [] else "success" for error in errors]
-        raas_scripts_dict["unique_id"] = raas_scripts_dict["unique_id"] + list(create_script_id_v([row["doi"]] * len(filenames), filenames))
-        #raas_scripts_dict["doi"] = raas_scripts_dict["doi"] + [row["doi"]] * len(filenames)
-    else:
-        #print(row["doi"])
-        pass
-    #print(filenames)
-    
-#[error for error in raas_scripts_dict["error"] if error is not None and len(error) >1]
-raas_scripts_dict["raas_error"] = [error[0] if error != "success" else error for error in raas_scripts_dict["raas_error"]]
-raas_scripts_df = pd.DataFrame(raas_scripts_dict)
-raas_scripts_df["raas_error_category"] = determine_error_cause_v(raas_scripts_df["raas_error"])
+# In[ ]:
 
-both_scripts_complete_df = scripts_df.merge(raas_scripts_df.set_index("unique_id"), on="unique_id")
-both_scripts_all_df = scripts_df.join(raas_scripts_df.set_index("unique_id"), on="unique_id")
-scripts_datasets_both_complete = both_scripts_all_df[both_scripts_all_df.doi.isin(both_datasets_complete_df.doi)] 
 
-both_no_timeouts = both_datasets_all_df[(both_datasets_all_df["raas_timed_out"] == False) & (both_datasets_all_df["nr_timed_out"] == False)]
-#3033
+# The counts of the scripts with RaaS, added to the counts without RaaS
+@pipeline.stage(outputs=["cube"])
+def raas_counts(no_raas_cube, both_scripts_all_df, datasets_by_id_df, both_datasets_all_df, subject_table):
+    raas_timed_out = both_datasets_all_df.set_index("doi_id")["raas_timed_out"] == True
+    raas_cube = build_condition_cube("raas", both_scripts_all_df, "raas_error_category", datasets_by_id_df, raas_timed_out, subject_table)
+    return(no_raas_cube.combine(raas_cube))
 
 
 # ## Comparison of Timeout Information
@@ -533,7 +551,7 @@ both_no_timeouts = both_datasets_all_df[(both_datasets_all_df["raas_timed_out"]
 # In[19]:
 
 
-timed_out_md = '''
+timed_out_template = '''
 -----------------------------------------------------------------------------
     Datasets                                                          Scripts
   ---------- --------------- -------------- ---------------- ----------------
@@ -553,29 +571,28 @@ the percentages are out of the total number of datasets: TOTAL_DS. {#tbl:timeout
 '''
 
 
-def replace_total_perc_table(md, total, percent, key):
-    md = md.replace(key + "_TOTAL", str(total))
-    md = md.replace(key + "_PERC", str(percent))
-    return(md)
-
+timed_out_placeholders = ["TOTAL_DS", "TOTAL_SC"] + [key + suffix for key in ["DS_TO_WO_RAAS", "DS_TO_W_RAAS", "DS_BOTH_DONE", "SC_BOTH_DONE"] for suffix in ["_TOTAL", "_PERC"]]
 
-total_datasets = len(both_datasets_all_df.index)
-num_datasets_without_raas_timed_out = len(both_datasets_all_df[both_datasets_all_df.nr_time.isna() | both_datasets_all_df.nr_timed_out == True].index)
-num_datasets_with_raas_timed_out = len(both_datasets_all_df[both_datasets_all_df.raas_time.isna() | both_datasets_all_df.raas_timed_out == True].index)
-num_datasets_both_completed = len(both_datasets_all_df[(both_datasets_all_df["raas_timed_out"] == False) & (both_datasets_all_df["nr_timed_out"] == False)].index)
+def total_perc_values(key, total, percent):
+    return({key + "_TOTAL": total, key + "_PERC": percent})
 
-num_scripts_both_completed = len(both_scripts_complete_df.index)
-num_total_scripts = len(both_scripts_all_df.index)
+@pipeline.stage(writes=md_insert_paths("timed_out_comparisons.md"))
+def timeout_table(both_datasets_all_df, both_scripts_complete_df, both_scripts_all_df):
+    total_datasets = len(both_datasets_all_df.index)
+    num_datasets_without_raas_timed_out = len(both_datasets_all_df[both_datasets_all_df.nr_time.isna() | both_datasets_all_df.nr_timed_out == True].index)
+    num_datasets_with_raas_timed_out = len(both_datasets_all_df[both_datasets_all_df.raas_num_scripts.isna() | both_datasets_all_df.raas_timed_out == True].index)
+    num_datasets_both_completed = len(both_datasets_all_df[(both_datasets_all_df["raas_timed_out"] == False) & (both_datasets_all_df["nr_timed_out"] == False)].index)
 
-timed_out_md = timed_out_md.replace("TOTAL_DS", str(total_datasets))
-timed_out_md = timed_out_md.replace("TOTAL_SC", str(num_total_scripts))
+    num_scripts_both_completed = len(both_scripts_complete_df.index)
+    num_total_scripts = len(both_scripts_all_df.index)
 
-timed_out_md = replace_total_perc_table(timed_out_md, num_datasets_without_raas_timed_out, "{0:.1f}".format(num_datasets_without_raas_timed_out / total_datasets * 100), "DS_TO_WO_RAAS")
-timed_out_md = replace_total_perc_table(timed_out_md, num_datasets_with_raas_timed_out, "{0:.1f}".format(num_datasets_with_raas_timed_out / total_datasets * 100), "DS_TO_W_RAAS")
-timed_out_md = replace_total_perc_table(timed_out_md, num_datasets_both_completed, "{0:.1f}".format(num_datasets_both_completed / total_datasets * 100), "DS_BOTH_DONE")
-timed_out_md = replace_total_perc_table(timed_out_md, num_scripts_both_completed, "{0:.1f}".format(num_scripts_both_completed / num_total_scripts * 100), "SC_BOTH_DONE")
+    values = {"TOTAL_DS": total_datasets, "TOTAL_SC": num_total_scripts}
+    values.update(total_perc_values("DS_TO_WO_RAAS", num_datasets_without_raas_timed_out, "{0:.1f}".format(num_datasets_without_raas_timed_out / total_datasets * 100)))
+    values.update(total_perc_values("DS_TO_W_RAAS", num_datasets_with_raas_timed_out, "{0:.1f}".format(num_datasets_with_raas_timed_out / total_datasets * 100)))
+    values.update(total_perc_values("DS_BOTH_DONE", num_datasets_both_completed, "{0:.1f}".format(num_datasets_both_completed / total_datasets * 100)))
+    values.update(total_perc_values("SC_BOTH_DONE", num_scripts_both_completed, "{0:.1f}".format(num_scripts_both_completed / num_total_scripts * 100)))
 
-write_file_from_string("timed_out_comparisons.md", timed_out_md)
+    write_md_inserts({"timed_out_comparisons.md": render_template(timed_out_template, timed_out_placeholders, values)})
 
 
 # ## Success Rates Comparisons 
@@ -583,7 +600,7 @@ write_file_from_string("timed_out_comparisons.md", timed_out_md)
 # In[20]:
 
 
-success_rates_md = '''
+success_rates_template = '''
 ----------------------------------------------------------------------------
                               Scripts                   Datasets 
   -------------------- -------------- ----------- -------------- -----------
@@ -600,23 +617,28 @@ success_rates_md = '''
 ----------------------------------------------------------------------------
 '''
 
-def replace_success_rate_table(success_rates_md, total, good, key):
-    success_rates_md = success_rates_md.replace(key + "_TOTAL", str(total))
-    success_rates_md = success_rates_md.replace(key + "_GOOD", str(good))
-    success_rates_md = success_rates_md.replace(key + "_BAD", str(total - good))
-    success_rates_md = success_rates_md.replace(key + "_PERC", "{0:.1f}".format(good / total * 100))
-    return(success_rates_md)
+success_rates_placeholders = [key + suffix for key in ["SC_WO_RAAS", "SC_W_RAAS", "DS_WO_RAAS", "DS_W_RAAS"] for suffix in ["_TOTAL", "_GOOD", "_BAD", "_PERC"]]
+
+@pipeline.stage(outputs=["scripts_wo_raas", "scripts_w_raas"], writes=md_insert_paths("success_rates_comparisons.md"))
+def success_rates_table(scripts_datasets_both_complete, both_datasets_complete_df):
+    def success_rate_values(total, good, key):
+        return({key + "_TOTAL": total,
+                key + "_GOOD": good,
+                key + "_BAD": total - good,
+                key + "_PERC": "{0:.1f}".format(good / total * 100)})
 
-scripts_wo_raas = scripts_datasets_both_complete[~scripts_datasets_both_complete.nr_error.isna()]
-scripts_w_raas = scripts_datasets_both_complete[~scripts_datasets_both_complete.raas_error.isna()]
+    scripts_wo_raas = scripts_datasets_both_complete[~scripts_datasets_both_complete.nr_error.isna()]
+    scripts_w_raas = scripts_datasets_both_complete[~scripts_datasets_both_complete.raas_error.isna()]
 
-success_rates_md = replace_success_rate_table(success_rates_md, len(scripts_wo_raas.index), len(scripts_wo_raas[scripts_wo_raas["nr_error"] == "success"].index), "SC_WO_RAAS")
-success_rates_md = replace_success_rate_table(success_rates_md, len(scripts_w_raas.index), len(scripts_w_raas[scripts_w_raas["raas_error"] == "success"].index), "SC_W_RAAS")
+    values = {}
+    values.update(success_rate_values(len(scripts_wo_raas.index), len(scripts_wo_raas[scripts_wo_raas["nr_error"] == "success"].index), "SC_WO_RAAS"))
+    values.update(success_rate_values(len(scripts_w_raas.index), len(scripts_w_raas[scripts_w_raas["raas_error"] == "success"].index), "SC_W_RAAS"))
 
-success_rates_md = replace_success_rate_table(success_rates_md, len(both_datasets_complete_df.index), len(both_datasets_complete_df[both_datasets_complete_df.nr_clean].index), "DS_WO_RAAS")
-success_rates_md = replace_success_rate_table(success_rates_md, len(both_datasets_complete_df.index), len(both_datasets_complete_df[both_datasets_complete_df.raas_clean].index), "DS_W_RAAS")
+    values.update(success_rate_values(len(both_datasets_complete_df.index), len(both_datasets_complete_df[both_datasets_complete_df.nr_clean].index), "DS_WO_RAAS"))
+    values.update(success_rate_values(len(both_datasets_complete_df.index), len(both_datasets_complete_df[both_datasets_complete_df.raas_clean].index), "DS_W_RAAS"))
 
-write_file_from_string("success_rates_comparisons.md", success_rates_md)
+    write_md_inserts({"success_rates_comparisons.md": render_template(success_rates_template, success_rates_placeholders, values)})
+    return(scripts_wo_raas, scripts_w_raas)
 
 
 # ## Error Categories Comparison
@@ -624,7 +646,7 @@ write_file_from_string("success_rates_comparisons.md", success_rates_md)
 # In[21]:
 
 
-error_categories_md = '''
+error_categories_template = '''
 ------------------------------------------------------------
                         containR              RaaS 
   ------------------- ---------- --------- ------- ---------
@@ -645,86 +667,138 @@ error_categories_md = '''
 ------------------------------------------------------------
 '''
 
-def replace_error_category(precision, category, key, raas_error_scripts):
-    return(replace_total_perc_table(error_categories_md, 
-                             len(raas_error_scripts[raas_error_scripts.raas_error_category == category].index), 
-                             precision.format(len(raas_error_scripts[raas_error_scripts.raas_error_category == category].index) / total_raas_errors * 100), 
-                             key))
+# Placeholder prefix of each error category in the table
+error_categories_keys = {"LIB": "library", "WD": "working directory", "MF": "missing file", "F": "function", "OT": "other"}
+error_categories_placeholders = ["ALL_TOTAL"] + [key + suffix for key in error_categories_keys for suffix in ["_TOTAL", "_PERC"]]
 
-raas_error_scripts = raas_scripts_df[raas_scripts_df.raas_error != "success"]
-total_raas_errors = len(raas_error_scripts.index)
-error_categories_md = error_categories_md.replace("ALL_TOTAL", str(total_raas_errors))
+@pipeline.stage(outputs=["raas_error_scripts", "total_raas_errors"], writes=md_insert_paths("error_categories_comparisons.md"))
+def error_categories_table(raas_scripts_df):
+    raas_error_scripts = raas_scripts_df[raas_scripts_df.raas_error != "success"]
+    total_raas_errors = len(raas_error_scripts.index)
+    category_counts = raas_error_scripts.raas_error_category.value_counts()
 
-error_categories_md = replace_error_category("{0:.1f}", "library", "LIB", raas_error_scripts)
-error_categories_md = replace_error_category("{0:.1f}", "working directory", "WD", raas_error_scripts)
-error_categories_md = replace_error_category("{0:.1f}", "missing file", "MF", raas_error_scripts)
-error_categories_md = replace_error_category("{0:.1f}", "function", "F", raas_error_scripts)
-error_categories_md = replace_error_category("{0:.1f}", "other", "OT", raas_error_scripts)
+    values = {"ALL_TOTAL": total_raas_errors}
+    for key, category in error_categories_keys.items():
+        error_count = int(category_counts.get(category, 0))
+        values.update(total_perc_values(key, error_count, "{0:.1f}".format(error_count / total_raas_errors * 100)))
 
-
-write_file_from_string("error_categories_comparisons.md", error_categories_md)
+    write_md_inserts({"error_categories_comparisons.md": render_template(error_categories_template, error_categories_placeholders, values)})
+    return(raas_error_scripts, total_raas_errors)
 
 
 # In[22]:
 
 
-error_change_df = pd.crosstab(index=both_scripts_complete_df["nr_error_category"], columns=both_scripts_complete_df["raas_error_category"])
-if("timed out" not in error_change_df):
-    error_change_df["timed out"] = np.repeat([0], len(error_change_df))
-error_change_df.reindex(["library", "working directory", "missing file", "function", "other", "timed out", "success"])[["library", "working directory", "missing file", "function", "other", "success"]]
-
-# Once the data is there, mess with the markdown to get the right format
-error_change_md = error_change_df.to_markdown()
-error_change_md = error_change_md.replace("|", " ")
-error_change_md = error_change_md.replace(":", "-")
-error_change_list = error_change_md.split("\n")
-error_change_list[0], error_change_list[1] = error_change_list[1], error_change_list[0]
-#error_change_list[1] = "     " + error_change_list[1]
-error_change_list.insert(2, "  **Pre-RaaS**\n")
-
-list_idxs = list(range(0, len(error_change_list)))
-list_idxs.reverse()
-
-for idx in list_idxs:
-    if(idx != list_idxs[-1]): 
-        error_change_list[idx] = error_change_list[idx][:19] + "     " + error_change_list[idx][19:]
-    error_change_list.insert(idx, " ")
-
-error_change_list.append(" ")
-print(error_change_list.pop(2))
-error_change_md = "\n".join(error_change_list)
-error_change_md = '''
+error_change_header = '''
 --------------------------------------------------------------------------------------------------------------
-                           **Post-RaaS**                                                                 ''' + error_change_md
+                           **Post-RaaS**                                                                 '''
 
-error_change_md = error_change_md + '''
+error_change_footer = '''
 --------------------------------------------------------------------------------------------------------------
 '''
 
-error_change_md = error_change_md[:220] + "----" + error_change_md[220:]
-error_change_md = error_change_md[:349] + "                 " + error_change_md[366:]
+@pipeline.stage(outputs=["transitions"], writes=md_insert_paths("error_change_table.md"))
+def error_change_table(both_scripts_complete_df):
+    # How the category of each script changed from the evaluation without RaaS to the one with RaaS.
+    # Later evaluations, such as a RaaS rerun, would be added here as more conditions.
+    transitions = TransitionMatrices(both_scripts_complete_df, {"no raas": "nr_error_category", "raas": "raas_error_category"})
+    error_change_df = transitions.frame("no raas", "raas", index_name="nr_error_category", columns_name="raas_error_category")
+    if("timed out" not in error_change_df):
+        error_change_df["timed out"] = np.repeat([0], len(error_change_df))
+    error_change_df.reindex(["library", "working directory", "missing file", "function", "other", "timed out", "success"])[["library", "working directory", "missing file", "function", "other", "success"]]
+
+    # Once the data is there, mess with the markdown to get the right format
+    error_change_md = error_change_df.to_markdown()
+    error_change_md = error_change_md.replace("|", " ")
+    error_change_md = error_change_md.replace(":", "-")
+    error_change_list = error_change_md.split("\n")
+    error_change_list[0], error_change_list[1] = error_change_list[1], error_change_list[0]
+    #error_change_list[1] = "     " + error_change_list[1]
+    error_change_list.insert(2, "  **Pre-RaaS**\n")
+
+    list_idxs = list(range(0, len(error_change_list)))
+    list_idxs.reverse()
+
+    for idx in list_idxs:
+        if(idx != list_idxs[-1]): 
+            error_change_list[idx] = error_change_list[idx][:19] + "     " + error_change_list[idx][19:]
+        error_change_list.insert(idx, " ")
+
+    error_change_list.append(" ")
+    print(error_change_list.pop(2))
+    error_change_md = "\n".join(error_change_list)
+    error_change_md = error_change_header + error_change_md
 
-write_file_from_string("error_change_table.md", error_change_md)
+    error_change_md = error_change_md + error_change_footer
+
+    error_change_md = error_change_md[:220] + "----" + error_change_md[220:]
+    error_change_md = error_change_md[:349] + "                 " + error_change_md[366:]
+
+    write_md_inserts({"error_change_table.md": error_change_md})
+    return(transitions)
 
 
 # In[23]:
 
 
-all_clean_completed_datasets_df = both_datasets_complete_df[both_datasets_complete_df.nr_clean & both_datasets_complete_df.raas_clean]
-#print(len(all_clean_completed_datasets_df.index))
-#plt.figure(figsize=(10, 5), dpi=300)
-plt.figure(dpi=300)
-sns.set(color_codes=True)
-sns.set_style("whitegrid")
-sns.set_context("notebook")
-ax = sns.scatterplot(x="nr_time", y="raas_time", data=all_clean_completed_datasets_df, color = ".2", marker ="+")
-ax.set_title('Comparison of Runtimes')
-ax.set_xlabel("Runtime Without RaaS in Seconds")
-ax.set_ylabel("Runtime With RaaS in Seconds")
-plt.tight_layout()
-ax.axline([0, 0], [1, 1], linewidth=1, alpha = 0.5, color = "0.2")
-#plt.show()
-plt.savefig('../figures/runtime-comparison.png', format="png")
+@pipeline.stage(outputs=["all_clean_completed_datasets_df"])
+def runtime_comparison_data(both_datasets_complete_df):
+    all_clean_completed_datasets_df = both_datasets_complete_df[both_datasets_complete_df.nr_clean & both_datasets_complete_df.raas_clean]
+    #print(len(all_clean_completed_datasets_df.index))
+    return(all_clean_completed_datasets_df)
+
+runtime_quantiles_template = '''
+--------------------------------------------------------------------
+                             Control   Treatment   Overhead Ratio
+  ------------------------ --------- ----------- ----------------
+                Median (s)  CTRL_P50   TREAT_P50        RATIO_P50
+
+       90th percentile (s)  CTRL_P90   TREAT_P90        RATIO_P90
+
+       99th percentile (s)  CTRL_P99   TREAT_P99        RATIO_P99
+
+        At the timeout cap  CTRL_CAP   TREAT_CAP
+
+--------------------------------------------------------------------
+
+Table: Runtime percentiles of the CTRL_DS datasets with a runtime without RaaS and the TREAT_DS datasets with a runtime with RaaS, where a dataset that timed out counts as the TIMEOUT_LIMIT second cap, and percentiles of the overhead ratio (runtime with RaaS over runtime without) of the RATIO_DS datasets that completed under both. {#tbl:runtime-quantiles}
+'''
+
+runtime_quantiles_placeholders = ["CTRL_P50", "TREAT_P50", "RATIO_P50", "CTRL_P90", "TREAT_P90", "RATIO_P90", "CTRL_P99", "TREAT_P99", "RATIO_P99",
+                                  "CTRL_CAP", "TREAT_CAP", "CTRL_DS", "TREAT_DS", "RATIO_DS", "TIMEOUT_LIMIT"]
+
+# A table of the overhead ratio percentiles of each subject or year
+def overhead_ratio_md(ratio_df, label, caption):
+    widths = [36, 10, 8, 8, 8]
+    lines = ["", "  {0:<36} {1:>10} {2:>8} {3:>8} {4:>8}".format(label, "Datasets", "Median", "p90", "p99"),
+             "  " + " ".join("-" * width for width in widths)]
+    for group, row in ratio_df.iterrows():
+        lines.append("  {0:<36} {1:>10} {2:>8.2f} {3:>8.2f} {4:>8.2f}".format(str(group), int(row["datasets"]), row["p50"], row["p90"], row["p99"]))
+    return("\n".join(lines) + "\n\nTable: " + caption + "\n")
+
+# Runtime percentiles, the share of datasets at the timeout cap and the overhead of RaaS by subject
+# and year, from mergeable sketches built in one pass over the datasets
+@pipeline.stage(files=["runtime_stats.py"], writes=md_insert_paths("runtime_quantiles.md", "runtime_overhead_by_subject.md", "runtime_overhead_by_year.md"))
+def runtime_statistics(both_datasets_all_df, subject_table):
+    summary = summarize_runtimes([both_datasets_all_df], subject_table)
+    quantiles = [0.5, 0.9, 0.99]
+    control = summary.runtimes["control"].quantile(quantiles)
+    treatment = summary.runtimes["treatment"].quantile(quantiles)
+    ratios = summary.ratios.quantile(quantiles)
+
+    values = {"CTRL_DS": summary.runtimes["control"].count, "TREAT_DS": summary.runtimes["treatment"].count, "RATIO_DS": summary.ratios.count,
+              "CTRL_CAP": "{0:.1f}%".format(summary.cap_share("control") * 100), "TREAT_CAP": "{0:.1f}%".format(summary.cap_share("treatment") * 100),
+              "TIMEOUT_LIMIT": "{0:,}".format(TIMEOUT_SECONDS)}
+    for idx, name in enumerate(["P50", "P90", "P99"]):
+        values["CTRL_" + name] = "{0:,.0f}".format(control[idx])
+        values["TREAT_" + name] = "{0:,.0f}".format(treatment[idx])
+        values["RATIO_" + name] = "{0:.2f}".format(ratios[idx])
+
+    write_md_inserts({"runtime_quantiles.md": render_template(runtime_quantiles_template, runtime_quantiles_placeholders, values),
+                      "runtime_overhead_by_subject.md": overhead_ratio_md(summary.ratio_table("subject"), "Subject",
+                                                                          "Overhead ratio (runtime with RaaS over runtime without) of the datasets of each subject that completed under both. {#tbl:runtime-overhead-subject}"),
+                      "runtime_overhead_by_year.md": overhead_ratio_md(summary.ratio_table("year"), "Year",
+                                                                       "Overhead ratio (runtime with RaaS over runtime without) of the datasets published each year that completed under both. {#tbl:runtime-overhead-year}")})
 
 
 # ## Individual Values Used in the Paper
@@ -732,173 +806,210 @@ plt.savefig('../figures/runtime-comparison.png', format="png")
 # In[24]:
 
 
-#r_file_query = "name:renv.lock"
-#api_url="https://dataverse.harvard.edu/api/search/"
-#lock_results = requests.get(api_url, params= {"q": r_file_query, "type": "file", "start":"0", "per_page":"100"}).json()
-#with open("../data/lockfiles_on_dataverse_2022_06_16.json", "w+") as lockfile_json:
-#    json.dump(lock_results, lockfile_json)
+@pipeline.stage(files=["../data/lockfiles_on_dataverse_2022_06_16.json", "../data/r_dois.txt"], writes=md_insert_paths("lockfiles.md", "num_of_datasets.md"))
+def dataset_count_values():
+    inserts = {}
+    #r_file_query = "name:renv.lock"
+    #api_url="https://dataverse.harvard.edu/api/search/"
+    #lock_results = requests.get(api_url, params= {"q": r_file_query, "type": "file", "start":"0", "per_page":"100"}).json()
+    #with open("../data/lockfiles_on_dataverse_2022_06_16.json", "w+") as lockfile_json:
+    #    json.dump(lock_results, lockfile_json)
+
+    with open("../data/lockfiles_on_dataverse_2022_06_16.json", "r") as lockfile_json:
+        lockfile_data = json.load(lockfile_json)
+    inserts["lockfiles.md"] = str(lockfile_data["data"]["total_count"])
 
-with open("../data/lockfiles_on_dataverse_2022_06_16.json", "r") as lockfile_json:
-    lockfile_data = json.load(lockfile_json)
-write_file_from_string("lockfiles.md", str(lockfile_data["data"]["total_count"]))
+    with open("../data/r_dois.txt", "r") as dois_txt:
+        r_dois = dois_txt.readlines()
+    inserts["num_of_datasets.md"] = str(len(r_dois))
+    write_md_inserts(inserts)
 
-with open("../data/r_dois.txt", "r") as dois_txt:
-    r_dois = dois_txt.readlines()
-write_file_from_string("num_of_datasets.md", str(len(r_dois)))
 
-write_file_from_string("num_successful_scripts_noraas.md", "{0:.1f}%".format(num_success_scripts / total_num_scripts * 100))
+# In[ ]:
+
+
+@pipeline.stage(writes=md_insert_paths("num_successful_scripts_noraas.md", "num_successful_datasets_noraas.md", "perc_successful_datasets_noraas.md", "perc_library_errors_noraas.md", "number_of_physics_scripts.md", "min_subject_perc.md", "max_subject_perc.md", "missing_file_perc_control.md"))
+def no_raas_values(scripts_df, dataset_df, overall_df, total_num_scripts, num_success_scripts, num_error_scripts, subject_error_desc, subject_table):
+    inserts = {}
+    inserts["num_successful_scripts_noraas.md"] = "{0:.1f}%".format(num_success_scripts / total_num_scripts * 100)
 
-write_file_from_string("num_successful_datasets_noraas.md", str(len(dataset_df[dataset_df.nr_clean].index)))
+    inserts["num_successful_datasets_noraas.md"] = str(len(dataset_df[dataset_df.nr_clean].index))
 
-write_file_from_string("perc_successful_datasets_noraas.md", "{0:.1f}%".format(len(dataset_df[dataset_df.nr_clean].index) / len(dataset_df.index) * 100))
+    inserts["perc_successful_datasets_noraas.md"] = "{0:.1f}%".format(len(dataset_df[dataset_df.nr_clean].index) / len(dataset_df.index) * 100)
 
-write_file_from_string("perc_library_errors_noraas.md", "{0:.1f}%".format(len(scripts_df[scripts_df["nr_error_category"] == 'library'].index) / num_error_scripts * 100))
+    inserts["perc_library_errors_noraas.md"] = "{0:.1f}%".format(len(scripts_df[scripts_df["nr_error_category"] == 'library'].index) / num_error_scripts * 100)
 
-physics_df = overall_df[~overall_df.Physics.isna()]
-physics_df = physics_df[physics_df.Physics]
-write_file_from_string("number_of_physics_scripts.md", str(len(physics_df.index)))
+    physics_df = overall_df[subject_table.has_any(overall_df["subjects"], "Physics")]
+    inserts["number_of_physics_scripts.md"] = str(len(physics_df.index))
 
-#write_file_from_string("num_of_both_clean_datasets.md", str(len(all_clean_completed_datasets_df.index)))
+    inserts["min_subject_perc.md"] = "{0:.1f}%".format(subject_error_desc["min"])
+    inserts["max_subject_perc.md"] = "{0:.1f}%".format(subject_error_desc["max"])
 
-#write_file_from_string("num_of_both_completed_datasets.md", str(num_datasets_both_completed))
-#write_file_from_string("num_of_both_completed_scripts.md", str(num_scripts_both_completed))
+    inserts["missing_file_perc_control.md"] = "{0:.1f}%".format(len(scripts_df[scripts_df["nr_error_category"] == "missing file"].index) / num_error_scripts * 100)
+    write_md_inserts(inserts)
+
+
+# In[ ]:
 
-scripts_in_datasets_both_completed = both_scripts_all_df[both_scripts_all_df.doi.isin(both_no_timeouts.doi)]
-scripts_sourced = scripts_in_datasets_both_completed[scripts_in_datasets_both_completed.raas_error.isna()]
-num_of_success_source_scripts = len(scripts_sourced[scripts_sourced.nr_error_category == "success"].index)
-perc_success_sourced_in_raas = num_of_success_source_scripts / len(both_scripts_complete_df[both_scripts_complete_df.nr_error_category == "success"].index) * 100
-write_file_from_string("num_of_success_source_scripts.md", str(num_of_success_source_scripts))
-write_file_from_string("perc_success_sourced_in_raas.md", "{0:.1f}%".format(perc_success_sourced_in_raas))
 
-success_increase = "{0:.3g}x".format(len(both_scripts_complete_df[both_scripts_complete_df.raas_error_category == "success"]) / len(both_scripts_complete_df[both_scripts_complete_df.nr_error_category == "success"]))
-write_file_from_string("success_increase.md", success_increase)
+@pipeline.stage(writes=md_insert_paths("num_of_success_source_scripts.md", "perc_success_sourced_in_raas.md", "success_increase.md", "nr_raas_clean_dataset_increase.md", "clean_raas_datasets.md", "perc_clean_raas_datasets.md", "library_to_success.md", "perc_library_fixed.md", "perc_wd_fixed.md", "perc_mf_fixed.md", "mf_no_change.md", "perc_other_fixed.md", "perc_library_not_repeated.md", "perc_wd_not_repeated.md"))
+def raas_values(both_scripts_all_df, both_scripts_complete_df, both_datasets_complete_df, both_datasets_all_df, both_no_timeouts, transitions):
+    inserts = {}
+    #write_file_from_string("num_of_both_clean_datasets.md", str(len(all_clean_completed_datasets_df.index)))
 
-clean_raas_datasets = len(both_datasets_complete_df[both_datasets_complete_df.raas_clean == True].index)
-clean_nr_datasets = len(both_datasets_complete_df[both_datasets_complete_df.nr_clean == True].index)
+    #write_file_from_string("num_of_both_completed_datasets.md", str(num_datasets_both_completed))
+    #write_file_from_string("num_of_both_completed_scripts.md", str(num_scripts_both_completed))
 
-write_file_from_string("nr_raas_clean_dataset_increase.md","{0:.3g}x".format(clean_raas_datasets / clean_nr_datasets))
-write_file_from_string("clean_raas_datasets.md", str(clean_raas_datasets))
-write_file_from_string("perc_clean_raas_datasets.md", "{0:.1f}%".format(clean_raas_datasets / len(both_datasets_all_df[~both_datasets_all_df.raas_time.isna()].index) * 100))
+    scripts_in_datasets_both_completed = both_scripts_all_df[both_scripts_all_df.doi_id.isin(both_no_timeouts.doi_id)]
+    scripts_sourced = scripts_in_datasets_both_completed[scripts_in_datasets_both_completed.raas_error.isna()]
+    num_of_success_source_scripts = len(scripts_sourced[scripts_sourced.nr_error_category == "success"].index)
+    perc_success_sourced_in_raas = num_of_success_source_scripts / len(both_scripts_complete_df[both_scripts_complete_df.nr_error_category == "success"].index) * 100
+    inserts["num_of_success_source_scripts.md"] = str(num_of_success_source_scripts)
+    inserts["perc_success_sourced_in_raas.md"] = "{0:.1f}%".format(perc_success_sourced_in_raas)
 
-write_file_from_string("library_to_success.md", str(error_change_df.loc["library"]["success"]))
+    success_increase = "{0:.3g}x".format(len(both_scripts_complete_df[both_scripts_complete_df.raas_error_category == "success"]) / len(both_scripts_complete_df[both_scripts_complete_df.nr_error_category == "success"]))
+    inserts["success_increase.md"] = success_increase
 
-def find_perc_change(cat_from, cat_to):
-    return(error_change_df.loc[cat_from][cat_to] / sum(error_change_df.loc[cat_from]) * 100)
+    clean_raas_datasets = len(both_datasets_complete_df[both_datasets_complete_df.raas_clean == True].index)
+    clean_nr_datasets = len(both_datasets_complete_df[both_datasets_complete_df.nr_clean == True].index)
 
-def write_perc_change(filename, cat_from, cat_to):
-    write_file_from_string(filename, "{0:.1f}%".format(find_perc_change(cat_from, cat_to)))
+    inserts["nr_raas_clean_dataset_increase.md"] = "{0:.3g}x".format(clean_raas_datasets / clean_nr_datasets)
+    inserts["clean_raas_datasets.md"] = str(clean_raas_datasets)
+    inserts["perc_clean_raas_datasets.md"] = "{0:.1f}%".format(clean_raas_datasets / len(both_datasets_all_df[~both_datasets_all_df.raas_num_scripts.isna()].index) * 100)
 
-def find_perc_diff(category):
-    return((sum(error_change_df.loc[category]) - error_change_df.loc[category][category]) / sum(error_change_df.loc[category]) * 100)
+    error_change_df = transitions.frame("no raas", "raas")
+    # Percent of each category without RaaS that went to each category with RaaS, and that changed category
+    perc_change_df = transitions.shares("no raas", "raas")
+    perc_diff = transitions.changed_shares("no raas", "raas")
 
-def write_perc_diff(filename, category):
-    write_file_from_string(filename, "{0:.1f}%".format(find_perc_diff(category)))
+    def write_perc_change(filename, cat_from, cat_to):
+        inserts[filename] = "{0:.1f}%".format(perc_change_df.loc[cat_from, cat_to])
+
+    def write_perc_diff(filename, category):
+        inserts[filename] = "{0:.1f}%".format(perc_diff[category])
     
-write_perc_change("perc_library_fixed.md", cat_from = "library", cat_to = "success")
-write_perc_change("perc_wd_fixed.md", cat_from = "working directory", cat_to = "success")
-write_perc_change("perc_mf_fixed.md", cat_from = "missing file", cat_to = "success")
-write_perc_change("mf_no_change.md", cat_from = "missing file", cat_to = "missing file")
-write_perc_change("perc_other_fixed.md", cat_from = "other", cat_to = "success")
+    write_perc_change("perc_library_fixed.md", cat_from = "library", cat_to = "success")
+    write_perc_change("perc_wd_fixed.md", cat_from = "working directory", cat_to = "success")
+    write_perc_change("perc_mf_fixed.md", cat_from = "missing file", cat_to = "success")
+    write_perc_change("mf_no_change.md", cat_from = "missing file", cat_to = "missing file")
+    write_perc_change("perc_other_fixed.md", cat_from = "other", cat_to = "success")
+
+    write_perc_diff("perc_library_not_repeated.md", "library")
+    write_perc_diff("perc_wd_not_repeated.md", "working directory")
 
-write_perc_diff("perc_library_not_repeated.md", "library")
-write_perc_diff("perc_wd_not_repeated.md", "working directory")
+    inserts["library_to_success.md"] = str(error_change_df.loc["library", "success"])
+    write_md_inserts(inserts)
 
-write_file_from_string("library_to_success.md", str(error_change_df.loc["library"]["success"]))
 
-write_file_from_string("min_subject_perc.md", "{0:.1f}%".format(subject_error_desc["min"]))
-write_file_from_string("max_subject_perc.md", "{0:.1f}%".format(subject_error_desc["max"]))
+# In[ ]:
 
-raas_library_errors = both_scripts_all_df[both_scripts_all_df.raas_error_category == "library"]
-def get_package_name_from_error(error_msg):
-    package_match = re.search("\‘(.+)\’", error_msg)
-    if(package_match):
-        package_match = package_match.group(1)
-    return package_match
-get_package_name_from_error_v = np.vectorize(get_package_name_from_error)
-packages_not_loaded = get_package_name_from_error_v(raas_library_errors.raas_error)
 
-write_file_from_string("len_set_not_loaded_packages.md", str(len(set(packages_not_loaded))))
+@pipeline.stage(outputs=["raas_library_errors"], writes=md_insert_paths("len_set_not_loaded_packages.md", "missing_file_perc_treat.md"))
+def library_error_values(both_scripts_all_df, raas_error_scripts, total_raas_errors):
+    inserts = {}
+    raas_library_errors = both_scripts_all_df[both_scripts_all_df.raas_error_category == "library"]
+    def get_package_name_from_error(error_msg):
+        package_match = re.search("\‘(.+)\’", error_msg)
+        if(package_match):
+            package_match = package_match.group(1)
+        return package_match
+    get_package_name_from_error_v = np.vectorize(get_package_name_from_error)
+    packages_not_loaded = get_package_name_from_error_v(raas_library_errors.raas_error)
 
-write_file_from_string("missing_file_perc_control.md", "{0:.1f}%".format(len(scripts_df[scripts_df["nr_error_category"] == "missing file"].index) / num_error_scripts * 100))
-write_file_from_string("missing_file_perc_treat.md", "{0:.1f}%".format(len(raas_error_scripts[raas_error_scripts.raas_error_category == "missing file"].index) / total_raas_errors * 100))
+    inserts["len_set_not_loaded_packages.md"] = str(len(set(packages_not_loaded)))
+    inserts["missing_file_perc_treat.md"] = "{0:.1f}%".format(len(raas_error_scripts[raas_error_scripts.raas_error_category == "missing file"].index) / total_raas_errors * 100)
+    write_md_inserts(inserts)
+    return(raas_library_errors)
 
 
 # In[25]:
 
 
-other_to_success = both_scripts_all_df[(both_scripts_all_df.nr_error_category == "other") & (both_scripts_all_df.raas_error_category == "success")] 
-def get_missing_objects_errors(error_msg):
-    if(re.search("object.+not found", error_msg)):
-        return error_msg
-    else:
-        return None
-get_missing_objects_errors_v = np.vectorize(get_missing_objects_errors)
+@pipeline.stage(writes=md_insert_paths("miss_obj_to_success.md"))
+def missing_object_values(both_scripts_all_df):
+    other_to_success = both_scripts_all_df[(both_scripts_all_df.nr_error_category == "other") & (both_scripts_all_df.raas_error_category == "success")] 
+    def get_missing_objects_errors(error_msg):
+        if(re.search("object.+not found", error_msg)):
+            return error_msg
+        else:
+            return None
+    get_missing_objects_errors_v = np.vectorize(get_missing_objects_errors)
 
-missing_object_msgs = set(get_missing_objects_errors_v(other_to_success.nr_error))
-missing_object_msgs.remove(None)
+    missing_object_msgs = set(get_missing_objects_errors_v(other_to_success.nr_error))
+    missing_object_msgs.remove(None)
 
-write_file_from_string("miss_obj_to_success.md", str(len(missing_object_msgs)))
+    write_md_inserts({"miss_obj_to_success.md": str(len(missing_object_msgs))})
 
 
 # In[26]:
 
 
-def get_devoff_errors(error_msg):
-    if(re.search("dev.off()", error_msg)):
-        return True
-    else:
-        return None
-get_devoff_errors_v = np.vectorize(get_devoff_errors)
+@pipeline.stage(writes=md_insert_paths("num_success_to_error.md", "success_to_error_rdtLite_errors.md", "success_to_error_mf_errors.md", "success_to_error_func_errors.md", "success_to_error_other_errors.md", "perc_successful_scripts_raas.md", "perc_successful_scripts_noraas.md", "perc_error_scripts_raas.md", "perc_easily_fixed.md", "list_of_example_other_errors.md", "faster_with_raas_datasets.md", "library_version_loaded.md"))
+def success_to_error_values(both_scripts_all_df, both_scripts_complete_df, scripts_w_raas, scripts_wo_raas, transitions, raas_error_scripts,
+                            all_clean_completed_datasets_df, raas_library_errors):
+    inserts = {}
+    def get_devoff_errors(error_msg):
+        if(re.search("dev.off()", error_msg)):
+            return True
+        else:
+            return None
+    get_devoff_errors_v = np.vectorize(get_devoff_errors)
 
-success_to_error = both_scripts_all_df[(both_scripts_all_df.nr_error_category == "success") & (both_scripts_all_df.raas_error_category != "success")] 
-success_to_error = success_to_error[~success_to_error.raas_error_category.isna()]
-success_to_error_rdtLite_errors = len(success_to_error[(get_devoff_errors_v(success_to_error.raas_error)) | (success_to_error.raas_error == "rdtLite Error")])
-success_to_error_noRdtLite = success_to_error[~((get_devoff_errors_v(success_to_error.raas_error)) | (success_to_error.raas_error == "rdtLite Error"))]
-success_to_error_mf_errors = len(success_to_error_noRdtLite[success_to_error_noRdtLite.raas_error_category == "missing file"])
-success_to_error_func_errors = len(success_to_error_noRdtLite[success_to_error_noRdtLite.raas_error_category == "function"])
-success_to_error_other_errors = len(success_to_error_noRdtLite[success_to_error_noRdtLite.raas_error_category == "other"])
+    success_to_error = both_scripts_all_df[(both_scripts_all_df.nr_error_category == "success") & (both_scripts_all_df.raas_error_category != "success")] 
+    success_to_error = success_to_error[~success_to_error.raas_error_category.isna()]
+    success_to_error_rdtLite_errors = len(success_to_error[(get_devoff_errors_v(success_to_error.raas_error)) | (success_to_error.raas_error == "rdtLite Error")])
+    success_to_error_noRdtLite = success_to_error[~((get_devoff_errors_v(success_to_error.raas_error)) | (success_to_error.raas_error == "rdtLite Error"))]
+    success_to_error_mf_errors = len(success_to_error_noRdtLite[success_to_error_noRdtLite.raas_error_category == "missing file"])
+    success_to_error_func_errors = len(success_to_error_noRdtLite[success_to_error_noRdtLite.raas_error_category == "function"])
+    success_to_error_other_errors = len(success_to_error_noRdtLite[success_to_error_noRdtLite.raas_error_category == "other"])
 
 
-write_file_from_string("num_success_to_error.md", str(len(success_to_error)))
-write_file_from_string("success_to_error_rdtLite_errors.md", str(success_to_error_rdtLite_errors))
-write_file_from_string("success_to_error_mf_errors.md", str(success_to_error_mf_errors))
-write_file_from_string("success_to_error_func_errors.md", str(success_to_error_func_errors))
-write_file_from_string("success_to_error_other_errors.md", str(success_to_error_other_errors))
+    inserts["num_success_to_error.md"] = str(len(success_to_error))
+    inserts["success_to_error_rdtLite_errors.md"] = str(success_to_error_rdtLite_errors)
+    inserts["success_to_error_mf_errors.md"] = str(success_to_error_mf_errors)
+    inserts["success_to_error_func_errors.md"] = str(success_to_error_func_errors)
+    inserts["success_to_error_other_errors.md"] = str(success_to_error_other_errors)
 
-write_file_from_string("perc_successful_scripts_raas.md", "{0:.1f}%".format(len(scripts_w_raas[scripts_w_raas["raas_error"] == "success"].index) / len(scripts_w_raas.index) * 100))
-write_file_from_string("perc_successful_scripts_noraas.md", "{0:.1f}%".format(len(scripts_wo_raas[scripts_wo_raas["nr_error"] == "success"].index) / len(scripts_wo_raas.index) * 100))
+    inserts["perc_successful_scripts_raas.md"] = "{0:.1f}%".format(len(scripts_w_raas[scripts_w_raas["raas_error"] == "success"].index) / len(scripts_w_raas.index) * 100)
+    inserts["perc_successful_scripts_noraas.md"] = "{0:.1f}%".format(len(scripts_wo_raas[scripts_wo_raas["nr_error"] == "success"].index) / len(scripts_wo_raas.index) * 100)
 
-write_file_from_string("perc_error_scripts_raas.md", "{0:.1f}%".format(len(scripts_w_raas[scripts_w_raas["raas_error"] != "success"].index) / len(scripts_w_raas.index) * 100))
+    inserts["perc_error_scripts_raas.md"] = "{0:.1f}%".format(len(scripts_w_raas[scripts_w_raas["raas_error"] != "success"].index) / len(scripts_w_raas.index) * 100)
 
-write_file_from_string("perc_easily_fixed.md", "{0:.1f}%".format(((error_change_df.success["library"] + error_change_df.success["working directory"]) / len(both_scripts_complete_df[both_scripts_complete_df.nr_error_category != "success"])) * 100))
+    error_change_df = transitions.frame("no raas", "raas")
+    inserts["perc_easily_fixed.md"] = "{0:.1f}%".format(((error_change_df.loc["library", "success"] + error_change_df.loc["working directory", "success"]) / error_change_df.drop(index="success").to_numpy().sum()) * 100)
 
-example_other_error_idxs = [22, 102, 362]
-list_of_example_other_errors = ''.join(["- " + ex_error + "\n" for ex_error in list(raas_error_scripts[raas_error_scripts.raas_error_category == "other"].raas_error.iloc[example_other_error_idxs])])
-write_file_from_string("list_of_example_other_errors.md", list_of_example_other_errors)
+    # Examples picked for the paper. Campaigns other than the paper's may not have them, in which
+    # case the missing ones are left out of the insert with a warning.
+    other_errors = raas_error_scripts[raas_error_scripts.raas_error_category == "other"].raas_error
+    example_other_error_idxs = [idx for idx in [22, 102, 362] if idx < len(other_errors.index)]
+    if len(example_other_error_idxs) < 3:
+        warnings.warn("only {0} of the 3 example other errors exist, list_of_example_other_errors.md lists those".format(len(example_other_error_idxs)))
+    list_of_example_other_errors = ''.join(["- " + ex_error + "\n" for ex_error in list(other_errors.iloc[example_other_error_idxs])])
+    inserts["list_of_example_other_errors.md"] = list_of_example_other_errors
 
-write_file_from_string("faster_with_raas_datasets.md", str(len(all_clean_completed_datasets_df[all_clean_completed_datasets_df.raas_time < all_clean_completed_datasets_df.nr_time])))
+    inserts["faster_with_raas_datasets.md"] = str(len(all_clean_completed_datasets_df[all_clean_completed_datasets_df.raas_time < all_clean_completed_datasets_df.nr_time]))
 
-write_file_from_string("library_version_loaded.md", raas_library_errors.loc[9002].raas_error.strip("\n"))
+    example_library_errors = raas_library_errors[raas_library_errors.index == 9002]
+    if len(example_library_errors.index) == 0:
+        warnings.warn("the example library error (script 9002) does not exist, library_version_loaded.md is left empty")
+    inserts["library_version_loaded.md"] = "".join(example_library_errors.raas_error.str.strip("\n"))
+    write_md_inserts(inserts)
 
 
 # In[27]:
 
 
-error_cats = ["library", "working directory", "missing file", "function", "other", "success"]
+@pipeline.stage(writes=md_insert_paths("perc_errors_not_repeated.md"))
+def repeated_error_values(transitions):
+    error_change_df = transitions.frame("no raas", "raas")
+    error_cats = ["library", "working directory", "missing file", "function", "other"]
 
-total_error = 0
-repeat_errors = 0
-
-for error_category in error_cats:
-    total_error += sum(error_change_df.loc[:, error_change_df.columns != 'success'].loc[error_category])
-    
-# We don't care about scripts that stayed a success
-error_cats.remove('success')
+    # Scripts that had an error with RaaS, out of those that had one of these errors or succeeded without it
+    total_error = error_change_df.loc[error_cats + ["success"], error_change_df.columns != "success"].to_numpy().sum()
+    # We don't care about scripts that stayed a success
+    repeat_errors = np.diagonal(error_change_df.loc[error_cats, error_cats].to_numpy()).sum()
 
-for error_category in error_cats:
-    repeat_errors += error_change_df.loc[error_category, error_category]
-
-write_file_from_string("perc_errors_not_repeated.md", "{0:.1f}%".format((total_error - repeat_errors) / total_error * 100))
+    write_md_inserts({"perc_errors_not_repeated.md": "{0:.1f}%".format((total_error - repeat_errors) / total_error * 100)})
 
 
 # # ========================================
@@ -908,7 +1019,7 @@ write_file_from_string("perc_errors_not_repeated.md", "{0:.1f}%".format((total_e
 # In[37]:
 
 
-dataset_level_md = '''
+dataset_level_template = '''
 ---------------------------------------------
                           Control   Treatment                                               
   --------------------- --------- -----------
@@ -921,27 +1032,27 @@ dataset_level_md = '''
 Table: This table displays the percentage of dataset errors and timeouts out of all TOTAL_DS runnable datasets. Our control is running scripts without RaaS, and our treatment is running scripts with RaaS. {#tbl:dataset-level-fraction}
 '''
 
+dataset_level_placeholders = ["CTRL_SUCCESS", "TREAT_SUCCESS", "CTRL_TIMEOUT", "TREAT_TIMEOUT", "TOTAL_DS"]
 
-runnable_datasets = len(both_datasets_all_df.index)
-
-num_datasets_without_raas_errored = len(both_datasets_all_df[(both_datasets_all_df.nr_clean == True)].index)
-num_datasets_with_raas_errored = len(both_datasets_all_df[(both_datasets_all_df.raas_clean == True)].index)
-
-num_datasets_without_raas_timeout = len(both_datasets_all_df[(both_datasets_all_df.nr_timed_out) | (both_datasets_all_df.nr_time > 18000)])
-num_datasets_with_raas_timeout = len(both_datasets_all_df[(both_datasets_all_df.raas_timed_out) | (both_datasets_all_df.raas_time > 18000)])
+@pipeline.stage(writes=md_insert_paths("dataset_level_table.md", "runnable_datasets.md"))
+def dataset_level_table(both_datasets_all_df):
+    runnable_datasets = len(both_datasets_all_df.index)
 
-dataset_level_md = dataset_level_md.replace("CTRL_SUCCESS", "{0:.1f}%".format(num_datasets_without_raas_errored / runnable_datasets * 100))
-dataset_level_md = dataset_level_md.replace("TREAT_SUCCESS", "{0:.1f}%".format(num_datasets_with_raas_errored / runnable_datasets * 100))
+    num_datasets_without_raas_errored = len(both_datasets_all_df[(both_datasets_all_df.nr_clean == True)].index)
+    num_datasets_with_raas_errored = len(both_datasets_all_df[(both_datasets_all_df.raas_clean == True)].index)
 
-dataset_level_md = dataset_level_md.replace("CTRL_TIMEOUT", "{0:.1f}%".format(num_datasets_without_raas_timeout / runnable_datasets * 100))
-dataset_level_md = dataset_level_md.replace("TREAT_TIMEOUT", "{0:.1f}%".format(num_datasets_with_raas_timeout / runnable_datasets * 100))
+    num_datasets_without_raas_timeout = len(both_datasets_all_df[(both_datasets_all_df.nr_timed_out) | (both_datasets_all_df.nr_time > 18000)])
+    num_datasets_with_raas_timeout = len(both_datasets_all_df[(both_datasets_all_df.raas_timed_out) | (both_datasets_all_df.raas_time > 18000)])
 
-dataset_level_md = dataset_level_md.replace("TOTAL_DS", str(runnable_datasets))
+    dataset_level_md = render_template(dataset_level_template, dataset_level_placeholders, {
+        "CTRL_SUCCESS": "{0:.1f}%".format(num_datasets_without_raas_errored / runnable_datasets * 100),
+        "TREAT_SUCCESS": "{0:.1f}%".format(num_datasets_with_raas_errored / runnable_datasets * 100),
+        "CTRL_TIMEOUT": "{0:.1f}%".format(num_datasets_without_raas_timeout / runnable_datasets * 100),
+        "TREAT_TIMEOUT": "{0:.1f}%".format(num_datasets_with_raas_timeout / runnable_datasets * 100),
+        "TOTAL_DS": runnable_datasets})
 
-
-
-write_file_from_string("dataset_level_table.md", dataset_level_md)
-write_file_from_string("runnable_datasets.md", str(runnable_datasets))
+    write_md_inserts({"dataset_level_table.md": dataset_level_md,
+                      "runnable_datasets.md": str(runnable_datasets)})
 
 
 # In[ ]:
@@ -955,7 +1066,7 @@ write_file_from_string("runnable_datasets.md", str(runnable_datasets))
 # In[38]:
 
 
-script_level_md = '''
+script_level_template = '''
 --------------------------------------------------------------------------------------------------------
                           Control   Treatment   Chen Control   Chen Treatment       Trisovic et al. Best                                              
   --------------------- --------- -----------  ------------- ----------------  -------------------------  
@@ -968,47 +1079,47 @@ script_level_md = '''
 Table: This table displays the percentage of runnable scripts that produced errors with and without RaaS. {#tbl:script-level-fraction}
 '''
 
-#Values taken from Chen's thesis results
-chen_control_successful = 408 / 2839 * 100
-# The 408 + 62 is derived from control table stating 408 were successful, and treatment table stating 62 scripts' errors were fixed
-chen_treatment_successful = (408 + 62) / 2839 * 100
-
-# Values taken from @trisovic2022largescale referenced in paper
-# Total files from 'best of both' is 8609
-# Successes from from 'best of both' is 1581
-# Time outs from 'best of both' is 5790
-tris_best_success = 1581 / 8609 * 100
-tris_best_timeouts = 5790 / 8609 * 100
-
-runnable_scripts = len(both_scripts_all_df)
-num_scripts_without_raas_successful = len(both_scripts_all_df[both_scripts_all_df.nr_error == "success"].index)
-num_scripts_with_raas_successful = len(both_scripts_all_df[both_scripts_all_df.raas_error == "success"].index)
-num_scripts_without_raas_timedout = len(both_scripts_all_df[both_scripts_all_df.nr_error_category == "timed out"].index)
-num_scripts_with_raas_timedout = len(both_scripts_all_df[both_scripts_all_df.raas_error_category == "timed out"].index)
-
-# Fraction successful inserts
-script_level_md = script_level_md.replace("CTRL_SUCCESS", "{0:.1f}%".format(num_scripts_without_raas_successful / runnable_scripts * 100))
-script_level_md = script_level_md.replace("TREAT_SUCCESS", "{0:.1f}%".format(num_scripts_with_raas_successful / runnable_scripts * 100))
-script_level_md = script_level_md.replace("CHEN_SUCCESS", "{0:.1f}%".format(chen_control_successful))
-script_level_md = script_level_md.replace("CHEN_TREAT", "{0:.1f}%".format(chen_treatment_successful))
-script_level_md = script_level_md.replace("TRIS_BEST", "{0:.1f}%".format(tris_best_success))
-
-# Fraction Timed-out inserts
-script_level_md = script_level_md.replace("CTRL_TO", "{0:.1f}%".format(num_scripts_without_raas_timedout / runnable_scripts * 100))
-script_level_md = script_level_md.replace("TREAT_TO", "{0:.1f}%".format(num_scripts_with_raas_timedout / runnable_scripts * 100))
-script_level_md = script_level_md.replace("TRIS_TO", "{0:.1f}%".format(tris_best_timeouts))
-
-
-
-write_file_from_string("script_level_table.md", script_level_md)
-write_file_from_string("runnable_scripts.md", str(runnable_scripts))
+script_level_placeholders = ["CTRL_SUCCESS", "TREAT_SUCCESS", "CHEN_SUCCESS", "CHEN_TREAT", "TRIS_BEST", "CTRL_TO", "TREAT_TO", "TRIS_TO"]
+
+@pipeline.stage(writes=md_insert_paths("script_level_table.md", "runnable_scripts.md"))
+def script_level_table(both_scripts_all_df):
+    #Values taken from Chen's thesis results
+    chen_control_successful = 408 / 2839 * 100
+    # The 408 + 62 is derived from control table stating 408 were successful, and treatment table stating 62 scripts' errors were fixed
+    chen_treatment_successful = (408 + 62) / 2839 * 100
+
+    # Values taken from @trisovic2022largescale referenced in paper
+    # Total files from 'best of both' is 8609
+    # Successes from from 'best of both' is 1581
+    # Time outs from 'best of both' is 5790
+    tris_best_success = 1581 / 8609 * 100
+    tris_best_timeouts = 5790 / 8609 * 100
+
+    runnable_scripts = len(both_scripts_all_df)
+    num_scripts_without_raas_successful = len(both_scripts_all_df[both_scripts_all_df.nr_error == "success"].index)
+    num_scripts_with_raas_successful = len(both_scripts_all_df[both_scripts_all_df.raas_error == "success"].index)
+    num_scripts_without_raas_timedout = len(both_scripts_all_df[both_scripts_all_df.nr_error_category == "timed out"].index)
+    num_scripts_with_raas_timedout = len(both_scripts_all_df[both_scripts_all_df.raas_error_category == "timed out"].index)
+
+    script_level_md = render_template(script_level_template, script_level_placeholders, {
+        # Fraction successful inserts
+        "CTRL_SUCCESS": "{0:.1f}%".format(num_scripts_without_raas_successful / runnable_scripts * 100),
+        "TREAT_SUCCESS": "{0:.1f}%".format(num_scripts_with_raas_successful / runnable_scripts * 100),
+        "CHEN_SUCCESS": "{0:.1f}%".format(chen_control_successful),
+        "CHEN_TREAT": "{0:.1f}%".format(chen_treatment_successful),
+        "TRIS_BEST": "{0:.1f}%".format(tris_best_success),
+        # Fraction Timed-out inserts
+        "CTRL_TO": "{0:.1f}%".format(num_scripts_without_raas_timedout / runnable_scripts * 100),
+        "TREAT_TO": "{0:.1f}%".format(num_scripts_with_raas_timedout / runnable_scripts * 100),
+        "TRIS_TO": "{0:.1f}%".format(tris_best_timeouts)})
+
+    write_md_inserts({"script_level_table.md": script_level_md,
+                      "runnable_scripts.md": str(runnable_scripts)})
 
 
 # In[30]:
 
 
-sankey_input_intro = []
-sankey_input_body = []
 sankey_colors = '''
 :Success  #00CC00  << 
 :Library  Error #0033cc <<
@@ -1023,130 +1134,93 @@ sankey_colors = '''
 :Working Directory #cc00cc <<
 '''
 
-def get_sankey_node(node_name, extra_space = ""):
-    if node_name in ["library", "function", "other"]:
-        node_name = node_name.title() + extra_space + " Error"
-    elif node_name in ["working directory", "missing file", "timed out", "missing object"]:
-        nodes = node_name.title().split(" ")
-        node_name = nodes[0] + " " + extra_space + nodes[1]
-    else:
-        node_name = node_name.title()
-    return(node_name)
-
-for index, row in error_change_df.iterrows():
-    if sum(row) > 0:
-        sankey_line = "R files [" + str(sum(row)) + "] " + get_sankey_node(index)
-        sankey_input_intro.append(sankey_line)
-    
-    for name, values in row.iteritems():
-        if values > 0 and index != "success":
-            sankey_input_body.append(get_sankey_node(index) + " [" + str(values) + "] " + get_sankey_node(name, " "))
-    sankey_input_body.append("")
-sankey_input_intro.append("\n")
-
-# To be used with sankeymatic.com/build
-# Dimensions chosen: width 700 height 376
-write_file_from_string("sankey_input.txt", '\n'.join(sankey_input_intro)  + '\n'.join(sankey_input_body) + sankey_colors) 
+@pipeline.stage(writes=md_insert_paths("sankey_input.txt"))
+def sankey_input(transitions):
+    sankey_input_intro = []
+    sankey_input_body = []
+
+    def get_sankey_node(node_name, extra_space = ""):
+        if node_name in ["library", "function", "other"]:
+            node_name = node_name.title() + extra_space + " Error"
+        elif node_name in ["working directory", "missing file", "timed out", "missing object"]:
+            nodes = node_name.title().split(" ")
+            node_name = nodes[0] + " " + extra_space + nodes[1]
+        else:
+            node_name = node_name.title()
+        return(node_name)
+
+    scripts_by_category = transitions.frame("no raas", "raas").sum(axis=1)
+    flows_df = transitions.flows("no raas", "raas")
+    for category, scripts in scripts_by_category.items():
+        sankey_input_intro.append("R files [" + str(scripts) + "] " + get_sankey_node(category))
+
+        # Scripts that stayed a success are not drawn as a flow
+        if category != "success":
+            for flow in flows_df[flows_df["source"] == category].itertuples():
+                sankey_input_body.append(get_sankey_node(flow.source) + " [" + str(flow.scripts) + "] " + get_sankey_node(flow.target, " "))
+        sankey_input_body.append("")
+    sankey_input_intro.append("\n")
+
+    # To be used with sankeymatic.com/build
+    # Dimensions chosen: width 700 height 376
+    write_md_inserts({"sankey_input.txt": '\n'.join(sankey_input_intro)  + '\n'.join(sankey_input_body) + sankey_colors})
 
 
 # In[31]:
 
 
-# Massage the data into the format used for plotting
-years = set(dataset_df["year"].values)
-raas_year_and_err_category_df = both_scripts_all_df.join(dataset_df.set_index("doi"), on ="doi")[["raas_error_category", "year", "doi"]]
-plot_years_df = scripts_df.join(raas_year_and_err_category_df.set_index("doi"), on="doi")[["nr_error_category", "raas_error_category", "year", "doi"]]
-year_breakdown = {"Year":[], "Total Files": [], "Total Error Files":[], "Error Rate (Rounded)":[]}
-for year in years:
-    scripts_in_year = plot_years_df[plot_years_df["year"] == year]
-    total_files = len(scripts_in_year.index)
-    if(total_files == 0):
-        continue
-        
-    year_breakdown["Year"].append(str(year))
-    total_error_files = len(scripts_in_year[scripts_in_year["nr_error_category"] != "success"].index)
-    year_breakdown["Total Files"].append(total_files)
-    year_breakdown["Total Error Files"].append(total_error_files)
-    year_breakdown["Error Rate (Rounded)"].append("{0:.4g}".format(total_error_files / total_files * 100))
-year_breakdown_df = pd.DataFrame(year_breakdown)
-year_breakdown_df.sort_values(["Year"], inplace=True)
-
-year_breakdown_df.columns = ["Year", "Total", "with Errors", "Error Rate"]
-year_melted_df = year_breakdown_df[["Year", "with Errors", "Total"]]    .loc[year_breakdown_df['Year'].isin(["2015","2016", "2017", "2018", "2019", "2020", "2021",])]    .melt(id_vars='Year').rename(columns=str.title)
-year_melted_df.columns = ["Year", "Count Type", "Count"]
-
-
-# In[32]:
-
-
-year_melted_df
-
-
-# In[33]:
-
-
-#plt.figure(figsize=(10, 5), dpi=300)
-plt.figure(dpi=300)
-sns.set(color_codes=True)
-sns.set_style("whitegrid")
-sns.set_context("notebook")
-ax = sns.barplot(x="Year", y="Count", hue="Count Type", data=year_melted_df, palette=sns.color_palette("Set1", n_colors=2, desat=.7))
-ax.set_title('Total Script and Error Count by Year')
-ax.set_xlabel("Dataset Publish Year")
-ax.set_ylabel("Number of Scripts")
-year_errors_df = year_melted_df[year_melted_df["Count Type"] == "with Errors"]
-x_index = 0
-for index, row in year_errors_df.iterrows():
-    x = row["Year"]
-    y = row["Count"]
-    total = year_melted_df[year_melted_df["Count Type"] == "Total"]
-    total = total[total["Year"] == row["Year"]]
-    perc = round(row["Count"] / total["Count"].values[0] * 100, 1)
-    ax.text(x=x_index,y=total["Count"].values[0],s=str(perc) + "%", ha="center")
-    x_index += 1
-#plt.show()
-plt.savefig('../figures/error_count_by_year.png', format="png")
-
-
-# In[34]:
-
+@pipeline.stage(outputs=["year_melted_df"])
+def error_count_by_year_data(cube):
+    # Every script without RaaS counted once under the publish year of its dataset
+    year_counts = cube.success_counts("year", condition="no raas")
+    year_breakdown_df = pd.DataFrame({"Year": year_counts.index.astype(str),
+                                      "Total Files": (year_counts["n_success"] + year_counts["n_error"]).to_numpy(),
+                                      "Total Error Files": year_counts["n_error"].to_numpy()})
+    year_breakdown_df.sort_values(["Year"], inplace=True)
 
-plot_years_df = both_scripts_all_df.join(dataset_df.set_index("doi"), on ="doi")[["raas_error_category", "nr_error_category", "year", "doi"]]
-plot_years_df["raas_is_successful"] = [int(x) for x in plot_years_df.raas_error_category == "success"]
-plot_years_df["nr_is_successful"] = [int(x) for x in plot_years_df.nr_error_category == "success"]
+    year_breakdown_df.columns = ["Year", "Total", "with Errors"]
+    year_melted_df = year_breakdown_df[["Year", "with Errors", "Total"]]    .loc[year_breakdown_df['Year'].isin(["2015","2016", "2017", "2018", "2019", "2020", "2021",])]    .melt(id_vars='Year').rename(columns=str.title)
+    year_melted_df.columns = ["Year", "Count Type", "Count"]
+    return(year_melted_df)
 
-plot_years_df.columns = [x.title() for x in plot_years_df.columns]
-plot_years_df
 
+# In[34]:
 
-# In[35]:
 
+@pipeline.stage(outputs=["success_by_year_df"])
+def success_rate_by_year_data(cube):
+    # Scripts with RaaS per publish year, those without a RaaS result counted as unsuccessful
+    success_by_year_df = cube.success_counts("year", condition="raas")
+    success_by_year_df.index = success_by_year_df.index.astype(str)
+    return(success_by_year_df.rename_axis("Year").reset_index())
 
-plt.figure(dpi=300)
-plt.xticks(rotation=-70, ha = "left")
-plt.ylim(0,1)
-sns.set(color_codes=True)
-sns.set_style("whitegrid")
-sns.set_context("notebook")
-ax = sns.barplot(x=plot_years_df['Year'], 
-                 y=plot_years_df['Raas_Is_Successful'],
-                 order=["2015", "2016", "2017", "2018", "2019", "2020", "2021"],
-                 palette=sns.color_palette("Set1", n_colors=1, desat=.7))
-#ax.set_title('Script Failure Proportion by Subject')
-ax.set_xlabel("Year")
-ax.set_ylabel("Fraction of Successful Scripts")
-plt.tight_layout()
-plt.show()
 
+# ## Figures
 
 # In[ ]:
 
 
-
+# Each selected figure is drawn in its own process on the Agg backend, and only if its frame or
+# plot code changed since it was last drawn
+@pipeline.stage(files=["figure_renderer.py"], writes=figure_paths(selected_figures))
+def render_figures(year_melted_df, subject_counts_df, all_clean_completed_datasets_df, success_by_year_df):
+    frames = {"error_count_by_year": year_melted_df,
+              "error_rate_by_subject": subject_counts_df,
+              "runtime_comparison": runtime_comparison_frame(all_clean_completed_datasets_df, runtime_plot),
+              "success_rate_by_year": success_by_year_df}
+    renderer = FigureRenderer("../data/stages/figures.json", workers=args.jobs)
+    renderer.render({name: frames[name] for name in selected_figures})
 
 
 # In[ ]:
 
 
-
+# Run every stage whose code or inputs changed since the last run
+if args.list_stages:
+    print(pipeline.describe())
+else:
+    targets = args.stages
+    if args.figures and not targets:
+        targets = ["render_figures"]
+    pipeline.run(targets=targets, workers=args.jobs, force=args.refresh_cache)
 
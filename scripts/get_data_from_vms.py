@@ -1,55 +1,285 @@
 import os
+import sys
+import json
+import time
+import shlex
+import random
+import hashlib
 import argparse
+import threading
+import subprocess
 
-parser = argparse.ArgumentParser()
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-parser.add_argument('--all', action='store_true')
-parser.add_argument('--dbs', action='store_true')
-parser.add_argument('--touts', action='store_true')
-parser.add_argument('--dirs', action='store_true')
-parser.add_argument('--vms', nargs='+')
+# The artifacts each VM produces: where they live on the VM and where they are copied to.
+# NUMBER is replaced with the VM number.
+ARTIFACTS = {
+    "dbs": ("/home/ubuntu/raas/db/app.db", "../data/raas_dbs/NUMBER-app-redo.db"),
+    "touts": ("/home/ubuntu/raas/eval/raas_timeout_dois.txt", "../data/raas_timeouts/NUMBER-timeout-dois-redo.txt"),
+    "dirs": ("/home/ubuntu/raas/eval/prov_dirs.tar", "../data/prov_dirs/NUMBER-prov_dirs_redo.tar"),
+}
 
-args = parser.parse_args()
+class TransferError(Exception):
+    pass
 
+class Transfer:
+    '''
+    One artifact to copy from one VM. Filled in with what was found on the VM (size, mtime and
+    optionally sha256), whether the copy was skipped, how long it took and the last error.
+    '''
+    def __init__(self, vm, host, kind, remote_path, local_path):
+        self.vm = vm
+        self.host = host
+        self.kind = kind
+        self.remote_path = remote_path
+        self.local_path = local_path
+        self.remote = None
+        self.skipped = False
+        self.attempts = 0
+        self.seconds = 0.0
+        self.error = None
 
-vms = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+def sha256_file(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as artifact_file:
+        for block in iter(lambda: artifact_file.read(block_size), b""):
+            digest.update(block)
+    return(digest.hexdigest())
 
-if(args.vms):
-    vms = args.vms
+class VmCollector:
+    '''
+    Copies artifacts from the VMs with a bounded pool of workers shared by every VM and artifact
+    type, with at most per_host transfers running against one VM at a time. Before copying, the
+    size and modification time of the artifact (and its sha256 when checksum is set) are read over
+    ssh and compared with the manifest from earlier runs, so unchanged artifacts are skipped.
+    Copies go to a .part file that is checked against the remote size (and checksum) before it
+    replaces the old copy, and failed commands are retried with backoff.
 
-dbs = False
-touts = False
-dirs = False
+    The scp and ssh commands are argument lists, so any local stand-in that takes the same
+    arguments (scp SOURCE DEST, ssh LOGIN COMMAND) can replace them.
+    '''
+    def __init__(self, scp_command, ssh_command, user="ubuntu", manifest_path="../data/vm_manifest.json",
+                 workers=4, per_host=2, retries=3, timeout=3600, probe_timeout=60, checksum=False,
+                 force=False, verbose=True):
+        self.scp_command = scp_command
+        self.ssh_command = ssh_command
+        self.user = user
+        self.manifest_path = manifest_path
+        self.workers = workers
+        self.per_host = per_host
+        self.retries = retries
+        self.timeout = timeout
+        self.probe_timeout = probe_timeout
+        self.checksum = checksum
+        self.force = force
+        self.verbose = verbose
+        self.manifest = self.load_manifest()
+        self.manifest_lock = threading.Lock()
+        self.host_locks = {}
 
-if args.dbs: dbs = True 
-if args.touts: touts = True 
-if args.dirs: dirs = True
+    def load_manifest(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as manifest_file:
+                return(json.load(manifest_file))
+        return({})
 
-if args.all:
-    dbs = True 
-    touts = True 
-    dirs = True
+    def save_manifest(self):
+        manifest_dir = os.path.dirname(self.manifest_path)
+        if manifest_dir:
+            os.makedirs(manifest_dir, exist_ok=True)
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w") as manifest_file:
+            json.dump(self.manifest, manifest_file, indent=1, sort_keys=True)
+        os.replace(temp_path, self.manifest_path)
 
+    def log(self, message):
+        if self.verbose:
+            print(message, flush=True)
 
+    def run(self, command, timeout):
+        try:
+            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            raise TransferError("timed out after " + str(timeout) + "s: " + " ".join(command))
+        except OSError as e:
+            raise TransferError(str(e))
+        if result.returncode != 0:
+            raise TransferError("exit code " + str(result.returncode) + ": " + result.stderr.decode(errors="replace").strip())
+        return(result.stdout.decode(errors="replace"))
 
-ip_temp_list = os.environ.get("IP_LIST").split(";")
-ip_list = []
-for vm in vms:
-    ip_list.append(ip_temp_list[int(vm)])
+    # Run a command up to retries times, waiting longer (with jitter) after each failure
+    def run_with_retries(self, transfer, command, timeout):
+        for attempt in range(1, self.retries + 1):
+            transfer.attempts += 1
+            try:
+                return(self.run(command, timeout))
+            except TransferError as e:
+                if attempt == self.retries:
+                    raise
+                self.log(transfer.host + " " + transfer.kind + " attempt " + str(attempt) + " failed, retrying: " + str(e))
+                time.sleep(random.uniform(0, min(30, 2 ** attempt)))
 
-print(ip_list)
+    # Size, modification time and (with checksum) sha256 of the artifact on the VM
+    def probe(self, transfer):
+        path = shlex.quote(transfer.remote_path)
+        remote_command = "stat -c '%s %Y' " + path
+        if self.checksum:
+            remote_command += " && sha256sum " + path
+        output = self.run_with_retries(transfer, self.ssh_command + [self.user + "@" + transfer.host, remote_command],
+                                       self.probe_timeout).split()
+        try:
+            remote = {"size": int(output[0]), "mtime": int(output[1])}
+        except (IndexError, ValueError):
+            raise TransferError("could not read the size of " + transfer.remote_path)
+        if self.checksum:
+            if len(output) < 3:
+                raise TransferError("could not read the checksum of " + transfer.remote_path)
+            remote["sha256"] = output[2]
+        return(remote)
 
-copy_db_command = "scp -i ~/.ssh/id_rsa ubuntu@HOST:/home/ubuntu/raas/db/app.db ../data/raas_dbs/NUMBER-app-redo.db"
-copy_timeouts_command = "scp -i ~/.ssh/id_rsa ubuntu@HOST:/home/ubuntu/raas/eval/raas_timeout_dois.txt ../data/raas_timeouts/NUMBER-timeout-dois-redo.txt"
-copy_prov_dirs_command = "scp -i ~/.ssh/id_rsa ubuntu@HOST:/home/ubuntu/raas/eval/prov_dirs.tar ../data/prov_dirs/NUMBER-prov_dirs_redo.tar"
+    # An artifact is unchanged when the VM reports what the manifest recorded for it and the
+    # local copy still has the recorded size
+    def unchanged(self, transfer):
+        previous = self.manifest.get(transfer.local_path)
+        if self.force or previous is None or not os.path.exists(transfer.local_path):
+            return(False)
+        if os.path.getsize(transfer.local_path) != previous["size"] or previous.get("host") != transfer.host:
+            return(False)
+        return(all(previous.get(field) == value for field, value in transfer.remote.items()))
 
-counter = 0
-for ip_addr in ip_list:
-    ip_db_command = copy_db_command.replace("HOST", ip_addr).replace("NUMBER", str(vms[counter]))
-    ip_timeout_command = copy_timeouts_command.replace("HOST", ip_addr).replace("NUMBER", str(vms[counter]))
-    ip_dirs_command = copy_prov_dirs_command.replace("HOST", ip_addr).replace("NUMBER", str(vms[counter]))
+    def copy(self, transfer):
+        local_dir = os.path.dirname(transfer.local_path)
+        if local_dir:
+            os.makedirs(local_dir, exist_ok=True)
+        part_path = transfer.local_path + ".part"
+        source = self.user + "@" + transfer.host + ":" + transfer.remote_path
+        try:
+            self.run_with_retries(transfer, self.scp_command + [source, part_path], self.timeout)
+            if not os.path.exists(part_path):
+                raise TransferError("scp exited without writing " + part_path)
+            copied_size = os.path.getsize(part_path)
+            if copied_size != transfer.remote["size"]:
+                raise TransferError("copied " + str(copied_size) + " bytes, expected " + str(transfer.remote["size"]))
+            if self.checksum and sha256_file(part_path) != transfer.remote["sha256"]:
+                raise TransferError("checksum mismatch for " + transfer.local_path)
+            os.replace(part_path, transfer.local_path)
+            # Keep the modification time the artifact has on the VM, as scp -p would, so the copy
+            # dates from when the run wrote it rather than from when this transfer finished
+            os.utime(transfer.local_path, (time.time(), transfer.remote["mtime"]))
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
 
-    counter += 1
-    if dbs: os.system(ip_db_command)
-    if touts: os.system(ip_timeout_command)
-    if dirs: os.system(ip_dirs_command)
+    def collect_one(self, transfer):
+        with self.host_locks[transfer.host]:
+            start = time.monotonic()
+            try:
+                transfer.remote = self.probe(transfer)
+                if self.unchanged(transfer):
+                    transfer.skipped = True
+                else:
+                    self.copy(transfer)
+                    with self.manifest_lock:
+                        self.manifest[transfer.local_path] = dict(transfer.remote, host=transfer.host,
+                                                                  remote_path=transfer.remote_path, copied_at=time.time())
+                        self.save_manifest()
+            except TransferError as e:
+                transfer.error = str(e)
+            transfer.seconds = time.monotonic() - start
+        return(transfer)
+
+    # Copy every transfer and return them with their outcome filled in
+    def collect(self, transfers):
+        for transfer in transfers:
+            if transfer.host not in self.host_locks:
+                self.host_locks[transfer.host] = threading.BoundedSemaphore(self.per_host)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(self.collect_one, transfer) for transfer in transfers]
+            for future in as_completed(futures):
+                transfer = future.result()
+                if transfer.error is not None:
+                    status = "FAILED " + transfer.error
+                elif transfer.skipped:
+                    status = "unchanged, skipped"
+                else:
+                    status = "copied " + str(transfer.remote["size"]) + " bytes in " + "{:.1f}".format(transfer.seconds) + "s"
+                self.log("vm " + str(transfer.vm) + " (" + transfer.host + ") " + transfer.kind + ": " + status)
+        return(transfers)
+
+# The transfers for the chosen VMs and artifact kinds, in the order the old serial loop copied them
+def plan_transfers(vms, ip_list, kinds):
+    transfers = []
+    for vm, ip_addr in zip(vms, ip_list):
+        for kind in ARTIFACTS:
+            if kind in kinds:
+                remote_path, local_path = ARTIFACTS[kind]
+                transfers.append(Transfer(vm, ip_addr, kind, remote_path, local_path.replace("NUMBER", str(vm))))
+    return(transfers)
+
+# Per host counts of copied, skipped and failed artifacts and the throughput of the copies
+def summarize_transfers(transfers):
+    lines = ["{:<18}{:>8}{:>8}{:>8}{:>12}{:>10}".format("host", "copied", "skipped", "failed", "MB", "MB/s")]
+    hosts = []
+    for transfer in transfers:
+        if transfer.host not in hosts:
+            hosts.append(transfer.host)
+    for host in hosts:
+        copied = [t for t in transfers if t.host == host and t.error is None and not t.skipped]
+        skipped = [t for t in transfers if t.host == host and t.skipped]
+        failed = [t for t in transfers if t.host == host and t.error is not None]
+        megabytes = sum(t.remote["size"] for t in copied) / 1e6
+        seconds = sum(t.seconds for t in copied)
+        rate = "{:.1f}".format(megabytes / seconds) if seconds > 0 else "-"
+        lines.append("{:<18}{:>8}{:>8}{:>8}{:>12.1f}{:>10}".format(host, len(copied), len(skipped), len(failed), megabytes, rate))
+    for transfer in transfers:
+        if transfer.error is not None:
+            lines.append("failed: vm " + str(transfer.vm) + " " + transfer.kind + " " + transfer.error)
+    return("\n".join(lines))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--all', action='store_true')
+    parser.add_argument('--dbs', action='store_true')
+    parser.add_argument('--touts', action='store_true')
+    parser.add_argument('--dirs', action='store_true')
+    parser.add_argument('--vms', nargs='+')
+    parser.add_argument('--workers', type=int, default=4, help="transfers running at once across all VMs")
+    parser.add_argument('--per-host', type=int, default=2, help="transfers running at once against one VM")
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=3600, help="seconds before one scp is abandoned")
+    parser.add_argument('--checksum', action='store_true', help="compare sha256 as well as size and modification time")
+    parser.add_argument('--force', action='store_true', help="copy artifacts even if the manifest says they are unchanged")
+    parser.add_argument('--manifest', default="../data/vm_manifest.json")
+    parser.add_argument('--scp', default="scp -i ~/.ssh/id_rsa", help="command used as: SCP SOURCE DEST")
+    parser.add_argument('--ssh', default="ssh -i ~/.ssh/id_rsa", help="command used as: SSH LOGIN COMMAND")
+    parser.add_argument('--user', default="ubuntu")
+
+    args = parser.parse_args()
+
+    vms = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+
+    if(args.vms):
+        vms = args.vms
+
+    kinds = set()
+    for kind in ARTIFACTS:
+        if args.all or getattr(args, kind):
+            kinds.add(kind)
+
+    ip_temp_list = os.environ.get("IP_LIST").split(";")
+    ip_list = []
+    for vm in vms:
+        ip_list.append(ip_temp_list[int(vm)])
+
+    print(ip_list)
+
+    collector = VmCollector([os.path.expanduser(part) for part in shlex.split(args.scp)],
+                            [os.path.expanduser(part) for part in shlex.split(args.ssh)],
+                            user=args.user, manifest_path=args.manifest, workers=args.workers,
+                            per_host=args.per_host, retries=args.retries, timeout=args.timeout,
+                            checksum=args.checksum, force=args.force)
+    transfers = collector.collect(plan_transfers(vms, ip_list, kinds))
+    print(summarize_transfers(transfers))
+    if any(transfer.error is not None for transfer in transfers):
+        sys.exit(1)
@@ -22,9 +22,59 @@ def strip_newlines(doi):
     return(doi.strip("\n"))
 strip_newlines_v = np.vectorize(strip_newlines)
 
+# Normalize DOIs written in any of the forms used in our data to "doi:10.7910/DVN/XXXXXX" with
+# vectorized string operations. Handles "doi:...\n" lines from the doi lists and metadata,
+# dataset directory paths ("datasets/doi-10.7910-DVN-XXXXXX") and RaaS container tags
+# ("jwons/doi-10.7910-dvn-xxxxxx"). In the dashed forms the first dash is the "doi:" separator
+# and the rest are slashes, the same as get_doi_from_dir_path and get_doi_from_tag_name.
+def normalize_dois(dois):
+    dois = pd.Series(np.asarray(dois, dtype=object)).str.strip()
+    dashed = dois.str.extract(r"(?:^|/)doi-([^/]+)$", expand=False)
+    dashed = "doi:" + dashed.str.replace("-", "/", regex=False).str.upper()
+    is_dashed = ~dois.str.startswith("doi:", na=False) & dashed.notna()
+    return(dois.where(~is_dashed, dashed).to_numpy())
+
+# Read DOI list files (one DOI per line, like the timeout lists) into a set of normalized DOIs
+def read_doi_lists(file_paths):
+    dois = []
+    for file_path in file_paths:
+        with open(file_path, "r") as doi_file:
+            dois = dois + [line for line in doi_file.read().splitlines() if line.strip() != ""]
+    return(pd.Index(normalize_dois(dois)).unique())
+
+# Boolean mask of which DOIs appear in flagged_dois, using a hash lookup on normalized DOIs
+def flag_dois(dois, flagged_dois):
+    return(pd.Index(normalize_dois(dois)).isin(pd.Index(normalize_dois(flagged_dois))))
+
+# Add a runtime column to dataset_df by joining on the normalized DOI. times_df has a column
+# of DOIs in any form and a column of runtimes; if a DOI appears more than once the last
+# runtime wins. Datasets without a runtime get NaN.
+def attach_runtimes(dataset_df, times_df, time_col, times_doi_col="doi", times_time_col="time"):
+    times = pd.Series(times_df[times_time_col].to_numpy(), index=normalize_dois(times_df[times_doi_col]))
+    times = times[~times.index.duplicated(keep="last")]
+    dataset_df[time_col] = pd.Index(normalize_dois(dataset_df["doi"])).map(times).to_numpy()
+    return(dataset_df)
+
 def write_file_from_string(filename, to_write):
     with open("../md_inserts/" + filename, "w") as outfile:
         outfile.write(to_write)
+
+# Write a batch of md inserts given as {filename: text}. Each file is replaced in one step, and a
+# file whose text did not change is left alone so its modification time stays meaningful to make.
+def write_md_inserts(inserts):
+    for filename, to_write in inserts.items():
+        path = "../md_inserts/" + filename
+        if os.path.exists(path):
+            with open(path, "r") as infile:
+                if infile.read() == to_write:
+                    continue
+        with open(path + ".tmp", "w") as outfile:
+            outfile.write(to_write)
+        os.replace(path + ".tmp", path)
+
+# The paths write_md_inserts writes these files to
+def md_insert_paths(*filenames):
+    return(["../md_inserts/" + filename for filename in filenames])
         
 def get_doi_from_results_filename(filename):
     doi = filename.split("/")[3]
@@ -118,7 +168,7 @@ def get_dataset_metadata(doi, api_url="https://dataverse.harvard.edu/api/"):
     while (attempts < timeout_limit):
         try:
             request = requests.get(api_url + "/datasets/:persistentId",
-                             params={"persistentId": doi}).json()
+                             params={"persistentId": doi}, timeout=timeout_duration).json()
             if(request["status"] == "ERROR"):
                 print("Possible incorrect permissions for " + doi)
                 return (False, False)
@@ -139,7 +189,7 @@ def get_dataset_metadata(doi, api_url="https://dataverse.harvard.edu/api/"):
             print("Could not get dataset info from dataverse")
             print(e)
             with open("../data/metadata_problem.txt", "a") as meta_prob:
-                meta_prob.write(doi + " " + e + "\n")
+                meta_prob.write(doi + " " + str(e) + "\n")
             return (False, False)
         break
         
@@ -163,4 +213,32 @@ def is_clean(doi, scripts_df):
         errors = set(doi_df["nr_error"].values)
         if "success" in errors and len(errors) == 1:
             ret_val = True
-    return ret_val
\ No newline at end of file
+    return ret_val
+
+# Summarize the scripts of every dataset in one pass over a scripts dataframe. error_col is the
+# condition to summarize, e.g. nr_error or raas_error, and a script is successful when its error
+# is "success". Returns a dataframe indexed by `key` with the number of scripts, the number of
+# scripts with errors, and whether the dataset is clean (it has scripts and none had errors, the
+# same as is_clean). If category_col is given, the number of scripts in each category is added.
+def summarize_datasets(scripts_df, error_col, category_col=None, key="doi"):
+    key_codes, key_values = pd.factorize(scripts_df[key])
+    has_key = key_codes >= 0
+    key_codes = key_codes[has_key]
+    is_error = (scripts_df[error_col] != "success").to_numpy()[has_key]
+
+    num_scripts = np.bincount(key_codes, minlength=len(key_values))
+    num_errors = np.bincount(key_codes, weights=is_error, minlength=len(key_values)).astype(np.int64)
+    summary_df = pd.DataFrame({"num_scripts": num_scripts,
+                               "num_errors": num_errors,
+                               "clean": (num_scripts > 0) & (num_errors == 0)},
+                              index=pd.Index(key_values, name=key))
+
+    if category_col is not None:
+        category_codes, categories = pd.factorize(scripts_df[category_col], sort=True)
+        category_codes = category_codes[has_key]
+        has_category = category_codes >= 0
+        counts = np.bincount(key_codes[has_category] * len(categories) + category_codes[has_category],
+                             minlength=len(key_values) * len(categories))
+        counts = counts.reshape(len(key_values), len(categories))
+        summary_df = summary_df.join(pd.DataFrame(counts, index=summary_df.index, columns=list(categories)))
+    return(summary_df)
@@ -0,0 +1,45 @@
+import re
+
+class TemplateError(Exception):
+    pass
+
+class MarkdownTemplate:
+    '''
+    A markdown table or paragraph with bare placeholder names in it, such as OUR_TOTAL or
+    Physics_PERC. The text is split at the placeholders once, trying longer names first so a name
+    that contains another one (MF_PERC and F_PERC) is always matched whole, and render fills
+    every placeholder in a single pass. Every placeholder has to appear in the text and every
+    placeholder needs a value, otherwise TemplateError is raised.
+    '''
+    def __init__(self, text, placeholders):
+        self.placeholders = sorted(set(placeholders), key=lambda name: (-len(name), name))
+        self.literals = []
+        self.slots = []
+        position = 0
+        if self.placeholders:
+            pattern = re.compile("|".join(re.escape(name) for name in self.placeholders))
+            for match in pattern.finditer(text):
+                self.literals.append(text[position:match.start()])
+                self.slots.append(match.group(0))
+                position = match.end()
+        self.literals.append(text[position:])
+
+        unused = sorted(set(self.placeholders) - set(self.slots))
+        if unused:
+            raise TemplateError("placeholders not found in the template: " + ", ".join(unused))
+
+    # values maps placeholder names to what they are replaced with; values for names that are
+    # not placeholders of this template are ignored
+    def render(self, values):
+        missing = [name for name in sorted(self.placeholders) if name not in values]
+        if missing:
+            raise TemplateError("no value for placeholders: " + ", ".join(missing))
+        parts = [self.literals[0]]
+        for slot, literal in zip(self.slots, self.literals[1:]):
+            parts.append(str(values[slot]))
+            parts.append(literal)
+        return("".join(parts))
+
+# Parse text and fill it in one go, for templates that are only rendered once
+def render_template(text, placeholders, values):
+    return(MarkdownTemplate(text, placeholders).render(values))
@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import random
+import argparse
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from requests.adapters import HTTPAdapter
+
+from metadata_store import open_metadata_store
+
+DATAVERSE_API = "https://dataverse.harvard.edu/api/"
+
+# Responses worth asking for again; anything else is reported as a failure straight away
+RETRY_STATUS_CODES = set([429, 500, 502, 503, 504])
+
+# Request errors worth trying again: the connection failed, timed out or broke off mid-response.
+# Any other requests error (a bad URL, too many redirects, ...) fails the DOI straight away.
+RETRY_EXCEPTIONS = (requests.exceptions.Timeout, requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError)
+
+class RateLimiter:
+    '''
+    Spaces requests at least 1 / rate seconds apart across all threads, so a large
+    concurrency limit does not hammer the Dataverse API.
+    '''
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            wait_until = max(self.next_time, now)
+            self.next_time = wait_until + self.interval
+        if wait_until > now:
+            time.sleep(wait_until - now)
+
+class MetadataError(Exception):
+    def __init__(self, message, retry=False):
+        super().__init__(message)
+        self.retry = retry
+
+# Pull the subjects and publication year out of a /datasets/:persistentId response, the same
+# way get_dataset_metadata does. Subjects are None when the dataset has no latestVersion.
+def parse_dataset_metadata(response_json):
+    if response_json.get("status") == "ERROR":
+        raise MetadataError("Possible incorrect permissions: " + str(response_json.get("message")))
+    dataset = response_json["data"]
+    subjects = None
+    year = dataset["publicationDate"][0:4]
+    if "latestVersion" in dataset:
+        for field in dataset["latestVersion"]["metadataBlocks"]["citation"]["fields"]:
+            if field["typeName"] == "subject":
+                subjects = field["value"]
+    return(subjects, year)
+
+class MetadataHarvester:
+    '''
+    Downloads dataset metadata for many DOIs concurrently. Each thread keeps its own
+    keep-alive session, all threads share one rate limiter, and failed requests are retried
+    with exponential backoff and jitter. Every result is saved as soon as it arrives, either
+    to a MetadataStore or to a JSON lines progress file, so an interrupted harvest picks up
+    where it stopped. With a store, only DOIs that are missing, failed last time, or were
+    fetched more than ttl seconds ago are requested.
+    '''
+    def __init__(self, api_url=DATAVERSE_API, concurrency=8, rate=10, timeout=7, max_attempts=4,
+                 backoff_base=0.5, backoff_max=30, progress_path="../data/doi_metadata_progress.jsonl",
+                 store=None, ttl=None):
+        self.api_url = api_url.strip("/")
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(rate)
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.progress_path = progress_path
+        self.store = store
+        self.ttl = ttl
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+
+    def session(self):
+        if not hasattr(self.local, "session"):
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self.local.session = session
+        return(self.local.session)
+
+    def backoff(self, attempt):
+        return(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
+
+    # The subjects and year in a response, or a MetadataError saying why there are none
+    def read_response(self, response):
+        if response.status_code in RETRY_STATUS_CODES:
+            raise MetadataError("HTTP " + str(response.status_code), retry=True)
+        try:
+            return(parse_dataset_metadata(response.json()))
+        except (ValueError, KeyError, TypeError) as e:
+            raise MetadataError("Unexpected response: " + repr(e))
+
+    def fetch(self, doi):
+        attempt = 0
+        while True:
+            self.rate_limiter.wait()
+            try:
+                response = self.session().get(self.api_url + "/datasets/:persistentId",
+                                              params={"persistentId": doi}, timeout=self.timeout)
+                return(self.read_response(response))
+            except RETRY_EXCEPTIONS as e:
+                error = MetadataError(type(e).__name__ + ": " + str(e), retry=True)
+            except requests.exceptions.RequestException as e:
+                error = MetadataError(type(e).__name__ + ": " + str(e))
+            except MetadataError as e:
+                error = e
+            attempt += 1
+            if not error.retry or attempt >= self.max_attempts:
+                raise error
+            time.sleep(self.backoff(attempt))
+
+    # DOIs already harvested successfully according to the progress file
+    def completed(self):
+        done = {}
+        if os.path.exists(self.progress_path):
+            with open(self.progress_path, "r") as progress_file:
+                for line in progress_file:
+                    if line.strip() == "":
+                        continue
+                    record = json.loads(line)
+                    if record["error"] is None:
+                        done[record["doi"]] = record
+        return(done)
+
+    # The DOIs that still need to be requested
+    def pending(self, dois):
+        if self.store is not None:
+            return(self.store.dois_to_fetch(dois, self.ttl))
+        done = self.completed()
+        todo = []
+        for doi in dois:
+            doi = doi.strip()
+            if doi not in done:
+                done[doi] = None
+                todo.append(doi)
+        return(todo)
+
+    def record(self, record):
+        if self.store is not None:
+            self.store.save(record)
+            return
+        with self.write_lock:
+            with open(self.progress_path, "a") as progress_file:
+                progress_file.write(json.dumps(record) + "\n")
+
+    def harvest_one(self, doi):
+        record = {"doi": doi, "subjects": None, "year": None, "error": None, "fetched_at": None}
+        try:
+            record["subjects"], record["year"] = self.fetch(doi)
+        except MetadataError as e:
+            record["error"] = str(e)
+        record["fetched_at"] = time.time()
+        self.record(record)
+        return(record)
+
+    # Harvest every pending DOI. Returns the records keyed by DOI: with a progress file these
+    # include DOIs harvested by earlier runs, with a store only the DOIs requested now.
+    def harvest(self, dois, verbose=True):
+        records = {} if self.store is not None else self.completed()
+        todo = self.pending(dois)
+
+        failures = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = [pool.submit(self.harvest_one, doi) for doi in todo]
+            for counter, future in enumerate(as_completed(futures)):
+                record = future.result()
+                records[record["doi"]] = record
+                if record["error"] is not None:
+                    failures += 1
+                    if verbose:
+                        print(record["doi"] + " " + record["error"])
+                if verbose and (counter + 1) % 100 == 0:
+                    print(str(counter + 1) + " of " + str(len(todo)) + " datasets")
+        if verbose:
+            print("Harvested " + str(len(todo) - failures) + " of " + str(len(todo)) + " datasets, " + str(failures) + " failed")
+        return(records)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dois', default="../data/r_dois.txt")
+    parser.add_argument('--api-url', default=DATAVERSE_API)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=10, help="maximum requests per second")
+    parser.add_argument('--timeout', type=float, default=7)
+    parser.add_argument('--max-attempts', type=int, default=4)
+    parser.add_argument('--store', default="../data/doi_metadata.db")
+    parser.add_argument('--ttl-days', type=float, default=None, help="re-request metadata fetched longer ago than this")
+    parser.add_argument('--output', default="../data/doi_metadata.json")
+    args = parser.parse_args()
+
+    with open(args.dois, "r") as doi_file:
+        doi_lines = doi_file.readlines()
+
+    store = open_metadata_store(args.store, seed_json=args.output)
+    ttl = args.ttl_days * 24 * 60 * 60 if args.ttl_days is not None else None
+    harvester = MetadataHarvester(api_url=args.api_url, concurrency=args.concurrency, rate=args.rate,
+                                  timeout=args.timeout, max_attempts=args.max_attempts, store=store, ttl=ttl)
+    harvester.harvest(doi_lines)
+    store.export_json(doi_lines, args.output)
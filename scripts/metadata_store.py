@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+import pandas as pd
+
+from helper_functions import normalize_dois
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS datasets (
+    doi TEXT PRIMARY KEY NOT NULL,
+    year TEXT,
+    has_subjects INTEGER NOT NULL DEFAULT 0,
+    fetched_at REAL,
+    last_error TEXT,
+    error_at REAL
+);
+CREATE TABLE IF NOT EXISTS dataset_subjects (
+    doi TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    PRIMARY KEY (doi, subject)
+);
+CREATE INDEX IF NOT EXISTS dataset_subjects_subject ON dataset_subjects (subject);
+CREATE TABLE IF NOT EXISTS store_info (
+    key TEXT PRIMARY KEY NOT NULL,
+    value TEXT
+);
+'''
+
+class MetadataStore:
+    '''
+    SQLite store of Dataverse metadata keyed by normalized DOI. Every dataset keeps its
+    subjects, publication year, when it was last fetched and the last error hit while fetching
+    it, so a harvest only has to request DOIs that are new, stale or failed last time.
+    has_subjects is 0 for datasets whose metadata has no latestVersion (None subjects in
+    doi_metadata.json); those are left out of the dataset dataframe like before.
+    '''
+    def __init__(self, db_path="../data/doi_metadata.db"):
+        self.db_path = db_path
+        self.con = sqlite3.connect(db_path, check_same_thread=False)
+        self.con.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.con.close()
+
+    # The hash of the doi_metadata.json the store was last imported from or exported to
+    def seed_hash(self):
+        row = self.con.execute("SELECT value FROM store_info WHERE key = 'seed_sha256'").fetchone()
+        return(row[0] if row else None)
+
+    def set_seed_hash(self, json_path):
+        with self.lock, self.con:
+            self.con.execute("INSERT OR REPLACE INTO store_info (key, value) VALUES ('seed_sha256', ?)", (json_sha256(json_path),))
+
+    # A hash of the datasets, years and subjects the store holds, in the order they are read back.
+    # Unlike the database file, it does not change when a fetch stores the same metadata again.
+    def content_hash(self):
+        digest = hashlib.sha256()
+        for row in self.con.execute("SELECT doi, year, has_subjects FROM datasets WHERE fetched_at IS NOT NULL ORDER BY rowid"):
+            digest.update(json.dumps(row).encode())
+        for row in self.con.execute("SELECT doi, subject FROM dataset_subjects ORDER BY doi, subject"):
+            digest.update(json.dumps(row).encode())
+        return(digest.hexdigest())
+
+    def is_empty(self):
+        return(self.con.execute("SELECT COUNT(*) FROM datasets").fetchone()[0] == 0)
+
+    # Store harvested records, as produced by MetadataHarvester.harvest_one, in one transaction.
+    # A failure keeps the metadata from the last successful fetch and only records the error.
+    def save_many(self, records):
+        dois = normalize_dois([record["doi"] for record in records])
+        with self.lock, self.con:
+            for doi, record in zip(dois, records):
+                fetched_at = record.get("fetched_at") or time.time()
+                if record["error"] is not None:
+                    self.con.execute('''INSERT INTO datasets (doi, last_error, error_at) VALUES (?, ?, ?)
+                                        ON CONFLICT (doi) DO UPDATE SET last_error = excluded.last_error, error_at = excluded.error_at''',
+                                     (doi, record["error"], fetched_at))
+                    continue
+                subjects = record["subjects"]
+                self.con.execute('''INSERT INTO datasets (doi, year, has_subjects, fetched_at, last_error, error_at) VALUES (?, ?, ?, ?, NULL, NULL)
+                                    ON CONFLICT (doi) DO UPDATE SET year = excluded.year, has_subjects = excluded.has_subjects,
+                                    fetched_at = excluded.fetched_at, last_error = NULL, error_at = NULL''',
+                                 (doi, record["year"], int(subjects is not None), fetched_at))
+                self.con.execute("DELETE FROM dataset_subjects WHERE doi = ?", (doi,))
+                self.con.executemany("INSERT OR IGNORE INTO dataset_subjects (doi, subject) VALUES (?, ?)",
+                                     [(doi, subject) for subject in (subjects or [])])
+
+    def save(self, record):
+        self.save_many([record])
+
+    # Load an existing doi_metadata.json. Its entries count as fetched when the file was written.
+    def import_json(self, json_path="../data/doi_metadata.json"):
+        with open(json_path, "r") as doi_file:
+            doi_metadata = json.loads(doi_file.read())
+        fetched_at = os.path.getmtime(json_path)
+        self.save_many([{"doi": doi, "subjects": subjects, "year": year, "error": None, "fetched_at": fetched_at}
+                        for doi, (subjects, year) in doi_metadata.items()])
+        self.set_seed_hash(json_path)
+
+    # The DOIs (in the given order, without duplicates) that are missing from the store, failed
+    # on their last fetch, or were fetched more than ttl seconds ago. A ttl of None never expires.
+    def dois_to_fetch(self, dois, ttl=None, now=None):
+        now = time.time() if now is None else now
+        known = pd.read_sql_query("SELECT doi, fetched_at, last_error FROM datasets", self.con).set_index("doi")
+        wanted = pd.Series(pd.unique(normalize_dois(dois)))
+        fetched_at = wanted.map(known["fetched_at"])
+        last_error = wanted.map(known["last_error"])
+        fetch = fetched_at.isna() | last_error.notna()
+        if ttl is not None:
+            fetch = fetch | (fetched_at < now - ttl)
+        return(list(wanted[fetch]))
+
+    def subjects(self):
+        return([row[0] for row in self.con.execute("SELECT DISTINCT subject FROM dataset_subjects ORDER BY subject")])
+
+    # One row per dataset with known subjects, in the order datasets were first stored, with the
+    # doi, the publication year and one boolean column per subject
+    def datasets_df(self):
+        dataset_df = pd.read_sql_query("SELECT doi, year FROM datasets WHERE has_subjects = 1 ORDER BY rowid", self.con)
+        subjects_df = pd.read_sql_query('''SELECT dataset_subjects.doi, subject FROM dataset_subjects
+                                           JOIN datasets ON datasets.doi = dataset_subjects.doi
+                                           WHERE has_subjects = 1''', self.con)
+        in_subject_df = pd.crosstab(subjects_df["doi"], subjects_df["subject"]) > 0
+        in_subject_df = in_subject_df.reindex(dataset_df["doi"], fill_value=False)
+        for subject in in_subject_df.columns:
+            dataset_df[subject] = in_subject_df[subject].to_numpy()
+        return(dataset_df)
+
+    # Write the store back out in the format of doi_metadata.json, keyed by the given doi list lines
+    def export_json(self, doi_lines, json_path="../data/doi_metadata.json"):
+        datasets = pd.read_sql_query("SELECT doi, year, has_subjects FROM datasets WHERE fetched_at IS NOT NULL", self.con).set_index("doi")
+        subjects = pd.read_sql_query("SELECT doi, subject FROM dataset_subjects ORDER BY rowid", self.con).groupby("doi")["subject"].apply(list)
+        doi_metadata = {}
+        for doi_line, doi in zip(doi_lines, normalize_dois(doi_lines)):
+            if doi in datasets.index and doi_line not in doi_metadata:
+                dataset = datasets.loc[doi]
+                doi_subjects = subjects.get(doi, []) if dataset["has_subjects"] else None
+                doi_metadata[doi_line] = (doi_subjects, dataset["year"])
+        with open(json_path, "w") as doi_file:
+            doi_file.write(json.dumps(doi_metadata))
+        self.set_seed_hash(json_path)
+        return(doi_metadata)
+
+def json_sha256(json_path):
+    with open(json_path, "rb") as json_file:
+        return(hashlib.sha256(json_file.read()).hexdigest())
+
+# Open the metadata store, seeding it from doi_metadata.json the first time and importing it again
+# whenever its content differs from the version the store last imported or exported, so a pulled
+# or edited doi_metadata.json replaces the subjects and years of its datasets in the local store
+def open_metadata_store(db_path="../data/doi_metadata.db", seed_json="../data/doi_metadata.json"):
+    store = MetadataStore(db_path)
+    if seed_json is not None and os.path.exists(seed_json) and store.seed_hash() != json_sha256(seed_json):
+        store.import_json(seed_json)
+    return(store)
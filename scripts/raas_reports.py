@@ -0,0 +1,133 @@
+import os
+import json
+import sqlite3
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from helper_functions import get_doi_from_tag_name
+from chunked_ingest import chunk_rows, concat_chunks
+
+DATASET_COLUMNS = ["doi", "raas_time", "raas_clean", "raas_num_scripts", "raas_timed_out_scripts"]
+SCRIPT_COLUMNS = ["report_idx", "doi", "unique_id", "script_name", "raas_error", "filename"]
+
+class ReportDecoder:
+    '''
+    Decodes RaaS reports (the JSON stored in the report column of each app.db) with a single
+    json.loads per report. Dataset level values and per script rows are appended to columnar
+    buffers, so decoding is linear in the number of reports and scripts.
+    '''
+    def __init__(self):
+        self.datasets = {column: [] for column in DATASET_COLUMNS}
+        self.scripts = {column: [] for column in SCRIPT_COLUMNS}
+        self.num_reports = 0
+
+    def add(self, report):
+        report_dict = json.loads(report)
+        info = report_dict["Additional Information"]
+        individual_scripts = report_dict["Individual Scripts"]
+        doi = get_doi_from_tag_name(info["Container Name"])
+
+        # A script's error is the first error RaaS recorded for it, or success if there were none
+        errors = [script["Errors"][0] if script["Errors"] else "success" for script in individual_scripts.values()]
+        timed_out = sum(1 for script in individual_scripts.values() if script.get("Timed Out") == True)
+
+        self.datasets["doi"].append(doi)
+        self.datasets["raas_time"].append(info["Build Time"])
+        # Datasets without any scripts are not considered clean
+        self.datasets["raas_clean"].append(len(errors) > 0 and all(error == "success" for error in errors))
+        self.datasets["raas_num_scripts"].append(len(individual_scripts))
+        self.datasets["raas_timed_out_scripts"].append(timed_out)
+
+        self.scripts["report_idx"].extend([self.num_reports] * len(errors))
+        self.scripts["doi"].extend([doi] * len(errors))
+        # The same script id as create_script_id
+        script_names = [os.path.basename(filename).lower() for filename in individual_scripts]
+        self.scripts["unique_id"].extend([doi + ":" + script_name for script_name in script_names])
+        self.scripts["script_name"].extend(script_names)
+        self.scripts["raas_error"].extend(errors)
+        self.scripts["filename"].extend(individual_scripts)
+        self.num_reports += 1
+
+    def datasets_df(self, index=None):
+        return(pd.DataFrame(self.datasets, index=index, columns=DATASET_COLUMNS))
+
+    def scripts_df(self):
+        scripts_df = pd.DataFrame(self.scripts, columns=SCRIPT_COLUMNS)
+        scripts_df["report_idx"] = scripts_df["report_idx"].astype(np.int64)
+        return(scripts_df)
+
+    # The dataframes of the reports added since the last flush, after which their buffers are
+    # emptied. report_idx keeps counting across flushes. Error messages are stored as a Categorical.
+    def flush(self):
+        datasets_df = self.datasets_df()
+        scripts_df = self.scripts_df()
+        scripts_df["raas_error"] = pd.Categorical(scripts_df["raas_error"].to_numpy())
+        self.datasets = {column: [] for column in DATASET_COLUMNS}
+        self.scripts = {column: [] for column in SCRIPT_COLUMNS}
+        return(datasets_df, scripts_df)
+
+# Decode a column of reports. Returns a dataset level dataframe aligned with the reports and a
+# script level dataframe whose report_idx column is the position of the report each script came from.
+def decode_reports(reports, index=None):
+    decoder = ReportDecoder()
+    for report in reports:
+        decoder.add(report)
+    return(decoder.datasets_df(index=index), decoder.scripts_df())
+
+# Decode every report stored in one RaaS database. Runs inside the worker processes of
+# ingest_raas_dbs, so only the compact decoded columns travel back, not the report text. With a
+# memory_budget (in bytes) the reports are read and decoded in chunks sized to fit it, and each
+# chunk's Python buffers are turned into compact dataframes before the next chunk is read.
+def decode_raas_db(db_file, memory_budget=None):
+    decoder = ReportDecoder()
+    con = sqlite3.connect(db_file)
+    cursor = con.execute("SELECT report FROM dataset")
+    if memory_budget is None:
+        for (report,) in cursor:
+            decoder.add(report)
+        con.close()
+        return(decoder.flush())
+
+    reports_per_chunk = chunk_rows(con, "dataset", ["report"], memory_budget)
+    chunks = []
+    rows = cursor.fetchmany(reports_per_chunk)
+    while rows:
+        for (report,) in rows:
+            decoder.add(report)
+        chunks.append(decoder.flush())
+        rows = cursor.fetchmany(reports_per_chunk)
+    con.close()
+    if not chunks:
+        chunks.append(decoder.flush())
+    return(concat_chunks([datasets_df for datasets_df, _ in chunks]), concat_chunks([scripts_df for _, scripts_df in chunks]))
+
+# Decode the RaaS databases from every VM, up to `workers` databases at a time. Results are
+# concatenated in the order of db_files no matter which worker finishes first. Each database
+# keeps its own row index, report_idx numbers the reports across all databases and db_idx is the
+# position in db_files of the database each report came from. A
+# memory_budget in bytes is shared between the workers, see decode_raas_db.
+def ingest_raas_dbs(db_files, workers=1, memory_budget=None):
+    workers = max(1, min(workers, len(db_files)))
+    if memory_budget is not None:
+        memory_budget = memory_budget / workers
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(partial(decode_raas_db, memory_budget=memory_budget), db_files))
+    else:
+        results = [decode_raas_db(db_file, memory_budget) for db_file in db_files]
+
+    datasets_dfs = []
+    scripts_dfs = []
+    offset = 0
+    for db_idx, (datasets_df, scripts_df) in enumerate(results):
+        datasets_df["report_idx"] = np.arange(offset, offset + len(datasets_df.index))
+        datasets_df["db_idx"] = db_idx
+        scripts_df["report_idx"] = scripts_df["report_idx"] + offset
+        offset += len(datasets_df.index)
+        datasets_dfs.append(datasets_df)
+        scripts_dfs.append(scripts_df)
+    return(pd.concat(datasets_dfs), concat_chunks(scripts_dfs))
@@ -0,0 +1,132 @@
+import os
+import sqlite3
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from helper_functions import normalize_dois, read_doi_lists
+from compact_schema import SubjectTable, compact_subjects
+from metadata_store import open_metadata_store
+from raas_reports import decode_raas_db
+from results_warehouse import discover_sources, dois_from_script_paths, build_warehouse
+from doi_partitioner import CostModel, runtime_history, lpt_partition, write_shards
+
+# Why a DOI is rerun, in the order they are listed in the plan
+REASONS = ["missing", "timed out", "rdtLite Error", "duplicated", "inconsistent"]
+
+RDTLITE_ERROR = "rdtLite Error"
+
+# Reruns of a VM's DOIs are loaded after its original run, so a rerun's results replace the original's
+RUN_LEVELS = {"original": 0, "redo": 1}
+
+# Every RaaS report and timeout from the sources of the "raas" campaign, with the level and time of
+# the run that produced it and the position of its source in the load order
+def read_raas_runs(sources):
+    reports = []
+    scripts = []
+    timeouts = []
+    for order, source in enumerate(sources):
+        if source.campaign != "raas":
+            continue
+        if source.kind == "reports":
+            datasets_df, scripts_df = decode_raas_db(source.path)
+            datasets_df["report"] = order * (1 << 32) + np.arange(len(datasets_df.index))
+            scripts_df["report"] = order * (1 << 32) + scripts_df["report_idx"]
+            reports.append(datasets_df[["doi", "report"]].assign(order=order, level=RUN_LEVELS[source.run], run_time=source.run_time()))
+            scripts.append(scripts_df[["report", "script_name", "raas_error"]].astype({"raas_error": object}))
+        else:
+            dois = read_doi_lists([source.path])
+            timeouts.append(pd.DataFrame({"doi": dois, "order": order, "level": RUN_LEVELS[source.run]}))
+    reports_df = pd.concat(reports, ignore_index=True) if reports else pd.DataFrame(columns=["doi", "report", "order", "level", "run_time"])
+    scripts_df = pd.concat(scripts, ignore_index=True) if scripts else pd.DataFrame(columns=["report", "script_name", "raas_error"])
+    timeouts_df = pd.concat(timeouts, ignore_index=True) if timeouts else pd.DataFrame(columns=["doi", "order", "level"])
+    reports_df["doi"] = normalize_dois(reports_df["doi"])
+    return(reports_df, scripts_df, timeouts_df)
+
+# Latest wins: the report of each DOI from the latest run, the same one the warehouse's "latest"
+# resolution reads
+def latest_reports(reports_df):
+    return(reports_df.sort_values(["level", "run_time", "order"], kind="stable").drop_duplicates("doi", keep="last").set_index("doi"))
+
+# DOIs reported more than once by the latest run that reported them, so which result is right is
+# not known until they are rerun
+def duplicated_dois(reports_df):
+    latest_level = reports_df.groupby("doi")["level"].transform("max")
+    latest_run_df = reports_df[reports_df["level"] == latest_level]
+    return(pd.Index(latest_run_df.loc[latest_run_df["doi"].duplicated(keep=False), "doi"]).unique())
+
+# DOIs in a timeout list that no later run has reported on
+def timed_out_dois(timeouts_df, latest_df):
+    timeout_level = timeouts_df.groupby("doi")["level"].max()
+    report_level = latest_df["level"].reindex(timeout_level.index)
+    return(timeout_level.index[report_level.isna() | (report_level <= timeout_level)])
+
+def rdtlite_dois(scripts_df, latest_df):
+    scripts_df = scripts_df[scripts_df["report"].isin(latest_df["report"])]
+    errors = scripts_df["raas_error"].astype(str)
+    failed = (errors == RDTLITE_ERROR) | errors.str.contains("dev.off", regex=False)
+    reports = pd.Index(scripts_df.loc[failed, "report"].unique())
+    return(latest_df.index[latest_df["report"].isin(reports)])
+
+# DOIs whose latest report and whose results without RaaS do not have the same scripts
+def inconsistent_dois(scripts_df, latest_df, control_df):
+    treatment_df = scripts_df[scripts_df["report"].isin(latest_df["report"])]
+    treatment_df = pd.DataFrame({"doi": pd.Series(latest_df.index, index=latest_df["report"]).reindex(treatment_df["report"]).to_numpy(),
+                                 "script_name": treatment_df["script_name"].to_numpy()})
+    both_dois = pd.Index(treatment_df["doi"].unique()).intersection(pd.Index(control_df["doi"].unique()))
+    pairs_df = treatment_df.drop_duplicates().merge(control_df.drop_duplicates(), on=["doi", "script_name"], how="outer", indicator=True)
+    pairs_df = pairs_df[pairs_df["doi"].isin(both_dois)]
+    return(pd.Index(pairs_df.loc[pairs_df["_merge"] != "both", "doi"].unique()))
+
+# The script names of every DOI in a results.db style database
+def read_control_scripts(db_file):
+    con = sqlite3.connect(db_file)
+    filenames = pd.read_sql_query("SELECT filename FROM results", con)["filename"]
+    con.close()
+    return(pd.DataFrame({"doi": dois_from_script_paths(filenames), "script_name": filenames.str.rsplit("/", n=1).str[-1].str.lower().to_numpy()}))
+
+# One row per DOI to rerun with a flag for every reason it is rerun for. DOIs are in the order of dois.
+def plan_reruns(dois, reports_df, scripts_df, timeouts_df, control_df):
+    dois = pd.Index(normalize_dois(dois)).unique()
+    latest_df = latest_reports(reports_df)
+    reasons = {"missing": dois.difference(latest_df.index).difference(pd.Index(timeouts_df["doi"])),
+               "timed out": timed_out_dois(timeouts_df, latest_df),
+               "rdtLite Error": rdtlite_dois(scripts_df, latest_df),
+               "duplicated": duplicated_dois(reports_df),
+               "inconsistent": inconsistent_dois(scripts_df, latest_df, control_df)}
+    plan_df = pd.DataFrame({reason: dois.isin(reasons[reason]) for reason in REASONS}, index=dois)
+    return(plan_df[plan_df.any(axis=1)])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', default="../data")
+    parser.add_argument('--dois', nargs='+', default=["../data/r_dois.txt"], help="DOI lists of every dataset that should have a result")
+    parser.add_argument('--shards', type=int, default=8, help="number of VMs to split the reruns over")
+    parser.add_argument('--output', default="../doi_lists/rerun")
+    parser.add_argument('--merge', nargs='?', const="../data/warehouse.db",
+                        help="once the reruns are copied back, merge every result into this warehouse to read the latest result of each DOI from")
+    args = parser.parse_args()
+
+    sources = discover_sources(args.data)
+    if args.merge:
+        build_warehouse(args.merge, sources)
+        print("Merged {0} result files into {1}, read it with --warehouse {1} --duplicates latest".format(len(sources), args.merge))
+
+    reports_df, scripts_df, timeouts_df = read_raas_runs(sources)
+    control_df = read_control_scripts(os.path.join(args.data, "results.db"))
+    plan_df = plan_reruns(read_doi_lists(args.dois), reports_df, scripts_df, timeouts_df, control_df)
+
+    metadata_store = open_metadata_store(os.path.join(args.data, "doi_metadata.db"), seed_json=os.path.join(args.data, "doi_metadata.json"))
+    metadata_df = compact_subjects(metadata_store.datasets_df(), SubjectTable(metadata_store.subjects()))
+    metadata_store.close()
+    metadata_df["doi"] = normalize_dois(metadata_df["doi"])
+    timeout_lists = [source.path for source in sources if source.kind == "timeouts"]
+    model = CostModel(runtime_history(os.path.join(args.data, "dataset_times.csv"), os.path.join(args.data, "raas_dbs"), timeout_lists), metadata_df)
+
+    write_shards(lpt_partition(model.predict(plan_df.index)["cost"], args.shards), args.output)
+    reasons = [", ".join(np.array(REASONS)[flags]) for flags in plan_df[REASONS].to_numpy()]
+    pd.DataFrame({"reasons": reasons}, index=plan_df.index).to_csv(os.path.join(args.output, "rerun_plan.csv"), index_label="doi")
+
+    print(pd.DataFrame({"datasets": plan_df.sum()}).to_string())
+    print("{0:,} of {1:,} datasets to rerun, written to {2}".format(len(plan_df.index), len(read_doi_lists(args.dois)), args.output))
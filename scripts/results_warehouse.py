@@ -0,0 +1,333 @@
+import os
+import re
+import json
+import sqlite3
+import argparse
+
+from glob import glob
+
+import numpy as np
+import pandas as pd
+
+from helper_functions import normalize_dois, read_doi_lists, create_script_id_v
+from raas_reports import decode_raas_db
+from stage_graph import sha256_file
+from sql_pushdown import sql_string
+
+SCHEMA = '''
+CREATE TABLE warehouse (
+    key TEXT PRIMARY KEY NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE TABLE runs (
+    run_id INTEGER PRIMARY KEY NOT NULL,
+    campaign TEXT NOT NULL,
+    vm TEXT,
+    run TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    run_time REAL NOT NULL,
+    source TEXT NOT NULL UNIQUE,
+    source_hash TEXT NOT NULL
+);
+CREATE TABLE datasets (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    seq INTEGER NOT NULL,
+    campaign TEXT NOT NULL,
+    doi TEXT NOT NULL,
+    build_time REAL,
+    clean INTEGER NOT NULL,
+    num_scripts INTEGER NOT NULL,
+    timed_out_scripts INTEGER NOT NULL,
+    success_scripts INTEGER NOT NULL,
+    UNIQUE (run_id, seq)
+);
+CREATE TABLE scripts (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    seq INTEGER NOT NULL,
+    report_seq INTEGER NOT NULL,
+    campaign TEXT NOT NULL,
+    doi TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    script_id TEXT NOT NULL,
+    error TEXT NOT NULL,
+    UNIQUE (run_id, seq)
+);
+CREATE TABLE timeouts (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    campaign TEXT NOT NULL,
+    doi TEXT NOT NULL,
+    UNIQUE (run_id, doi)
+);
+CREATE INDEX datasets_campaign ON datasets (campaign, doi);
+CREATE INDEX scripts_doi ON scripts (doi);
+CREATE INDEX timeouts_campaign ON timeouts (campaign, doi);
+CREATE INDEX scripts_script_id ON scripts (script_id);
+CREATE INDEX scripts_report ON scripts (run_id, report_seq);
+'''
+
+# The warehouse keeps every result it loads. When a DOI has results from several runs, the one
+# read is chosen when reading: "first" keeps the result loaded first, "latest" the result of the
+# latest run (reruns after original runs, then by run time) and "best" the result with the most
+# successful scripts, the latest of those if there is a tie. Each is the order of a window over the
+# results of a DOI whose first row is kept, so one sort of the rows resolves every DOI at once.
+DATASET_ORDER = {"first": "datasets.run_id, datasets.seq",
+                 "latest": "runs.run = 'redo' DESC, runs.run_time DESC, datasets.run_id DESC, datasets.seq DESC",
+                 "best": "datasets.success_scripts DESC, runs.run = 'redo' DESC, runs.run_time DESC, datasets.run_id DESC, datasets.seq DESC"}
+
+# A script listed twice in the kept result of its DOI is resolved the same way
+SCRIPT_ORDER = {"first": "scripts.seq", "latest": "scripts.seq DESC", "best": "scripts.error = 'success' DESC, scripts.seq DESC"}
+
+RESOLUTIONS = list(DATASET_ORDER)
+
+# The same orders for reports read straight from the RaaS databases (see keep_one_report), where
+# report_idx follows the databases' load order and the order of the reports inside each
+REPORT_ORDER = {"first": (["redo", "report_idx"], [True, True]),
+                "latest": (["redo", "run_time", "report_idx"], [False, False, False]),
+                "best": (["success_scripts", "redo", "run_time", "report_idx"], [False, False, False, False])}
+
+class WarehouseSource:
+    '''
+    One file loaded into the warehouse. kind is "results" for a results.db style table of scripts,
+    "reports" for a RaaS app.db of JSON reports and "timeouts" for a list of timed out DOIs. vm is
+    the number a VM file starts with and run is "redo" for the files of a rerun. The run time is
+    when the file was last written: for a file copied from a VM, the modification time on the VM
+    recorded in vm_manifest.json (remote_mtime), which is when the run ended whatever order the
+    copies finished in, and otherwise the modification time of the local file.
+    '''
+    def __init__(self, campaign, kind, path, vm=None, run="original", remote_mtime=None):
+        self.campaign = campaign
+        self.kind = kind
+        self.path = path
+        self.vm = vm
+        self.run = run
+        self.remote_mtime = remote_mtime
+
+    def run_time(self):
+        return(self.remote_mtime if self.remote_mtime is not None else os.path.getmtime(self.path))
+
+def vm_source(campaign, kind, path):
+    name = os.path.basename(path)
+    vm = re.match(r"(\d+)-", name)
+    return(WarehouseSource(campaign, kind, path, vm.group(1) if vm else None, "redo" if "redo" in name else "original"))
+
+# The result files of one campaign in its own directory: results.db style databases, RaaS databases
+# and timeout lists, named the same as in data_dir
+def campaign_sources(campaign, campaign_dir):
+    paths = sorted(glob(os.path.join(campaign_dir, "**", "*"), recursive=True))
+    sources = [vm_source(campaign, "results", path) for path in paths if path.endswith("results.db")]
+    sources = sources + [vm_source(campaign, "reports", path) for path in paths if re.search(r"app[^/]*\.db$", path)]
+    sources = sources + [vm_source(campaign, "timeouts", path) for path in paths if re.search(r"timeout-dois[^/]*\.txt$", path)]
+    return(sorted(sources, key=lambda source: (source.kind != "results", source.kind, source.run != "original", source.path)))
+
+# Modification time on the VM of every file get_data_from_vms.py copied, by absolute local path. The
+# manifest's paths are relative to the scripts directory both tools run from.
+def vm_remote_mtimes(manifest_path):
+    if not os.path.exists(manifest_path):
+        return({})
+    with open(manifest_path, "r") as manifest_file:
+        manifest = json.load(manifest_file)
+    return({os.path.abspath(local_path): float(entry["mtime"]) for local_path, entry in manifest.items() if "mtime" in entry})
+
+# Keep one report per DOI from the reports decoded by raas_reports.ingest_raas_dbs, by the same rules
+# the warehouse uses for a resolution, and the scripts of the reports kept. sources are the
+# WarehouseSource of each database read, in the order they were read, as given by raas_sources.
+# The reports stay in the order they were read.
+def keep_one_report(reports_df, scripts_df, sources, resolution="first"):
+    db_idx = reports_df["db_idx"].to_numpy()
+    reports_df = reports_df.drop(columns="db_idx").reset_index(drop=True)
+    success_scripts = np.bincount(scripts_df["report_idx"], weights=(scripts_df["raas_error"] == "success").to_numpy(), minlength=len(reports_df.index))
+    keys_df = pd.DataFrame({"doi": reports_df["doi"], "report_idx": reports_df["report_idx"],
+                            "redo": np.array([source.run == "redo" for source in sources], dtype=bool)[db_idx],
+                            "run_time": np.array([source.run_time() for source in sources], dtype=float)[db_idx],
+                            "success_scripts": success_scripts[reports_df["report_idx"].to_numpy()]})
+    by, ascending = REPORT_ORDER[resolution]
+    kept = keys_df.sort_values(by, ascending=ascending, kind="stable").drop_duplicates("doi").index.sort_values()
+    reports_df = reports_df.loc[kept]
+    return(reports_df, scripts_df[scripts_df["report_idx"].isin(reports_df["report_idx"])])
+
+# Each VM's RaaS database and timeout list under data_dir, in the order they are loaded: databases
+# before timeout lists, each sorted by path with reruns after the original runs. Both the warehouse
+# and the plain RaaS ingest read them from here, so both see the same files in the same order.
+def raas_sources(data_dir="../data"):
+    raas_dbs = [y for x in os.walk(os.path.join(data_dir, "raas_dbs")) for y in glob(os.path.join(x[0], "*app*.db"))]
+    timeout_lists = [y for x in os.walk(os.path.join(data_dir, "raas_timeouts")) for y in glob(os.path.join(x[0], "*timeout-dois*.txt"))]
+    sources = [vm_source("raas", "reports", path) for path in raas_dbs] + [vm_source("raas", "timeouts", path) for path in timeout_lists]
+    sources = sorted(sources, key=lambda source: (source.kind, source.run != "original", source.path))
+    remote_mtimes = vm_remote_mtimes(os.path.join(data_dir, "vm_manifest.json"))
+    for source in sources:
+        source.remote_mtime = remote_mtimes.get(os.path.abspath(source.path))
+    return(sources)
+
+# Every result file under data_dir, in the order they are loaded: results.db, timed_results.db,
+# then the RaaS sources. Each directory under data_dir/campaigns holds one more campaign, named
+# after the directory.
+def discover_sources(data_dir="../data"):
+    sources = [WarehouseSource("no raas", "results", os.path.join(data_dir, "results.db")),
+               WarehouseSource("no raas", "timeouts", os.path.join(data_dir, "no_raas_timeouts.txt")),
+               WarehouseSource("timed", "results", os.path.join(data_dir, "timed_results.db"))]
+    campaign_dirs = sorted(glob(os.path.join(data_dir, "campaigns", "*", "")))
+    campaign_sources_list = [source for campaign_dir in campaign_dirs for source in campaign_sources(os.path.basename(os.path.dirname(campaign_dir)), campaign_dir)]
+    remote_mtimes = vm_remote_mtimes(os.path.join(data_dir, "vm_manifest.json"))
+    sources = [source for source in sources + raas_sources(data_dir) + campaign_sources_list if os.path.exists(source.path)]
+    for source in sources:
+        source.remote_mtime = remote_mtimes.get(os.path.abspath(source.path))
+    return(sources)
+
+# The DOI of a script from the "doi-10.7910-DVN-XXXXXX" directory in its path
+def dois_from_script_paths(paths):
+    dirs = pd.Series(np.asarray(paths, dtype=object)).str.extract(r"(?:^|/)(doi-[^/]+)/", expand=False)
+    return(normalize_dois(dirs))
+
+class WarehouseLoader:
+    '''
+    Loads result files into one SQLite warehouse, one source at a time in a fixed order. Every
+    result is kept with the campaign, VM and time of the run it came from. A result is one
+    evaluation of one DOI: a RaaS report, or the scripts of a DOI in a results.db style table,
+    which get a dataset row of their own so both kinds of result are resolved the same way.
+    '''
+    def __init__(self, con):
+        self.con = con
+
+    def add_run(self, source):
+        cursor = self.con.execute("INSERT INTO runs (campaign, vm, run, kind, run_time, source, source_hash) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                  (source.campaign, source.vm, source.run, source.kind, source.run_time(), source.path, sha256_file(source.path)))
+        return(cursor.lastrowid)
+
+    def insert_datasets(self, run_id, campaign, datasets_df, success_scripts):
+        self.con.executemany("INSERT INTO datasets (run_id, seq, campaign, doi, build_time, clean, num_scripts, timed_out_scripts, success_scripts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             zip([run_id] * len(datasets_df.index), range(len(datasets_df.index)), [campaign] * len(datasets_df.index), datasets_df["doi"],
+                                 datasets_df["raas_time"].astype(float), datasets_df["raas_clean"].astype(int),
+                                 datasets_df["raas_num_scripts"].astype(int), datasets_df["raas_timed_out_scripts"].astype(int), success_scripts.astype(int)))
+
+    def load(self, source):
+        run_id = self.add_run(source)
+        if source.kind == "results":
+            self.load_results(run_id, source)
+        elif source.kind == "reports":
+            self.load_reports(run_id, source)
+        else:
+            self.load_timeouts(run_id, source)
+
+    def load_results(self, run_id, source):
+        results_con = sqlite3.connect(source.path)
+        results_df = pd.read_sql_query("SELECT filename, error FROM results ORDER BY ID", results_con)
+        results_con.close()
+        dois = dois_from_script_paths(results_df["filename"])
+        # One result per DOI, numbered in the order DOIs first appear
+        report_seq, result_dois = pd.factorize(dois)
+        num_scripts = np.bincount(report_seq, minlength=len(result_dois))
+        success_scripts = np.bincount(report_seq, weights=(results_df["error"] == "success").to_numpy(), minlength=len(result_dois))
+        datasets_df = pd.DataFrame({"doi": result_dois, "raas_time": np.nan, "raas_clean": num_scripts == success_scripts,
+                                    "raas_num_scripts": num_scripts, "raas_timed_out_scripts": 0})
+        self.insert_datasets(run_id, source.campaign, datasets_df, success_scripts)
+        self.con.executemany("INSERT INTO scripts (run_id, seq, report_seq, campaign, doi, filename, script_id, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             zip([run_id] * len(dois), range(len(dois)), report_seq.tolist(), [source.campaign] * len(dois), dois,
+                                 results_df["filename"], create_script_id_v(dois, results_df["filename"].to_numpy()), results_df["error"]))
+
+    def load_reports(self, run_id, source):
+        datasets_df, scripts_df = decode_raas_db(source.path)
+        success_scripts = np.bincount(scripts_df["report_idx"], weights=(scripts_df["raas_error"] == "success").to_numpy(), minlength=len(datasets_df.index))
+        self.insert_datasets(run_id, source.campaign, datasets_df, success_scripts)
+        self.con.executemany("INSERT INTO scripts (run_id, seq, report_seq, campaign, doi, filename, script_id, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             zip([run_id] * len(scripts_df.index), scripts_df.index.tolist(), scripts_df["report_idx"].tolist(), [source.campaign] * len(scripts_df.index),
+                                 scripts_df["doi"], scripts_df["filename"], scripts_df["unique_id"], scripts_df["raas_error"].astype(object)))
+
+    def load_timeouts(self, run_id, source):
+        dois = read_doi_lists([source.path])
+        self.con.executemany("INSERT OR IGNORE INTO timeouts (run_id, campaign, doi) VALUES (?, ?, ?)",
+                             [(run_id, source.campaign, doi) for doi in dois])
+
+# What a warehouse is built from: every source with its content hash
+def warehouse_manifest(sources):
+    return({"sources": [[source.campaign, source.kind, source.path, sha256_file(source.path), source.run_time()] for source in sources]})
+
+def read_manifest(path):
+    if not os.path.exists(path):
+        return(None)
+    con = sqlite3.connect(path)
+    try:
+        row = con.execute("SELECT value FROM warehouse WHERE key = 'manifest'").fetchone()
+    except sqlite3.DatabaseError:
+        row = None
+    con.close()
+    return(None if row is None else json.loads(row[0]))
+
+# Build the warehouse at path from sources, unless it was already built from the same files. The
+# new warehouse is written next to the old one and then replaces it, so a failed build never
+# leaves a half loaded warehouse behind. Returns the manifest.
+def build_warehouse(path, sources):
+    manifest = warehouse_manifest(sources)
+    if read_manifest(path) == manifest:
+        return(manifest)
+    temp_path = path + ".tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    con = sqlite3.connect(temp_path)
+    con.executescript(SCHEMA)
+    loader = WarehouseLoader(con)
+    with con:
+        for source in sources:
+            loader.load(source)
+        con.execute("INSERT INTO warehouse (key, value) VALUES ('manifest', ?)", (json.dumps(manifest),))
+    con.execute("ANALYZE")
+    con.close()
+    os.replace(temp_path, path)
+    return(manifest)
+
+def campaign_list(campaigns):
+    return("(" + ", ".join(sql_string(campaign) for campaign in campaigns) + ")")
+
+# The result kept for each DOI across a set of campaigns, as (run_id, seq) of its dataset row
+def kept_datasets_query(campaigns, resolution="first"):
+    return('''SELECT run_id, seq FROM (SELECT datasets.run_id, datasets.seq, ROW_NUMBER() OVER (PARTITION BY datasets.doi ORDER BY ''' + DATASET_ORDER[resolution] + ''') AS position
+              FROM datasets JOIN runs ON runs.run_id = datasets.run_id WHERE datasets.campaign IN ''' + campaign_list(campaigns) + ''') WHERE position = 1''')
+
+# The scripts of the kept results, once per script, as (run_id, seq) of their script row
+def kept_scripts_query(campaigns, resolution="first"):
+    return('''SELECT run_id, seq FROM (SELECT scripts.run_id, scripts.seq, ROW_NUMBER() OVER (PARTITION BY scripts.doi, scripts.filename ORDER BY ''' + SCRIPT_ORDER[resolution] + ''') AS position
+              FROM scripts JOIN (''' + kept_datasets_query(campaigns, resolution) + ''') AS kept ON kept.run_id = scripts.run_id AND kept.seq = scripts.report_seq)
+              WHERE position = 1''')
+
+# Query returning the filename, error and DOI of every script kept from a set of campaigns in load order
+def campaign_scripts_query(campaigns, resolution="first"):
+    return('''SELECT scripts.filename, scripts.error, scripts.doi FROM scripts JOIN (''' + kept_scripts_query(campaigns, resolution) + ''') AS kept
+              ON kept.run_id = scripts.run_id AND kept.seq = scripts.seq ORDER BY scripts.run_id, scripts.seq''')
+
+# The results kept from a set of campaigns in the format of raas_reports.ingest_raas_dbs, with
+# report_idx numbering them in load order. Results of results.db style campaigns have no build time.
+def campaign_reports(con, campaigns, resolution="first"):
+    datasets_df = pd.read_sql_query('''SELECT doi, build_time AS raas_time, clean AS raas_clean, num_scripts AS raas_num_scripts,
+                                       timed_out_scripts AS raas_timed_out_scripts, datasets.run_id, datasets.seq FROM datasets
+                                       JOIN (''' + kept_datasets_query(campaigns, resolution) + ''') AS kept ON kept.run_id = datasets.run_id AND kept.seq = datasets.seq
+                                       ORDER BY datasets.run_id, datasets.seq''', con)
+    datasets_df["raas_clean"] = datasets_df["raas_clean"].astype(bool)
+    datasets_df["report_idx"] = np.arange(len(datasets_df.index))
+    scripts_df = pd.read_sql_query('''SELECT scripts.run_id, report_seq AS seq, doi, script_id AS unique_id, filename, error AS raas_error FROM scripts
+                                      JOIN (''' + kept_scripts_query(campaigns, resolution) + ''') AS kept ON kept.run_id = scripts.run_id AND kept.seq = scripts.seq
+                                      ORDER BY scripts.run_id, scripts.seq''', con)
+    scripts_df = scripts_df.merge(datasets_df[["run_id", "seq", "report_idx"]], on=["run_id", "seq"])
+    scripts_df["script_name"] = scripts_df["filename"].map(lambda filename: os.path.basename(filename).lower())
+    scripts_df["raas_error"] = pd.Categorical(scripts_df["raas_error"].to_numpy())
+    scripts_df = scripts_df[["report_idx", "doi", "unique_id", "script_name", "raas_error", "filename"]]
+    return(datasets_df.drop(columns=["run_id", "seq"]), scripts_df)
+
+# Every DOI timed out in a set of campaigns, in the order they were first listed
+def campaign_timeouts(con, campaigns):
+    return(pd.Index([row[0] for row in con.execute("SELECT doi FROM timeouts WHERE campaign IN " + campaign_list(campaigns) + " GROUP BY doi ORDER BY MIN(rowid)")]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', default="../data")
+    parser.add_argument('--output', default="../data/warehouse.db")
+    args = parser.parse_args()
+
+    build_warehouse(args.output, discover_sources(args.data))
+    con = sqlite3.connect(args.output)
+    print(pd.read_sql_query('''SELECT runs.campaign, COUNT(DISTINCT runs.run_id) AS files, COUNT(DISTINCT runs.vm) AS vms,
+                               datetime(MIN(runs.run_time), 'unixepoch') AS first_run, datetime(MAX(runs.run_time), 'unixepoch') AS last_run,
+                               (SELECT COUNT(*) FROM datasets WHERE datasets.campaign = runs.campaign) AS results,
+                               (SELECT COUNT(DISTINCT doi) FROM datasets WHERE datasets.campaign = runs.campaign) AS datasets,
+                               (SELECT COUNT(*) FROM scripts WHERE scripts.campaign = runs.campaign) AS scripts,
+                               (SELECT COUNT(DISTINCT doi) FROM timeouts WHERE timeouts.campaign = runs.campaign) AS timeouts
+                               FROM runs GROUP BY runs.campaign ORDER BY MIN(runs.run_id)''', con).to_string(index=False))
+    con.close()
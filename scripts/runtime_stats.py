@@ -0,0 +1,196 @@
+import numpy as np
+import pandas as pd
+
+# Longest a dataset is allowed to run before it is stopped, in seconds
+TIMEOUT_SECONDS = 18000
+
+# Runtimes of each condition are the columns <prefix>_time and <prefix>_timed_out of a dataset frame
+CONDITIONS = {"control": "nr", "treatment": "raas"}
+
+class QuantileSketch:
+    '''
+    Mergeable quantile sketch of non-negative values with a relative error bound. Every value is
+    counted in a logarithmic bin whose bounds are a factor gamma apart, so a quantile read from
+    the bins is within relative_accuracy of the exact one however many values were added, and the
+    memory used grows with the range of the values, not their number. Values below min_value
+    (zero runtimes) are counted apart. Sketches with the same accuracy merge by adding their bin
+    counts, and to_dict gives a JSON-friendly copy, so partial sketches can be built where the
+    values are and combined later.
+    '''
+    def __init__(self, relative_accuracy=0.01, min_value=1e-3):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = np.log(self.gamma)
+        self.offset = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    # Add the bin counts of bins offset, offset + 1, ... to this sketch's, growing its bins to fit
+    def add_bins(self, offset, counts):
+        if len(counts) == 0:
+            return
+        if len(self.counts) == 0:
+            self.offset = offset
+            self.counts = np.asarray(counts, dtype=np.int64).copy()
+            return
+        low = min(self.offset, offset)
+        high = max(self.offset + len(self.counts), offset + len(counts))
+        merged = np.zeros(high - low, dtype=np.int64)
+        merged[self.offset - low:self.offset - low + len(self.counts)] += self.counts
+        merged[offset - low:offset - low + len(counts)] += counts
+        self.offset = low
+        self.counts = merged
+
+    # Count an array of values; NaN values are skipped
+    def add(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return(self)
+        small = values < self.min_value
+        bins = np.ceil(np.log(values[~small]) / self.log_gamma).astype(np.int64)
+        if len(bins) > 0:
+            self.add_bins(int(bins.min()), np.bincount(bins - bins.min()))
+        self.zero_count += int(small.sum())
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        return(self)
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy or other.min_value != self.min_value:
+            raise ValueError("only sketches with the same accuracy can be merged")
+        self.add_bins(other.offset, other.counts)
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return(self)
+
+    # The values at quantiles q (a number or an array of numbers between 0 and 1), NaN if empty
+    def quantile(self, q):
+        q = np.asarray(q, dtype=float)
+        if self.count == 0:
+            return(np.full(q.shape, np.nan)[()])
+        ranks = q * (self.count - 1)
+        bins = np.searchsorted(np.cumsum(self.counts), ranks - self.zero_count, side="right")
+        values = 2 * self.gamma ** (self.offset + bins.astype(float)) / (self.gamma + 1)
+        values = np.where(ranks < self.zero_count, 0.0, values)
+        return(np.clip(values, self.min, self.max)[()])
+
+    def mean(self):
+        return(self.total / self.count if self.count > 0 else np.nan)
+
+    def to_dict(self):
+        return({"relative_accuracy": self.relative_accuracy, "min_value": self.min_value, "offset": self.offset,
+                "counts": self.counts.tolist(), "zero_count": self.zero_count, "count": self.count,
+                "total": self.total, "min": self.min, "max": self.max})
+
+    @classmethod
+    def from_dict(cls, values):
+        sketch = cls(values["relative_accuracy"], values["min_value"])
+        sketch.add_bins(values["offset"], np.array(values["counts"], dtype=np.int64))
+        sketch.zero_count = values["zero_count"]
+        sketch.count = values["count"]
+        sketch.total = values["total"]
+        sketch.min = values["min"]
+        sketch.max = values["max"]
+        return(sketch)
+
+class RuntimeSummary:
+    '''
+    Runtime statistics of the datasets of any campaigns, gathered in one pass over frames of
+    datasets (all of them at once, in chunks, or one frame per VM): a sketch of the runtimes of
+    each condition, where datasets that timed out count as the timeout cap, the number of datasets
+    at the cap, and sketches of the overhead ratio (runtime with RaaS over runtime without) of the
+    datasets that completed under both, overall, by subject and by year. Summaries merge, so
+    partial summaries can be combined without the runtimes they were built from.
+    '''
+    def __init__(self, relative_accuracy=0.01, cap=TIMEOUT_SECONDS):
+        self.relative_accuracy = relative_accuracy
+        self.cap = cap
+        self.runtimes = {condition: QuantileSketch(relative_accuracy) for condition in CONDITIONS}
+        self.capped = {condition: 0 for condition in CONDITIONS}
+        self.ratios = QuantileSketch(relative_accuracy)
+        self.ratios_by_subject = {}
+        self.ratios_by_year = {}
+
+    def add_grouped(self, sketches, ratios, groups):
+        for group, group_ratios in pd.Series(ratios).groupby(np.asarray(groups)):
+            sketches.setdefault(group, QuantileSketch(self.relative_accuracy)).add(group_ratios.to_numpy())
+
+    # Add a frame of datasets with the runtime columns of CONDITIONS, a year and a subjects mask
+    def add(self, datasets_df, subject_table):
+        completed = np.ones(len(datasets_df.index), dtype=bool)
+        runtimes = {}
+        for condition, prefix in CONDITIONS.items():
+            timed_out = datasets_df[prefix + "_timed_out"].fillna(False).to_numpy(dtype=bool)
+            times = datasets_df[prefix + "_time"].to_numpy(dtype=float)
+            times = np.where(timed_out, float(self.cap), np.minimum(times, self.cap))
+            self.runtimes[condition].add(times)
+            self.capped[condition] += int((times >= self.cap).sum())
+            completed &= ~np.isnan(times) & (times < self.cap)
+            runtimes[condition] = times
+
+        completed &= runtimes["control"] > 0
+        ratios = runtimes["treatment"][completed] / runtimes["control"][completed]
+        self.ratios.add(ratios)
+        years = datasets_df["year"].to_numpy()[completed]
+        known_year = ~pd.isna(years)
+        self.add_grouped(self.ratios_by_year, ratios[known_year], years[known_year].astype(int))
+        positions, subjects = subject_table.memberships(datasets_df["subjects"].to_numpy()[completed])
+        self.add_grouped(self.ratios_by_subject, ratios[positions], subjects)
+        return(self)
+
+    def merge(self, other):
+        for condition in CONDITIONS:
+            self.runtimes[condition].merge(other.runtimes[condition])
+            self.capped[condition] += other.capped[condition]
+        self.ratios.merge(other.ratios)
+        for mine, theirs in [(self.ratios_by_subject, other.ratios_by_subject), (self.ratios_by_year, other.ratios_by_year)]:
+            for group, sketch in theirs.items():
+                mine.setdefault(group, QuantileSketch(self.relative_accuracy)).merge(sketch)
+        return(self)
+
+    # Share of the datasets of a condition that ran into the timeout cap
+    def cap_share(self, condition):
+        count = self.runtimes[condition].count
+        return(self.capped[condition] / count if count > 0 else np.nan)
+
+    # Datasets and the overhead ratio quantiles of every group of one breakdown
+    def ratio_table(self, by, quantiles=(0.5, 0.9, 0.99)):
+        sketches = self.ratios_by_subject if by == "subject" else self.ratios_by_year
+        rows = {group: [sketch.count] + list(sketch.quantile(list(quantiles))) for group, sketch in sorted(sketches.items())}
+        columns = ["datasets"] + ["p{0:g}".format(q * 100) for q in quantiles]
+        return(pd.DataFrame.from_dict(rows, orient="index", columns=columns).rename_axis(by))
+
+    def to_dict(self):
+        return({"relative_accuracy": self.relative_accuracy, "cap": self.cap,
+                "runtimes": {condition: sketch.to_dict() for condition, sketch in self.runtimes.items()},
+                "capped": self.capped, "ratios": self.ratios.to_dict(),
+                "ratios_by_subject": {subject: sketch.to_dict() for subject, sketch in self.ratios_by_subject.items()},
+                "ratios_by_year": {str(year): sketch.to_dict() for year, sketch in self.ratios_by_year.items()}})
+
+    @classmethod
+    def from_dict(cls, values):
+        summary = cls(values["relative_accuracy"], values["cap"])
+        summary.runtimes = {condition: QuantileSketch.from_dict(sketch) for condition, sketch in values["runtimes"].items()}
+        summary.capped = dict(values["capped"])
+        summary.ratios = QuantileSketch.from_dict(values["ratios"])
+        summary.ratios_by_subject = {subject: QuantileSketch.from_dict(sketch) for subject, sketch in values["ratios_by_subject"].items()}
+        summary.ratios_by_year = {int(year): QuantileSketch.from_dict(sketch) for year, sketch in values["ratios_by_year"].items()}
+        return(summary)
+
+# Summarize the runtimes in an iterable of dataset frames in one pass
+def summarize_runtimes(frames, subject_table, relative_accuracy=0.01, cap=TIMEOUT_SECONDS):
+    summary = RuntimeSummary(relative_accuracy, cap)
+    for datasets_df in frames:
+        summary.add(datasets_df, subject_table)
+    return(summary)
@@ -0,0 +1,77 @@
+import argparse
+import sqlite3
+
+import pandas as pd
+
+from error_classifier import ERROR_RULES, EXACT_ERRORS, DEFAULT_CATEGORY
+from helper_functions import get_doi_from_results_filename
+
+# Table of script counts by DOI and error category that can be stored next to the results table
+SUMMARY_TABLE = "results_summary"
+SUMMARY_SOURCE_TABLE = "results_summary_source"
+
+def sql_string(value):
+    return("'" + value.replace("'", "''") + "'")
+
+# A SQL CASE expression that categorizes the error messages in `column` with the same rules, in the
+# same order, as error_classifier.ErrorClassifier. Phrases are matched with instr, so the messages
+# are categorized inside SQLite without a call back into Python per row.
+def error_category_sql(column="error", rules=ERROR_RULES, exact=EXACT_ERRORS, default=DEFAULT_CATEGORY):
+    cases = []
+    for message, category in exact.items():
+        cases.append("WHEN " + column + " = " + sql_string(message) + " THEN " + sql_string(category))
+    for category, required, forbidden in rules:
+        conditions = ["instr(" + column + ", " + sql_string(phrase) + ") > 0" for phrase in required]
+        conditions = conditions + ["instr(" + column + ", " + sql_string(phrase) + ") = 0" for phrase in forbidden]
+        cases.append("WHEN " + " AND ".join(conditions) + " THEN " + sql_string(category))
+    return("CASE " + " ".join(cases) + " ELSE " + sql_string(default) + " END")
+
+# Make the DOI parser for results.db filenames callable from SQL as results_doi(filename)
+def register_functions(con):
+    con.create_function("results_doi", 1, get_doi_from_results_filename, deterministic=True)
+
+def summary_query():
+    return('''SELECT results_doi(filename) AS doi, ''' + error_category_sql("error") + ''' AS category, COUNT(*) AS scripts
+              FROM results GROUP BY doi, category ORDER BY doi, category''')
+
+# Number of rows and largest ID of the results table, to tell whether a stored summary is stale
+def results_source(con):
+    return(con.execute("SELECT COUNT(*), MAX(ID) FROM results").fetchone())
+
+# Store the counts by DOI and category as SUMMARY_TABLE, indexed by category, along with the state
+# of the results table they were counted from
+def materialize_summary(con):
+    register_functions(con)
+    rows, max_id = results_source(con)
+    with con:
+        con.execute("DROP TABLE IF EXISTS " + SUMMARY_TABLE)
+        con.execute("CREATE TABLE " + SUMMARY_TABLE + " (doi TEXT NOT NULL, category TEXT NOT NULL, scripts INTEGER NOT NULL, PRIMARY KEY (doi, category))")
+        con.execute("INSERT INTO " + SUMMARY_TABLE + " " + summary_query())
+        con.execute("CREATE INDEX " + SUMMARY_TABLE + "_category ON " + SUMMARY_TABLE + " (category)")
+        con.execute("CREATE TABLE IF NOT EXISTS " + SUMMARY_SOURCE_TABLE + " (rows INTEGER, max_id INTEGER)")
+        con.execute("DELETE FROM " + SUMMARY_SOURCE_TABLE)
+        con.execute("INSERT INTO " + SUMMARY_SOURCE_TABLE + " VALUES (?, ?)", (rows, max_id))
+
+def summary_is_current(con):
+    tables = [row[0] for row in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    if SUMMARY_TABLE not in tables or SUMMARY_SOURCE_TABLE not in tables:
+        return(False)
+    return(con.execute("SELECT rows, max_id FROM " + SUMMARY_SOURCE_TABLE).fetchone() == results_source(con))
+
+# Script counts by DOI and error category of a results database, grouped inside SQLite so only
+# the counts are read into pandas. A stored summary is used when it is up to date.
+def category_counts(con):
+    if summary_is_current(con):
+        return(pd.read_sql_query("SELECT doi, category, scripts FROM " + SUMMARY_TABLE + " ORDER BY doi, category", con))
+    register_functions(con)
+    return(pd.read_sql_query(summary_query(), con))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default="../data/results.db")
+    args = parser.parse_args()
+
+    con = sqlite3.connect(args.db)
+    materialize_summary(con)
+    print(pd.read_sql_query("SELECT category, SUM(scripts) AS scripts, COUNT(*) AS datasets FROM " + SUMMARY_TABLE + " GROUP BY category", con).to_string(index=False))
+    con.close()
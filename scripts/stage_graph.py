@@ -0,0 +1,354 @@
+import os
+import json
+import time
+import types
+import hashlib
+import inspect
+import traceback
+import multiprocessing
+
+from multiprocessing.connection import wait
+
+from frame_cache import dump_object, load_object
+
+STATE_DIR = "../data/stages"
+
+# Stored objects are written by frame_cache.dump_object; .pkl is what older versions wrote
+OBJECT_EXTENSION = ".frame"
+
+class StageError(Exception):
+    pass
+
+class Stage:
+    '''
+    One named step of the analysis. Its inputs are the objects named by the parameters of func,
+    its outputs are the names of the objects func returns (a single object, or a tuple in the same
+    order), files are the files it reads and writes are the files it creates.
+    '''
+    def __init__(self, name, func, outputs, files, writes):
+        self.name = name
+        self.func = func
+        self.inputs = list(inspect.signature(func).parameters)
+        self.outputs = list(outputs)
+        self.files = list(files)
+        self.writes = list(writes)
+
+def sha256_file(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as source_file:
+        for block in iter(lambda: source_file.read(block_size), b""):
+            digest.update(block)
+    return(digest.hexdigest())
+
+# Summarize a function's code without its file name or line numbers, which change between
+# notebook sessions and whenever an earlier cell is edited
+def fingerprint_code(code, digest):
+    digest.update(code.co_code)
+    digest.update(repr((code.co_names, code.co_varnames)).encode())
+    for const in code.co_consts:
+        if hasattr(const, "co_code"):
+            fingerprint_code(const, digest)
+        else:
+            digest.update(repr(const).encode())
+
+def write_atomic(path, data):
+    temp_path = path + "." + str(os.getpid()) + ".tmp"
+    with open(temp_path, "wb") as out_file:
+        out_file.write(data)
+    os.replace(temp_path, path)
+
+class FileHasher:
+    '''
+    Content hashes of files, remembered by path, size and modification time so a large file
+    that has not been touched is not read again. A directory hashes to the names and hashes of
+    every file inside it.
+    '''
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.cache = {}
+        if os.path.exists(cache_path):
+            with open(cache_path, "r") as cache_file:
+                self.cache = json.load(cache_file)
+
+    def hash_file(self, path):
+        stat = os.stat(path)
+        cached = self.cache.get(path)
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return(cached[2])
+        content_hash = sha256_file(path)
+        self.cache[path] = [stat.st_size, stat.st_mtime_ns, content_hash]
+        return(content_hash)
+
+    def hash(self, path):
+        if os.path.isdir(path):
+            digest = hashlib.sha256()
+            for dir_path, _, filenames in sorted(os.walk(path)):
+                for filename in sorted(filenames):
+                    file_path = os.path.join(dir_path, filename)
+                    digest.update((os.path.relpath(file_path, path) + "\0" + self.hash_file(file_path) + "\n").encode())
+            return(digest.hexdigest())
+        if os.path.exists(path):
+            return(self.hash_file(path))
+        return("missing")
+
+    def save(self):
+        write_atomic(self.cache_path, json.dumps(self.cache).encode())
+
+# Every global name used by a code object, including inside nested functions and comprehensions
+def global_names(code):
+    names = list(code.co_names)
+    for const in code.co_consts:
+        if hasattr(const, "co_code"):
+            names.extend(global_names(const))
+    return(names)
+
+# Fingerprint a stage function together with the functions and plain values it uses from its own
+# module, so editing a helper defined in another notebook cell invalidates every stage calling it.
+# Code imported from other modules is covered by listing those files as dependencies.
+def fingerprint_function(func, digest, seen):
+    if func in seen:
+        return
+    seen.add(func)
+    fingerprint_code(func.__code__, digest)
+    for name in sorted(set(global_names(func.__code__))):
+        value = func.__globals__.get(name)
+        if isinstance(value, types.FunctionType) and value.__module__ == func.__module__:
+            digest.update(name.encode())
+            fingerprint_function(value, digest, seen)
+        elif isinstance(value, (str, int, float, bool, tuple, list, dict)):
+            digest.update((name + "=" + repr(value)).encode())
+
+def execute_stage(stage, key, input_paths, state_dir):
+    start = time.time()
+    kwargs = {}
+    for name, path in input_paths.items():
+        kwargs[name] = load_object(path)
+    result = stage.func(**kwargs)
+
+    if len(stage.outputs) == 1:
+        result = (result,)
+    elif len(stage.outputs) == 0:
+        result = ()
+    if not isinstance(result, tuple) or len(result) != len(stage.outputs):
+        raise StageError(stage.name + " must return " + str(len(stage.outputs)) + " objects: " + ", ".join(stage.outputs))
+
+    # Objects are stored under the hash of their stored form, so a stage that reruns but produces
+    # the same objects does not invalidate the stages that use them
+    outputs = {}
+    for name, value in zip(stage.outputs, result):
+        data = dump_object(value)
+        object_hash = hashlib.sha256(data).hexdigest()
+        object_path = os.path.join(state_dir, "objects", object_hash + OBJECT_EXTENSION)
+        if not os.path.exists(object_path):
+            write_atomic(object_path, data)
+        outputs[name] = object_hash
+
+    writes = {}
+    for path in stage.writes:
+        if not os.path.exists(path):
+            raise StageError(stage.name + " did not write " + path)
+        writes[path] = sha256_file(path)
+
+    record = {"key": key, "outputs": outputs, "writes": writes, "seconds": time.time() - start}
+    write_atomic(os.path.join(state_dir, "records", stage.name + ".json"), json.dumps(record, indent=1).encode())
+    return(record)
+
+class StageGraph:
+    '''
+    Runs the analysis as a graph of named stages. A stage is rerun only when its key changes: the
+    key covers the stage's code, the content of the files it reads and the content of the objects
+    it takes from earlier stages. Objects passed between stages are stored in state_dir in the
+    columnar layout of frame_cache.py, so any stage can run on its own and the unchanged frames it
+    reads load in milliseconds. Stages that do not depend on each other run in parallel, each in
+    a forked process so plotting state never leaks from one stage into another.
+    '''
+    def __init__(self, state_dir=STATE_DIR, files=()):
+        self.state_dir = state_dir
+        self.files = list(files)
+        self.stages = []
+        self.producers = {}
+        self.writers = {}
+
+    # Decorator registering a function as a stage. Stages have to be declared after the stages
+    # producing their inputs, which keeps the graph acyclic.
+    def stage(self, outputs=(), files=(), writes=(), name=None):
+        def register(func):
+            stage = Stage(name or func.__name__, func, outputs, files, writes)
+            # Running a notebook cell again replaces the stage it declared before
+            for existing in [existing for existing in self.stages if existing.name == stage.name]:
+                self.stages.remove(existing)
+                self.producers = {output: producer for output, producer in self.producers.items() if producer != existing.name}
+                self.writers = {path: writer for path, writer in self.writers.items() if writer != existing.name}
+            for input_name in stage.inputs:
+                if input_name not in self.producers:
+                    raise StageError(stage.name + " uses " + input_name + ", which no earlier stage produces")
+            for output in stage.outputs:
+                if output in self.producers:
+                    raise StageError(output + " is produced by both " + self.producers[output] + " and " + stage.name)
+                self.producers[output] = stage.name
+            for path in stage.writes:
+                if path in self.writers:
+                    raise StageError(path + " is written by both " + self.writers[path] + " and " + stage.name)
+                self.writers[path] = stage.name
+            self.stages.append(stage)
+            return(func)
+        return(register)
+
+    def get_stage(self, name):
+        for stage in self.stages:
+            if stage.name == name:
+                return(stage)
+        raise StageError("unknown stage " + name)
+
+    # The named stages and every stage they depend on, in declaration order
+    def select(self, targets=None):
+        if not targets:
+            return(list(self.stages))
+        needed = set()
+        todo = [self.get_stage(target) for target in targets]
+        while todo:
+            stage = todo.pop()
+            if stage.name not in needed:
+                needed.add(stage.name)
+                todo.extend(self.get_stage(self.producers[input_name]) for input_name in stage.inputs)
+        return([stage for stage in self.stages if stage.name in needed])
+
+    def record_path(self, stage):
+        return(os.path.join(self.state_dir, "records", stage.name + ".json"))
+
+    def object_path(self, object_hash):
+        return(os.path.join(self.state_dir, "objects", object_hash + OBJECT_EXTENSION))
+
+    def load_record(self, stage):
+        if os.path.exists(self.record_path(stage)):
+            with open(self.record_path(stage), "r") as record_file:
+                return(json.load(record_file))
+        return(None)
+
+    def stage_key(self, stage, records, hasher):
+        digest = hashlib.sha256()
+        digest.update(json.dumps([stage.name, stage.outputs, stage.writes]).encode())
+        fingerprint_function(stage.func, digest, set())
+        for path in self.files + stage.files:
+            digest.update((path + "\0" + hasher.hash(path) + "\n").encode())
+        for input_name in stage.inputs:
+            digest.update((input_name + "\0" + records[self.producers[input_name]]["outputs"][input_name] + "\n").encode())
+        return(digest.hexdigest())
+
+    def up_to_date(self, stage, key, record, hasher):
+        if record is None or record["key"] != key:
+            return(False)
+        if any(not os.path.exists(self.object_path(object_hash)) for object_hash in record["outputs"].values()):
+            return(False)
+        return(all(hasher.hash(path) == write_hash for path, write_hash in record["writes"].items()))
+
+    def input_paths(self, stage, records):
+        return({input_name: self.object_path(records[self.producers[input_name]]["outputs"][input_name]) for input_name in stage.inputs})
+
+    # Run the selected stages (all of them by default) that are out of date, up to `workers` at a
+    # time. Raises StageError at the end if any stage failed; stages depending on a failed stage
+    # are not run.
+    def run(self, targets=None, workers=1, force=False, verbose=True):
+        os.makedirs(os.path.join(self.state_dir, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(self.state_dir, "records"), exist_ok=True)
+        hasher = FileHasher(os.path.join(self.state_dir, "file_hashes.json"))
+        context = None
+        if workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+
+        pending = self.select(targets)
+        records = {}
+        status = {}
+        keys = {}
+        running = {}
+        start = time.time()
+
+        def finish(stage, outcome, record=None):
+            status[stage.name] = outcome
+            if record is not None:
+                records[stage.name] = record
+            if verbose and outcome != "up to date":
+                seconds = "" if record is None else " ({0:.1f}s)".format(record["seconds"])
+                print("[stages] " + outcome + " " + stage.name + seconds, flush=True)
+
+        while pending or running:
+            progress = True
+            while progress:
+                progress = False
+                for stage in list(pending):
+                    producers = [self.producers[input_name] for input_name in stage.inputs]
+                    if any(status.get(producer) in ("failed", "skipped") for producer in producers):
+                        pending.remove(stage)
+                        finish(stage, "skipped")
+                        progress = True
+                        continue
+                    if not all(producer in records for producer in producers):
+                        continue
+                    if stage.name not in keys:
+                        keys[stage.name] = self.stage_key(stage, records, hasher)
+                    record = self.load_record(stage)
+                    if not force and self.up_to_date(stage, keys[stage.name], record, hasher):
+                        pending.remove(stage)
+                        finish(stage, "up to date", record)
+                        progress = True
+                    elif context is None:
+                        pending.remove(stage)
+                        try:
+                            finish(stage, "ran", execute_stage(stage, keys[stage.name], self.input_paths(stage, records), self.state_dir))
+                        except Exception:
+                            traceback.print_exc()
+                            finish(stage, "failed")
+                        progress = True
+                    elif len(running) < workers:
+                        pending.remove(stage)
+                        process = context.Process(target=execute_stage, name=stage.name,
+                                                  args=(stage, keys[stage.name], self.input_paths(stage, records), self.state_dir))
+                        process.start()
+                        running[process.sentinel] = (stage, process)
+                        progress = True
+            if not running:
+                break
+            for sentinel in wait(list(running)):
+                stage, process = running.pop(sentinel)
+                process.join()
+                if process.exitcode == 0:
+                    finish(stage, "ran", self.load_record(stage))
+                else:
+                    finish(stage, "failed")
+
+        hasher.save()
+        self.prune()
+        counts = {outcome: list(status.values()).count(outcome) for outcome in ["ran", "up to date", "failed", "skipped"]}
+        if verbose:
+            print("[stages] " + ", ".join(str(count) + " " + outcome for outcome, count in counts.items()) +
+                  " in {0:.1f}s".format(time.time() - start), flush=True)
+        failed = [name for name, outcome in status.items() if outcome == "failed"]
+        if failed:
+            raise StageError("failed stages: " + ", ".join(failed))
+        return(status)
+
+    # Delete stored objects that no stage record refers to anymore
+    def prune(self):
+        records_dir = os.path.join(self.state_dir, "records")
+        used = set()
+        for filename in os.listdir(records_dir):
+            with open(os.path.join(records_dir, filename), "r") as record_file:
+                used.update(json.load(record_file)["outputs"].values())
+        objects_dir = os.path.join(self.state_dir, "objects")
+        for filename in os.listdir(objects_dir):
+            object_hash, extension = os.path.splitext(filename)
+            if extension == ".pkl" or (extension == OBJECT_EXTENSION and object_hash not in used):
+                os.remove(os.path.join(objects_dir, filename))
+
+    # The object most recently produced under this name, e.g. to explore it in the notebook
+    def load(self, name):
+        record = self.load_record(self.get_stage(self.producers[name]))
+        if record is None:
+            raise StageError(name + " has not been produced yet")
+        return(load_object(self.object_path(record["outputs"][name])))
+
+    def describe(self):
+        lines = []
+        for stage in self.stages:
+            lines.append(stage.name + ": " + ", ".join(stage.inputs) + " -> " + ", ".join(stage.outputs + [os.path.basename(path) for path in stage.writes]))
+        return("\n".join(lines))
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+class TransitionMatrices:
+    '''
+    How the error category of each script changed across an ordered sequence of evaluation
+    conditions, e.g. without RaaS, with RaaS, a RaaS rerun. condition_cols maps each condition to
+    the column of scripts_df holding the category of the script under it, and every row is one
+    script under all conditions. Categories are integer coded once over all conditions (compared
+    as strings, so a missing result is its own "nan" category, the same as crosstab on astype(str)),
+    and the scripts moving between two conditions are counted with one np.bincount over
+    from * K + to, so comparing many reruns does not need a crosstab per pair.
+    '''
+    def __init__(self, scripts_df, condition_cols):
+        self.conditions = list(condition_cols)
+        values = [scripts_df[col].astype(str).to_numpy() for col in condition_cols.values()]
+        self.categories, codes = np.unique(np.concatenate(values), return_inverse=True)
+        self.codes = codes.reshape(len(values), -1)
+        self.cache = {}
+
+    def position(self, condition):
+        return(self.conditions.index(condition))
+
+    # Which categories occur under a condition
+    def observed(self, condition):
+        return(np.bincount(self.codes[self.position(condition)], minlength=len(self.categories)) > 0)
+
+    # K x K array of the number of scripts going from each category under source to each category
+    # under target
+    def counts(self, source, target):
+        if (source, target) not in self.cache:
+            k = len(self.categories)
+            pairs = self.codes[self.position(source)] * k + self.codes[self.position(target)]
+            self.cache[(source, target)] = np.bincount(pairs, minlength=k * k).reshape(k, k)
+        return(self.cache[(source, target)])
+
+    # The counts of every consecutive pair of conditions from one bincount, with shape
+    # (number of conditions - 1, K, K)
+    def step_counts(self):
+        k = len(self.categories)
+        steps = len(self.conditions) - 1
+        pairs = np.arange(steps)[:, None] * k * k + self.codes[:-1] * k + self.codes[1:]
+        return(np.bincount(pairs.ravel(), minlength=steps * k * k).reshape(steps, k, k))
+
+    # The counts as a dataframe laid out like pd.crosstab: the categories seen under source as rows
+    # and those seen under target as columns, both sorted
+    def frame(self, source, target, index_name=None, columns_name=None):
+        rows = self.observed(source)
+        columns = self.observed(target)
+        return(pd.DataFrame(self.counts(source, target)[rows][:, columns],
+                            index=pd.Index(self.categories[rows], name=index_name),
+                            columns=pd.Index(self.categories[columns], name=columns_name)))
+
+    # Percent of the scripts of each source category that went to each target category
+    def shares(self, source, target):
+        counts = self.frame(source, target)
+        return(counts / counts.sum(axis=1).to_numpy()[:, None] * 100)
+
+    # Percent of the scripts of each source category that ended up in a different category
+    def changed_shares(self, source, target):
+        counts = self.counts(source, target)
+        totals = counts.sum(axis=1)
+        rows = self.observed(source)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            changed = (totals - np.diagonal(counts)) / totals * 100
+        return(pd.Series(changed[rows], index=self.categories[rows]))
+
+    # The non-zero transitions in row order (source category, then target category) with their
+    # number of scripts, e.g. for the links of a Sankey diagram
+    def flows(self, source, target):
+        counts = self.counts(source, target)
+        sources, targets = np.nonzero(counts)
+        return(pd.DataFrame({"source": self.categories[sources],
+                             "target": self.categories[targets],
+                             "scripts": counts[sources, targets]}))